@@ -85,3 +85,109 @@ class PipelineErrorAdmin(admin.ModelAdmin):
         ('course_id', AllValuesDropdownFilter),
         ('user', RelatedOnlyFieldListFilter),
         'error_type')
+
+
+@admin.register(figures.models.PipelineRun)
+class PipelineRunAdmin(admin.ModelAdmin):
+    """Defines the admin interface for the PipelineRun model
+    """
+    list_display = ('id', 'date_for', 'site', 'status', 'created', 'finished_at')
+    list_filter = (
+        ('site', RelatedOnlyDropdownFilter),
+        'status',
+        'date_for')
+
+
+@admin.register(figures.models.PipelineCourseRun)
+class PipelineCourseRunAdmin(admin.ModelAdmin):
+    """Defines the admin interface for the PipelineCourseRun model
+    """
+    list_display = ('id', 'run', 'course_id', 'status', 'started_at',
+                    'finished_at', 'elapsed_seconds', 'learner_grades_count')
+    list_filter = (
+        ('course_id', AllValuesDropdownFilter),
+        'status')
+
+
+@admin.register(figures.models.CourseDetailsSnapshot)
+class CourseDetailsSnapshotAdmin(admin.ModelAdmin):
+    """Defines the admin interface for the CourseDetailsSnapshot model
+    """
+    list_display = ('id', 'course_id', 'site', 'date_for', 'modified')
+    list_filter = (
+        ('site', RelatedOnlyDropdownFilter),
+        'date_for')
+
+
+@admin.register(figures.models.SiteMonthlyMetrics)
+class SiteMonthlyMetricsAdmin(admin.ModelAdmin):
+    """Defines the admin interface for the SiteMonthlyMetrics model
+    """
+    list_display = ('id', 'month_for', 'site', 'total_user_count',
+                    'total_enrollment_count', 'course_count', 'course_completions')
+    list_filter = (
+        ('site', RelatedOnlyDropdownFilter),
+        'month_for')
+
+
+@admin.register(figures.models.CourseMonthlyMetrics)
+class CourseMonthlyMetricsAdmin(admin.ModelAdmin):
+    """Defines the admin interface for the CourseMonthlyMetrics model
+    """
+    list_display = ('id', 'month_for', 'course_id', 'site', 'enrollment_count',
+                    'average_progress', 'average_days_to_complete',
+                    'num_learners_completed')
+    list_filter = (
+        ('site', RelatedOnlyDropdownFilter),
+        ('course_id', AllValuesDropdownFilter),
+        'month_for')
+
+
+@admin.register(figures.models.SiteDailyActiveUsers)
+class SiteDailyActiveUsersAdmin(admin.ModelAdmin):
+    """Defines the admin interface for the SiteDailyActiveUsers model
+    """
+    list_display = ('id', 'date_for', 'site', 'user_count')
+    list_filter = (
+        ('site', RelatedOnlyDropdownFilter),
+        'date_for')
+    exclude = ('user_ids',)
+
+
+@admin.register(figures.models.OrgUserMembership)
+class OrgUserMembershipAdmin(admin.ModelAdmin):
+    """Defines the admin interface for the OrgUserMembership model
+    """
+    list_display = ('id', 'org', 'user', 'created')
+    list_filter = (('org', AllValuesDropdownFilter),)
+
+
+@admin.register(figures.models.OrgUserMembershipLoad)
+class OrgUserMembershipLoadAdmin(admin.ModelAdmin):
+    """Defines the admin interface for the OrgUserMembershipLoad model
+    """
+    list_display = ('id', 'loaded_until', 'created_count', 'created')
+
+
+@admin.register(figures.models.LearnerCourseGradeSnapshot)
+class LearnerCourseGradeSnapshotAdmin(admin.ModelAdmin):
+    """Defines the admin interface for the LearnerCourseGradeSnapshot model
+    """
+    list_display = ('id', 'date_for', 'site', 'user', 'course_id',
+                    'points_possible', 'points_earned', 'sections_worked',
+                    'sections_possible', 'progress_percent')
+    list_filter = (
+        ('site', RelatedOnlyDropdownFilter),
+        ('course_id', AllValuesDropdownFilter))
+
+
+@admin.register(figures.models.ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    """Defines the admin interface for the ReportJob model
+    """
+    list_display = ('id', 'created', 'site', 'report_type', 'date_for', 'status',
+                    'row_count', 'finished_at')
+    list_filter = (
+        ('site', RelatedOnlyDropdownFilter),
+        'report_type',
+        'status')
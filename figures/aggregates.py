@@ -0,0 +1,203 @@
+'''Aggregate queries over the Figures daily metrics models
+
+The metrics in ``figures.metrics`` that read ``SiteDailyMetrics`` or
+``CourseDailyMetrics`` aggregate a field over the records in a date range.
+``PeriodAggregate`` declares such a metric once, then computes it for a
+single period or for a series of months. Each computation is one query.
+
+An empty range, or a range where the field is NULL for every record, returns
+the metric's default. We don't test the queryset for emptiness first, as that
+loads the records and costs a second query
+
+A metric can also declare the field of a monthly rollup model
+(``SiteMonthlyMetrics`` or ``CourseMonthlyMetrics``) that stores its raw value
+for each calendar month. Whole months are then read from the rollup records
+instead of aggregating the daily records. The pipeline keeps the rollups up to
+date, see ``figures.pipeline.monthly_metrics``
+
+``PeriodUserUnion`` counts the distinct users of a period from the daily user
+sets of ``SiteDailyActiveUsers``. Days without a record count no users, the
+pipeline stores a record for each day and ``backfill_daily_metrics`` fills in
+the days before it did. We don't read ``StudentModule`` at request time
+'''
+
+import calendar
+from collections import defaultdict
+import datetime
+from decimal import Decimal
+import math
+
+from django.db.models.functions import TruncMonth
+
+from figures.helpers import as_date
+from figures.user_id_sets import unpack_user_ids
+
+
+def as_two_place_float(value):
+    return float(Decimal(value).quantize(Decimal('.00')))
+
+
+def as_ceil_int(value):
+    return int(math.ceil(value))
+
+
+def month_bounds(date_for):
+    '''Returns the first and the last day of the month of ``date_for``
+    '''
+    date_for = as_date(date_for)
+    return (date_for.replace(day=1),
+            date_for.replace(day=calendar.monthrange(date_for.year, date_for.month)[1]))
+
+
+def is_calendar_month(start_date, end_date):
+    return (start_date, end_date) == month_bounds(start_date)
+
+
+class PeriodMetric(object):
+    '''Base for the metrics computed from the daily records of a period
+
+    :param model: The daily model, with ``site`` and ``date_for`` fields
+    '''
+    def __init__(self, model):
+        self.model = model
+
+    def get_queryset(self, site, start_date, end_date, **filter_args):
+        '''Returns the records for the site from start_date to end_date inclusive
+        '''
+        return self.model.objects.filter(
+            site=site,
+            date_for__gte=as_date(start_date),
+            date_for__lte=as_date(end_date),
+            **filter_args)
+
+
+class PeriodAggregate(PeriodMetric):
+    '''Aggregate of a daily metrics model field over a period
+
+    :param model: ``SiteDailyMetrics`` or ``CourseDailyMetrics``
+    :param aggregate: The Django aggregate expression, like ``Max('course_count')``
+    :param transform: Optional function applied to non-NULL aggregate values
+    :param default: The value when the aggregate is NULL
+    :param rollup_model: Optional monthly rollup model storing the metric
+    :param rollup_field: The ``rollup_model`` field storing the metric
+    '''
+    def __init__(self, model, aggregate, transform=None, default=0,
+                 rollup_model=None, rollup_field=None):
+        super(PeriodAggregate, self).__init__(model)
+        self.aggregate = aggregate
+        self.transform = transform
+        self.default = default
+        self.rollup_model = rollup_model
+        self.rollup_field = rollup_field
+
+    def as_value(self, value):
+        if value is None:
+            return self.default
+        return self.transform(value) if self.transform else value
+
+    def get_raw_value(self, site, start_date, end_date, **filter_args):
+        '''Returns the aggregate of the daily records, None if there are none
+        '''
+        return self.get_queryset(
+            site, start_date, end_date, **filter_args).aggregate(
+            value=self.aggregate)['value']
+
+    def get_value(self, site, start_date, end_date, **filter_args):
+        start_date = as_date(start_date)
+        end_date = as_date(end_date)
+        if self.rollup_model and is_calendar_month(start_date, end_date):
+            return self.get_monthly_values(
+                site, [(start_date.year, start_date.month, end_date.day)],
+                **filter_args)[0]
+        return self.as_value(self.get_raw_value(
+            site, start_date, end_date, **filter_args))
+
+    def get_monthly_values(self, site, months, **filter_args):
+        '''Returns the list of values for the months with one query
+
+        ``months`` is a list of (year, month, last day of month) tuples in
+        order, as ``figures.helpers.previous_months_iterator`` yields
+
+        Reads the rollup records if the metric has a rollup model. Otherwise
+        groups the daily records by month
+        '''
+        if not months:
+            return []
+        if self.rollup_model:
+            values = dict(
+                ((month_for.year, month_for.month), value) for month_for, value in
+                self.rollup_model.objects.filter(
+                    site=site,
+                    month_for__gte=datetime.date(months[0][0], months[0][1], 1),
+                    month_for__lte=datetime.date(months[-1][0], months[-1][1], 1),
+                    **filter_args).values_list('month_for', self.rollup_field))
+            return [self.as_value(values.get((month[0], month[1]))) for month in months]
+        return self.get_daily_monthly_values(site, months, **filter_args)
+
+    def get_daily_monthly_values(self, site, months, **filter_args):
+        '''Returns the list of values for the months with one query of the
+        daily records grouped by month
+        '''
+        if not months:
+            return []
+        qs = self.get_queryset(
+            site,
+            datetime.date(months[0][0], months[0][1], 1),
+            datetime.date(*months[-1]),
+            **filter_args)
+        values = dict(
+            ((rec['month'].year, rec['month'].month), rec['value']) for rec in
+            qs.annotate(month=TruncMonth('date_for')).order_by().values(
+                'month').annotate(value=self.aggregate))
+        return [self.as_value(values.get((month[0], month[1]))) for month in months]
+
+
+class PeriodUserUnion(PeriodMetric):
+    '''Number of distinct users in the daily user sets of a period
+
+    The daily records store their users as packed id lists, see
+    ``figures.user_id_sets``, and their number of users. The users of a
+    period are the union of its days' users, which SQL can't aggregate, so the
+    sets are merged in Python after one query. A period of a single record
+    uses the record's count without unpacking its users
+
+    :param model: The daily model, like ``SiteDailyActiveUsers``
+    :param field: The model field storing the packed user ids
+    :param count_field: The model field storing the number of users
+    '''
+    def __init__(self, model, field='user_ids', count_field='user_count'):
+        super(PeriodUserUnion, self).__init__(model)
+        self.field = field
+        self.count_field = count_field
+
+    def get_daily_records(self, site, start_date, end_date, **filter_args):
+        '''Returns the list of (day, user count, packed user ids) of the period
+        '''
+        return list(self.get_queryset(
+            site, start_date, end_date, **filter_args).values_list(
+            'date_for', self.count_field, self.field))
+
+    def get_value(self, site, start_date, end_date, **filter_args):
+        records = self.get_daily_records(site, start_date, end_date, **filter_args)
+        if len(records) == 1:
+            return records[0][1]
+        user_ids = set()
+        for _, _, data in records:
+            user_ids.update(unpack_user_ids(data))
+        return len(user_ids)
+
+    def get_monthly_values(self, site, months, **filter_args):
+        '''Returns the list of values for the months with one query
+
+        See ``PeriodAggregate.get_monthly_values``
+        '''
+        if not months:
+            return []
+        user_ids = defaultdict(set)
+        for date_for, _, data in self.get_daily_records(
+                site,
+                datetime.date(months[0][0], months[0][1], 1),
+                datetime.date(*months[-1]),
+                **filter_args):
+            user_ids[(date_for.year, date_for.month)].update(unpack_user_ids(data))
+        return [len(user_ids[(month[0], month[1])]) for month in months]
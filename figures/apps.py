@@ -49,3 +49,9 @@ class FiguresConfig(AppConfig):
             }
         },
     }
+
+    def ready(self):
+        # Connects the course access role, site and enrollment signal receivers
+        import figures.course_roles  # noqa: F401
+        import figures.pipeline.org_user_memberships  # noqa: F401
+        import figures.sites  # noqa: F401
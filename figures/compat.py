@@ -33,6 +33,16 @@ except ImportError:
     # try the pre-hawthorn path
     from certificates.models import GeneratedCertificate    # noqa: F401
 
+try:
+    from lms.djangoapps.grades.models import (
+        PersistentCourseGrade,
+        PersistentSubsectionGrade,
+    )
+except ImportError:
+    # Persisted grades are not available
+    PersistentCourseGrade = None
+    PersistentSubsectionGrade = None
+
 
 def chapter_grade_values(chapter_grades):
     '''
@@ -52,3 +62,34 @@ def chapter_grade_values(chapter_grades):
         # TODO: improve clarity, add a message
         # This may be what
         raise TypeError
+
+
+def prefetch_persisted_grades(course_key, users):
+    '''Bulk reads the persisted course and subsection grades for the users
+
+    The grades models keep the prefetched records in the request cache, so the
+    ``CourseGradeFactory`` reads that follow do not query per learner. Does
+    nothing if the Open edX release does not support prefetching grades
+    '''
+    for grade_model in (PersistentCourseGrade, PersistentSubsectionGrade):
+        if hasattr(grade_model, 'prefetch'):
+            grade_model.prefetch(course_key, users)
+
+
+def iter_course_grades(users, course):
+    '''Yields a ``(user, course_grade, error)`` tuple for each user
+
+    Uses ``CourseGradeFactory.iter`` when available so that the course
+    structure is collected once for all the users. Otherwise reads the grade
+    for each user in turn
+    '''
+    factory = CourseGradeFactory()
+    if hasattr(factory, 'iter'):
+        for result in factory.iter(users, course=course):
+            yield result.student, result.course_grade, result.error
+    else:
+        for user in users:
+            try:
+                yield user, factory.read(user, course), None
+            except Exception as e:  # pylint: disable=broad-except
+                yield user, None, e
@@ -0,0 +1,71 @@
+'''Cached course staff user ids
+
+Figures metrics leave out course staff, instructors and CCX coaches. Looking up
+these users took three role queries each time a metric was computed, several
+times per course in the pipeline and in the course details serializer.
+
+This module caches the set of excluded user ids per course. The cache entry is
+deleted when a ``CourseAccessRole`` record for the course is saved or deleted.
+Role changes that bypass the model signals, like queryset updates, are picked
+up when the entry times out, see ``figures.helpers.course_roles_cache_timeout``
+'''
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from student.models import CourseAccessRole
+from student.roles import CourseCcxCoachRole, CourseInstructorRole, CourseStaffRole
+
+from figures.helpers import as_course_key, course_roles_cache_timeout
+
+
+EXCLUDED_COURSE_ROLES = (
+    CourseStaffRole.ROLE,
+    CourseInstructorRole.ROLE,
+    CourseCcxCoachRole.ROLE,
+)
+
+
+def course_locator_for(course_id):
+    '''Returns the course key the course roles are assigned to
+
+    CCX course roles are held by the master course
+    '''
+    if getattr(course_id, 'ccx', None):
+        return course_id.to_course_locator()
+    return as_course_key(course_id)
+
+
+def excluded_user_ids_cache_key(course_id):
+    return 'figures.course_roles.excluded_user_ids.{}'.format(
+        course_locator_for(course_id))
+
+
+def get_excluded_user_ids(course_id):
+    '''Returns the frozenset of ids of the users excluded from course metrics
+
+    These are the users with a staff, instructor or CCX coach role in the course
+    '''
+    key = excluded_user_ids_cache_key(course_id)
+    user_ids = cache.get(key)
+    if user_ids is None:
+        user_ids = frozenset(CourseAccessRole.objects.filter(
+            course_id=course_locator_for(course_id),
+            role__in=EXCLUDED_COURSE_ROLES).values_list('user_id', flat=True))
+        cache.set(key, user_ids, course_roles_cache_timeout())
+    return user_ids
+
+
+def invalidate_excluded_user_ids(course_id):
+    cache.delete(excluded_user_ids_cache_key(course_id))
+
+
+@receiver(post_save, sender=CourseAccessRole,
+          dispatch_uid='figures.course_roles.course_access_role_saved')
+@receiver(post_delete, sender=CourseAccessRole,
+          dispatch_uid='figures.course_roles.course_access_role_deleted')
+def invalidate_on_course_access_role_change(sender, instance, **kwargs):
+    # Org and global roles have an empty course id
+    if instance.course_id:
+        invalidate_excluded_user_ids(instance.course_id)
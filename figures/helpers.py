@@ -4,6 +4,7 @@ Helper functions to make data handling and conversions easier
 
 import calendar
 import datetime
+from itertools import islice
 from django.conf import settings
 from django.utils.timezone import utc
 
@@ -23,6 +24,16 @@ def is_multisite():
     return bool(settings.FEATURES.get('FIGURES_IS_MULTISITE', False))
 
 
+def has_microsites():
+    """
+    Whether Figures runs on a TMA multi-microsites platform, where each site
+    serves the courses of the org named by the first label of its domain.
+
+    Override by setting ``FIGURES_HAS_MICROSITES`` to true in the Open edX FEATURES.
+    """
+    return bool(settings.FEATURES.get('FIGURES_HAS_MICROSITES', False))
+
+
 def log_pipeline_errors_to_db():
     """
     Capture pipeline errors to the figures.models.PipelineError model.
@@ -32,6 +43,116 @@ def log_pipeline_errors_to_db():
     return bool(settings.FEATURES.get('FIGURES_LOG_PIPELINE_ERRORS_TO_DB', True))
 
 
+def pipeline_batch_size():
+    """
+    Number of learners the pipeline processes at a time when reading grades.
+
+    Override by setting ``FIGURES_PIPELINE_BATCH_SIZE`` in the Open edX FEATURES.
+    """
+    return int(settings.FEATURES.get('FIGURES_PIPELINE_BATCH_SIZE', 500))
+
+
+def report_batch_size():
+    """
+    Number of learners read at a time when writing a learner progress report.
+
+    Override by setting ``FIGURES_REPORT_BATCH_SIZE`` in the Open edX FEATURES.
+    """
+    return int(settings.FEATURES.get('FIGURES_REPORT_BATCH_SIZE', 500))
+
+
+def report_job_timeout():
+    """
+    Seconds a report job may stay pending, or started without a heartbeat,
+    before it is considered lost, like when its task was dropped or its worker
+    died, and is queued again on the next request.
+
+    Override by setting ``FIGURES_REPORT_JOB_TIMEOUT`` in the Open edX FEATURES.
+    """
+    return int(settings.FEATURES.get('FIGURES_REPORT_JOB_TIMEOUT', 3600))
+
+
+def pipeline_max_parallel_tasks():
+    """
+    Maximum number of course tasks the parallel pipeline runs at the same time
+    for a site.
+
+    Override by setting ``FIGURES_PIPELINE_MAX_PARALLEL_TASKS`` in the Open edX FEATURES.
+    """
+    return int(settings.FEATURES.get('FIGURES_PIPELINE_MAX_PARALLEL_TASKS', 8))
+
+
+def pipeline_course_time_limit():
+    """
+    Number of seconds a course task in the parallel pipeline may run before it
+    is stopped. Retries get the same time limit.
+
+    Override by setting ``FIGURES_PIPELINE_COURSE_TIME_LIMIT`` in the Open edX FEATURES.
+    """
+    return int(settings.FEATURES.get('FIGURES_PIPELINE_COURSE_TIME_LIMIT', 3600))
+
+
+def pipeline_course_max_retries():
+    """
+    Number of times the parallel pipeline retries a failed course task.
+
+    Override by setting ``FIGURES_PIPELINE_COURSE_MAX_RETRIES`` in the Open edX FEATURES.
+    """
+    return int(settings.FEATURES.get('FIGURES_PIPELINE_COURSE_MAX_RETRIES', 2))
+
+
+def incremental_grades_enabled():
+    """
+    Only read grades for learners with courseware activity since the previous
+    pipeline run. Other learners have their previous grade metrics carried
+    forward.
+
+    Override by setting ``FIGURES_INCREMENTAL_GRADES`` to true in the Open edX FEATURES.
+    """
+    return bool(settings.FEATURES.get('FIGURES_INCREMENTAL_GRADES', False))
+
+
+def course_roles_cache_timeout():
+    """
+    Seconds to cache the ids of the course staff excluded from course metrics.
+    The cache is also cleared when a course access role changes.
+
+    Override by setting ``FIGURES_COURSE_ROLES_CACHE_TIMEOUT`` in the Open edX FEATURES.
+    """
+    return int(settings.FEATURES.get('FIGURES_COURSE_ROLES_CACHE_TIMEOUT', 3600))
+
+
+def site_metrics_cache_timeout():
+    """
+    Seconds to cache the general site metrics. The cache is also versioned on
+    the site daily metrics the pipeline writes.
+
+    Override by setting ``FIGURES_SITE_METRICS_CACHE_TIMEOUT`` in the Open edX FEATURES.
+    """
+    return int(settings.FEATURES.get('FIGURES_SITE_METRICS_CACHE_TIMEOUT', 86400))
+
+
+def grade_metrics_retention_days():
+    """
+    Days of learner grade metrics history kept at daily granularity. Older
+    history is compacted by ``figures.tasks.compact_learner_course_grades``.
+
+    Override by setting ``FIGURES_GRADE_METRICS_RETENTION_DAYS`` in the Open edX FEATURES.
+    """
+    return int(settings.FEATURES.get('FIGURES_GRADE_METRICS_RETENTION_DAYS', 90))
+
+
+def grade_metrics_compaction_sampling():
+    """
+    How learner grade metrics history older than the retention window is
+    compacted: ``change`` keeps the records where grades changed, ``week`` and
+    ``month`` keep the last record of each week or month.
+
+    Override by setting ``FIGURES_GRADE_METRICS_COMPACTION_SAMPLING`` in the Open edX FEATURES.
+    """
+    return settings.FEATURES.get('FIGURES_GRADE_METRICS_COMPACTION_SAMPLING', 'change')
+
+
 def as_course_key(course_id):
     '''Returns course id as a CourseKey instance
 
@@ -130,3 +251,16 @@ def previous_months_iterator(month_for, months_back, include_month_for=False):
     for dt in rrule(freq=MONTHLY, dtstart=start_month, until=month_for):
         last_day_of_month = calendar.monthrange(dt.year, dt.month)[1]
         yield (dt.year, dt.month, last_day_of_month)
+
+
+def chunks(items, size):
+    '''Iterator returns lists of up to ``size`` items taken from ``items``
+
+    ``items`` can be any iterable, including a queryset iterator, so we never
+    need to hold more than one chunk in memory
+    '''
+    iterator = iter(items)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
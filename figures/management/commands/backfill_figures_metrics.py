@@ -0,0 +1,61 @@
+'''Management command to backfill Figures daily metrics for a range of dates
+
+see ``figures.pipeline.backfill``
+'''
+
+from __future__ import print_function
+
+from textwrap import dedent
+
+from django.core.management.base import BaseCommand, CommandError
+
+from figures.helpers import as_date
+from figures.tasks import backfill_daily_metrics
+
+
+class Command(BaseCommand):
+    '''Backfill Figures daily metrics models for a range of dates
+    '''
+    help = dedent(__doc__).strip()
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date',
+                            required=True,
+                            help='first date to backfill in yyyy-mm-dd format')
+        parser.add_argument('--end-date',
+                            required=True,
+                            help='last date to backfill in yyyy-mm-dd format')
+        parser.add_argument('--site',
+                            type=int,
+                            default=None,
+                            help='id of the site to backfill. Defaults to all sites')
+        parser.add_argument('--no-delay',
+                            action='store_true',
+                            default=False,
+                            help='Disable the celery "delay" directive')
+        parser.add_argument('--force-update',
+                            action='store_true',
+                            default=False,
+                            help='Overwrite metrics records that exist for the dates')
+
+    def handle(self, *args, **options):
+        if as_date(options['start_date']) > as_date(options['end_date']):
+            raise CommandError('--start-date must not be after --end-date')
+
+        print('backfilling Figures metrics...')
+
+        kwargs = dict(
+            start_date=options['start_date'],
+            end_date=options['end_date'],
+            site_id=options['site'],
+            force_update=options['force_update'],
+            )
+
+        if options['no_delay']:
+            backfill_daily_metrics(**kwargs)
+        else:
+            backfill_daily_metrics.delay(**kwargs)  # pragma: no cover
+
+        print('Management command backfill_figures_metrics complete. {} to {}'.format(
+            options['start_date'], options['end_date']))
+        print('Done.')
@@ -0,0 +1,54 @@
+'''Management command to compact the Figures learner grade metrics history
+
+see ``figures.pipeline.grade_metrics_compaction``
+'''
+
+from __future__ import print_function
+
+from textwrap import dedent
+
+from django.core.management.base import BaseCommand
+
+from figures.pipeline.grade_metrics_compaction import SAMPLING_CHOICES
+from figures.tasks import compact_learner_course_grades
+
+
+class Command(BaseCommand):
+    '''Compact the Figures learner grade metrics older than the retention window
+    '''
+    help = dedent(__doc__).strip()
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date',
+                            default=None,
+                            help='date the retention window ends in yyyy-mm-dd format. '
+                                 'Defaults to today')
+        parser.add_argument('--retention-days',
+                            type=int,
+                            default=None,
+                            help='days of history kept at daily granularity')
+        parser.add_argument('--sampling',
+                            choices=SAMPLING_CHOICES,
+                            default=None,
+                            help='records kept in the compacted history')
+        parser.add_argument('--no-delay',
+                            action='store_true',
+                            default=False,
+                            help='Disable the celery "delay" directive')
+
+    def handle(self, *args, **options):
+        print('compacting Figures learner grade metrics...')
+
+        kwargs = dict(
+            date_for=options['date'],
+            retention_days=options['retention_days'],
+            sampling=options['sampling'],
+            )
+
+        if options['no_delay']:
+            compact_learner_course_grades(**kwargs)
+        else:
+            compact_learner_course_grades.delay(**kwargs)  # pragma: no cover
+
+        print('Management command compact_figures_grade_metrics complete.')
+        print('Done.')
@@ -11,7 +11,7 @@ from django.core.management.base import BaseCommand
 
 from figures.tasks import (
     populate_daily_metrics,
-    experimental_populate_daily_metrics,
+    parallel_populate_daily_metrics,
 )
 
 
@@ -34,11 +34,18 @@ class Command(BaseCommand):
                             action='store_true',
                             default=False,
                             help='Overwrite metrics records if they exist for the given date')
-        parser.add_argument('--experimental',
+        parser.add_argument('--resume',
                             action='store_true',
                             default=False,
-                            help=('Run with Celery workflows (Warning: This is still under' +
-                                  ' development and likely to get stuck/hung jobs'))
+                            help=('Continue the last unfinished run for the date, skipping' +
+                                  ' the courses it completed'))
+        parser.add_argument('--parallel', '--experimental',
+                            dest='parallel',
+                            action='store_true',
+                            default=False,
+                            help=('Run course metrics in parallel Celery tasks. Requires a' +
+                                  ' Celery result backend. "--experimental" is a deprecated' +
+                                  ' alias'))
 
     def handle(self, *args, **options):
         '''
@@ -50,16 +57,17 @@ class Command(BaseCommand):
         kwargs = dict(
             date_for=options['date'],
             force_update=options['force_update'],
+            resume=options['resume'],
             )
 
-        experimental = options['experimental']
-        options.pop('experimental')
+        parallel = options['parallel']
+        options.pop('parallel')
 
-        if experimental:
+        if parallel:
             if options['no_delay']:
-                experimental_populate_daily_metrics(**kwargs)
+                parallel_populate_daily_metrics(**kwargs)
             else:
-                experimental_populate_daily_metrics.delay(**kwargs)  # pragma: no cover
+                parallel_populate_daily_metrics.delay(**kwargs)  # pragma: no cover
         else:
             if options['no_delay']:
                 populate_daily_metrics(**kwargs)
@@ -22,8 +22,6 @@ parameter to support multi-tenancy
 """
 
 import datetime
-from decimal import Decimal
-import math
 
 from django.contrib.auth import get_user_model
 from django.db.models import Avg, Max
@@ -31,6 +29,12 @@ from django.db.models import Avg, Max
 from courseware.courses import get_course_by_id
 from courseware.models import StudentModule
 
+from figures.aggregates import (
+    PeriodAggregate,
+    PeriodUserUnion,
+    as_ceil_int,
+    as_two_place_float,
+)
 from figures.compat import (
     CourseGradeFactory,
     GeneratedCertificate,
@@ -44,7 +48,13 @@ from figures.helpers import (
     prev_day,
     previous_months_iterator,
 )
-from figures.models import CourseDailyMetrics, SiteDailyMetrics
+from figures.models import (
+    CourseDailyMetrics,
+    CourseMonthlyMetrics,
+    SiteDailyActiveUsers,
+    SiteDailyMetrics,
+    SiteMonthlyMetrics,
+)
 import figures.sites
 
 # TMA imports
@@ -98,21 +108,35 @@ class LearnerCourseGrades(object):
     def __init__(self, user_id, course_id, **kwargs):
         """
 
+        Optional keyword arguments ``learner``, ``course`` and ``course_grade``
+        let the caller reuse objects it has already loaded. The pipeline uses
+        these to load the course once for all learners in the course
+
         If CourseGradeFactory is unable to retrieve the course blocks, raises
 
             django.core.exceptions.PermissionDenied(
                 "User does not have access to this course")
         """
-        self.learner = get_user_model().objects.get(id=user_id)
-        self.course = get_course_by_id(course_key=as_course_key(course_id))
-        self.course._field_data_cache = {}  # pylint: disable=protected-access
-        self.course.set_grading_policy(self.course.grading_policy)
-        self.course_grade = CourseGradeFactory().read(self.learner, self.course)
+        self.learner = kwargs.get('learner') or get_user_model().objects.get(
+            id=user_id)
+        self.course = kwargs.get('course') or LearnerCourseGrades.load_course(
+            course_id)
+        self.course_grade = kwargs.get('course_grade') or CourseGradeFactory(
+            ).read(self.learner, self.course)
 
     def __str__(self):
         return u'{} - {} - {} '.format(
             self.course.id, self.learner.id, self.learner.username)
 
+    @staticmethod
+    def load_course(course_id):
+        """Returns the course from the modulestore, ready for grading
+        """
+        course = get_course_by_id(course_key=as_course_key(course_id))
+        course._field_data_cache = {}  # pylint: disable=protected-access
+        course.set_grading_policy(course.grading_policy)
+        return course
+
     @staticmethod
     def from_course_enrollment(course_enrollment):
         return LearnerCourseGrades(
@@ -203,10 +227,16 @@ class LearnerCourseGrades(object):
                 progress_details['count'])
 
     @staticmethod
-    def course_progress(course_enrollment):
+    def course_progress(course_enrollment, **kwargs):
+        """Returns the progress for the enrollment
+
+        Accepts the same optional keyword arguments as the constructor
+        """
+        kwargs.setdefault('learner', course_enrollment.user)
         lcg = LearnerCourseGrades(
                 user_id=course_enrollment.user.id,
                 course_id=course_enrollment.course_id,
+                **kwargs
         )
         course_progress_details = lcg.progress()
         return dict(
@@ -230,27 +260,88 @@ start_date, end_date, site
 """
 
 
+# Aggregates of the daily metrics models. See ``figures.aggregates``
+
+SITE_TOTAL_USERS = PeriodAggregate(
+    SiteDailyMetrics, Max('total_user_count'),
+    rollup_model=SiteMonthlyMetrics, rollup_field='total_user_count')
+SITE_TOTAL_ENROLLMENTS = PeriodAggregate(
+    SiteDailyMetrics, Max('total_enrollment_count'),
+    rollup_model=SiteMonthlyMetrics, rollup_field='total_enrollment_count')
+SITE_COURSE_COUNT = PeriodAggregate(
+    SiteDailyMetrics, Max('course_count'),
+    rollup_model=SiteMonthlyMetrics, rollup_field='course_count')
+SITE_COURSE_COMPLETIONS = PeriodAggregate(
+    CourseDailyMetrics, Max('num_learners_completed'),
+    rollup_model=SiteMonthlyMetrics, rollup_field='course_completions')
+COURSE_ENROLLMENTS = PeriodAggregate(
+    CourseDailyMetrics, Max('enrollment_count'),
+    rollup_model=CourseMonthlyMetrics, rollup_field='enrollment_count')
+COURSE_AVERAGE_PROGRESS = PeriodAggregate(
+    CourseDailyMetrics, Avg('average_progress'),
+    transform=as_two_place_float, default=0.0,
+    rollup_model=CourseMonthlyMetrics, rollup_field='average_progress')
+COURSE_AVERAGE_DAYS_TO_COMPLETE = PeriodAggregate(
+    CourseDailyMetrics, Avg('average_days_to_complete'), transform=as_ceil_int,
+    rollup_model=CourseMonthlyMetrics, rollup_field='average_days_to_complete')
+COURSE_LEARNERS_COMPLETED = PeriodAggregate(
+    CourseDailyMetrics, Max('num_learners_completed'),
+    rollup_model=CourseMonthlyMetrics, rollup_field='num_learners_completed')
+
+
+SITE_ACTIVE_USERS = PeriodUserUnion(SiteDailyActiveUsers)
+
+# The aggregates stored in the monthly rollup records
+SITE_MONTHLY_AGGREGATES = (
+    SITE_TOTAL_USERS,
+    SITE_TOTAL_ENROLLMENTS,
+    SITE_COURSE_COUNT,
+    SITE_COURSE_COMPLETIONS,
+)
+COURSE_MONTHLY_AGGREGATES = (
+    COURSE_ENROLLMENTS,
+    COURSE_AVERAGE_PROGRESS,
+    COURSE_AVERAGE_DAYS_TO_COMPLETE,
+    COURSE_LEARNERS_COMPLETED,
+)
+
+
+def monthly_history_series(period_aggregate):
+    """Declares the ``PeriodAggregate`` or ``PeriodUserUnion`` a metric
+    function computes
+
+    ``get_monthly_history_metric`` then computes all the months with one query
+    grouped by month instead of calling the function for each month
+    """
+    def decorator(func):
+        func.monthly_history_series = period_aggregate
+        return func
+    return decorator
+
+
+@monthly_history_series(SITE_ACTIVE_USERS)
 def get_active_users_for_time_period(site, start_date, end_date, course_ids=None):
     """
     Returns the number of users active in the time period.
 
-    This is determined by finding the unique user ids for StudentModule records
-    modified in a time period
+    This is the number of distinct users in the ``SiteDailyActiveUsers``
+    records the pipeline stores for each day of the time period. Days without
+    a record count no users, run ``backfill_daily_metrics`` to fill them. If
+    ``course_ids`` is given, the users with ``StudentModule`` records modified
+    in the time period for those courses are counted instead
     """
-    # Get list of learners for the site
-    user_ids = figures.sites.get_user_ids_for_site(site)
-    filter_args = dict(
-        created__gt=as_datetime(prev_day(start_date)),
-        modified__lt=as_datetime(next_day(end_date)),
-        student_id__in=user_ids,
-    )
     if course_ids:
-        filter_args['course_ids__in'] = course_ids
+        return StudentModule.objects.filter(
+            modified__gte=as_datetime(start_date),
+            modified__lt=as_datetime(next_day(as_date(end_date))),
+            student_id__in=figures.sites.get_user_ids_for_site(site),
+            course_id__in=[as_course_key(course_id) for course_id in course_ids],
+        ).values('student__id').distinct().count()
 
-    return StudentModule.objects.filter(
-        **filter_args).values('student__id').distinct().count()
+    return SITE_ACTIVE_USERS.get_value(site, start_date, end_date)
 
 
+@monthly_history_series(SITE_TOTAL_USERS)
 def get_total_site_users_for_time_period(site, start_date, end_date, **kwargs):
     """
     Returns the maximum number of users who joined before or on the end date
@@ -261,31 +352,22 @@ def get_total_site_users_for_time_period(site, start_date, end_date, **kwargs):
 
     TODO: Consider first trying to get the data from the SiteDailyMetrics
     model. If there are no records, then get the data from the User model
+
+    With ``calc_raw``, the users are read from the TMA org users of the
+    ``site_context`` keyword argument, so a series of months shares them
     """
     def calc_from_user_model():
         filter_args = dict(
             date_joined__lt=next_day(end_date),
         )
-        # TMA retrieve org 
-        org = site.domain.split('.')[0]
-        users = figures.sites.get_users_for_org(org)
-        return users.filter(**filter_args).count()
-
-    def calc_from_site_daily_metrics():
-        filter_args = dict(
-            site=site,
-            date_for__gt=prev_day(start_date),
-            date_for__lt=next_day(end_date))
-        qs = SiteDailyMetrics.objects.filter(**filter_args)
-        if qs:
-            return qs.aggregate(maxval=Max('total_user_count'))['maxval']
-        else:
-            return 0
+        # TMA org users, the SiteContext org defaults to the site domain org
+        site_context = kwargs.get('site_context') or figures.sites.SiteContext(site)
+        return site_context.org_users.filter(**filter_args).count()
 
     if kwargs.get('calc_raw'):
         return calc_from_user_model()
     else:
-        return calc_from_site_daily_metrics()
+        return SITE_TOTAL_USERS.get_value(site, start_date, end_date)
 
 
 def get_total_site_users_joined_for_time_period(site, start_date, end_date, course_ids=None):
@@ -308,42 +390,22 @@ def get_total_site_users_joined_for_time_period(site, start_date, end_date, cour
     return calc_from_user_model()
 
 
+@monthly_history_series(SITE_TOTAL_ENROLLMENTS)
 def get_total_enrollments_for_time_period(site, start_date, end_date, course_ids=None):
     """Returns the maximum number of enrollments
 
     This returns the count of unique enrollments, not unique learners
     """
-    filter_args = dict(
-        site=site,
-        date_for__gt=prev_day(start_date),
-        date_for__lt=next_day(end_date),
-    )
-
-    qs = SiteDailyMetrics.objects.filter(**filter_args)
-    if qs:
-        return qs.aggregate(maxval=Max('total_enrollment_count'))['maxval']
-    else:
-        return 0
+    return SITE_TOTAL_ENROLLMENTS.get_value(site, start_date, end_date)
 
 
+@monthly_history_series(SITE_COURSE_COUNT)
 def get_total_site_courses_for_time_period(site, start_date, end_date,
                                            course_ids=None, **kwargs):
     """
     Potential fix:
     get unique course ids from CourseEnrollment
     """
-    def calc_from_site_daily_metrics():
-        filter_args = dict(
-            site=site,
-            date_for__gt=prev_day(start_date),
-            date_for__lt=next_day(end_date),
-        )
-        qs = SiteDailyMetrics.objects.filter(**filter_args)
-        if qs:
-            return qs.aggregate(maxval=Max('course_count'))['maxval']
-        else:
-            return 0
-
     def calc_from_course_enrollments():
         filter_args = dict(
             created__gt=prev_day(start_date),
@@ -358,115 +420,68 @@ def get_total_site_courses_for_time_period(site, start_date, end_date,
     if kwargs.get('calc_raw'):
         return calc_from_course_enrollments()
     else:
-        return calc_from_site_daily_metrics()
+        return SITE_COURSE_COUNT.get_value(site, start_date, end_date)
 
 
+@monthly_history_series(SITE_COURSE_COMPLETIONS)
 def get_total_course_completions_for_time_period(site, start_date, end_date, course_ids=None):
     """
     This metric is not currently captured in SiteDailyMetrics, so retrieving from
     course dailies instead
     """
-    def calc_from_course_daily_metrics():
-        filter_args = dict(
-            site=site,
-            date_for__gt=prev_day(start_date),
-            date_for__lt=next_day(end_date),
-        )
-        qs = CourseDailyMetrics.objects.filter(**filter_args)
-        if qs:
-            return qs.aggregate(maxval=Max('num_learners_completed'))['maxval']
-        else:
-            return 0
-
-    return calc_from_course_daily_metrics()
+    return SITE_COURSE_COMPLETIONS.get_value(site, start_date, end_date)
 
 
 # TODO: Consider moving these aggregate queries to the
 # CourseDailyMetricsManager class (not yet created)
 
 
+@monthly_history_series(COURSE_ENROLLMENTS)
 def get_course_enrolled_users_for_time_period(site, start_date, end_date, course_id):
     """
 
     """
-    filter_args = dict(
-        site=site,
-        date_for__gt=prev_day(start_date),
-        date_for__lt=next_day(end_date),
-        course_id=course_id
-    )
-
-    qs = CourseDailyMetrics.objects.filter(**filter_args)
-    if qs:
-        return qs.aggregate(maxval=Max('enrollment_count'))['maxval']
-    else:
-        return 0
+    return COURSE_ENROLLMENTS.get_value(
+        site, start_date, end_date, course_id=course_id)
 
 
+@monthly_history_series(COURSE_AVERAGE_PROGRESS)
 def get_course_average_progress_for_time_period(site, start_date, end_date, course_id):
-    filter_args = dict(
-        site=site,
-        date_for__gt=prev_day(start_date),
-        date_for__lt=next_day(end_date),
-        course_id=course_id
-    )
-
-    qs = CourseDailyMetrics.objects.filter(**filter_args)
-    if qs:
-        value = qs.aggregate(average=Avg('average_progress'))['average']
-        return float(Decimal(value).quantize(Decimal('.00')))
-    else:
-        return 0.0
+    return COURSE_AVERAGE_PROGRESS.get_value(
+        site, start_date, end_date, course_id=course_id)
 
 
+@monthly_history_series(COURSE_AVERAGE_DAYS_TO_COMPLETE)
 def get_course_average_days_to_complete_for_time_period(site, start_date, end_date, course_id):
-    filter_args = dict(
-        site=site,
-        date_for__gt=prev_day(start_date),
-        date_for__lt=next_day(end_date),
-        course_id=course_id
-    )
-
-    qs = CourseDailyMetrics.objects.filter(**filter_args)
-    if qs:
-        return int(math.ceil(
-            qs.aggregate(average=Avg('average_days_to_complete'))['average']
-        ))
-    else:
-        return 0
+    return COURSE_AVERAGE_DAYS_TO_COMPLETE.get_value(
+        site, start_date, end_date, course_id=course_id)
 
 
+@monthly_history_series(COURSE_LEARNERS_COMPLETED)
 def get_course_num_learners_completed_for_time_period(site, start_date, end_date, course_id):
-    """
-    We're duplicating some code.
-    """
-    filter_args = dict(
-        site=site,
-        date_for__gt=prev_day(start_date),
-        date_for__lt=next_day(end_date),
-        course_id=course_id
-    )
-
-    qs = CourseDailyMetrics.objects.filter(**filter_args)
-    if qs:
-        return qs.aggregate(max=Max('num_learners_completed'))['max']
-    else:
-        return 0
+    return COURSE_LEARNERS_COMPLETED.get_value(
+        site, start_date, end_date, course_id=course_id)
 
 
 def get_monthly_history_metric(func, site, date_for, months_back,
-                               include_current_in_history=True):
+                               include_current_in_history=True, **filter_args):
     """Convenience method to retrieve current and historic data
 
     Convenience function to populate monthly metrics data with history. Purpose
     is to provide a time series list of values for a particular metrics going
     back N months
+
+    If ``func`` is decorated with ``monthly_history_series``, the whole series
+    is read with one query, from the monthly rollup records if the metric has
+    them. Otherwise ``func`` is called for each month
     :param func: the function we call for each time point
     :param date_for: The most recent date for which we generate data. This is
     the "current month"
     :param months_back: How many months back to retrieve data
     :param include_current_in_history: flag to include the current month as well
     as previous months
+    :param filter_args: extra keyword arguments passed to ``func``, like
+    ``course_id`` for the course metrics
     :type func: Python function
     :type date_for: datetime.datetime, datetime.date, or date as a string
     :type months_back: integer
@@ -480,16 +495,21 @@ def get_monthly_history_metric(func, site, date_for, months_back,
 
     """
     date_for = as_date(date_for)
-    history = []
+    months = list(previous_months_iterator(month_for=date_for, months_back=months_back,))
 
-    for month in previous_months_iterator(month_for=date_for, months_back=months_back,):
-        period = period_str(month)
-        value = func(
+    if not months:
+        values = []
+    elif hasattr(func, 'monthly_history_series'):
+        values = func.monthly_history_series.get_monthly_values(
+            site, months, **filter_args)
+    else:
+        values = [func(
             site=site,
             start_date=datetime.date(month[0], month[1], 1),
             end_date=datetime.date(month[0], month[1], month[2]),
-        )
-        history.append(dict(period=period, value=value,))
+            **filter_args) for month in months]
+    history = [dict(period=period_str(month), value=value,)
+               for month, value in zip(months, values)]
 
     if history:
         # use the last entry
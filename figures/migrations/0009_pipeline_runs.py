@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0001_initial'),
+        ('figures', '0008_auto_20190510_0941'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineRun',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, verbose_name='created', editable=False)),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, verbose_name='modified', editable=False)),
+                ('date_for', models.DateField()),
+                ('status', models.CharField(default=b'STARTED', max_length=255, choices=[(b'STARTED', b'Started'), (b'FINISHED', b'Finished')])),
+                ('finished_at', models.DateTimeField(null=True, blank=True)),
+                ('site', models.ForeignKey(to='sites.Site')),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PipelineCourseRun',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, verbose_name='created', editable=False)),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, verbose_name='modified', editable=False)),
+                ('course_id', models.CharField(max_length=255)),
+                ('status', models.CharField(default=b'PENDING', max_length=255, choices=[(b'PENDING', b'Pending'), (b'STARTED', b'Started'), (b'SUCCEEDED', b'Succeeded'), (b'FAILED', b'Failed')])),
+                ('started_at', models.DateTimeField(null=True, blank=True)),
+                ('finished_at', models.DateTimeField(null=True, blank=True)),
+                ('learner_grades_count', models.IntegerField(null=True, blank=True)),
+                ('run', models.ForeignKey(related_name='course_runs', to='figures.PipelineRun')),
+            ],
+            options={
+                'ordering': ('run', 'course_id'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='pipelinecourserun',
+            unique_together=set([('run', 'course_id')]),
+        ),
+    ]
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Avg, Max
+from django.db.models.functions import TruncMonth
+import django.utils.timezone
+import model_utils.fields
+
+
+def populate_monthly_metrics(apps, schema_editor):
+    """Rolls up the existing daily metrics records by month
+    """
+    SiteDailyMetrics = apps.get_model('figures', 'SiteDailyMetrics')
+    CourseDailyMetrics = apps.get_model('figures', 'CourseDailyMetrics')
+    SiteMonthlyMetrics = apps.get_model('figures', 'SiteMonthlyMetrics')
+    CourseMonthlyMetrics = apps.get_model('figures', 'CourseMonthlyMetrics')
+
+    site_months = {}
+    for rec in SiteDailyMetrics.objects.annotate(
+            month_for=TruncMonth('date_for')).order_by().values(
+            'site_id', 'month_for').annotate(
+            total_user_count_max=Max('total_user_count'),
+            total_enrollment_count_max=Max('total_enrollment_count'),
+            course_count_max=Max('course_count')):
+        site_months[(rec['site_id'], rec['month_for'])] = dict(
+            total_user_count=rec['total_user_count_max'],
+            total_enrollment_count=rec['total_enrollment_count_max'],
+            course_count=rec['course_count_max'])
+    for rec in CourseDailyMetrics.objects.annotate(
+            month_for=TruncMonth('date_for')).order_by().values(
+            'site_id', 'month_for').annotate(
+            course_completions=Max('num_learners_completed')):
+        site_months.setdefault((rec['site_id'], rec['month_for']), {})[
+            'course_completions'] = rec['course_completions']
+    SiteMonthlyMetrics.objects.bulk_create([
+        SiteMonthlyMetrics(site_id=site_id, month_for=month_for, **values)
+        for (site_id, month_for), values in site_months.items()])
+
+    CourseMonthlyMetrics.objects.bulk_create([
+        CourseMonthlyMetrics(
+            site_id=rec['site_id'],
+            course_id=rec['course_id'],
+            month_for=rec['month_for'],
+            enrollment_count=rec['enrollment_count_max'],
+            average_progress=rec['average_progress_avg'],
+            average_days_to_complete=rec['average_days_to_complete_avg'],
+            num_learners_completed=rec['num_learners_completed_max'])
+        for rec in CourseDailyMetrics.objects.annotate(
+            month_for=TruncMonth('date_for')).order_by().values(
+            'site_id', 'course_id', 'month_for').annotate(
+            enrollment_count_max=Max('enrollment_count'),
+            average_progress_avg=Avg('average_progress'),
+            average_days_to_complete_avg=Avg('average_days_to_complete'),
+            num_learners_completed_max=Max('num_learners_completed'))])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0001_initial'),
+        ('figures', '0011_course_details_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseMonthlyMetrics',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, verbose_name='created', editable=False)),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, verbose_name='modified', editable=False)),
+                ('course_id', models.CharField(max_length=255)),
+                ('month_for', models.DateField()),
+                ('enrollment_count', models.IntegerField(null=True, blank=True)),
+                ('average_progress', models.DecimalField(null=True, max_digits=12, decimal_places=6, blank=True)),
+                ('average_days_to_complete', models.FloatField(null=True, blank=True)),
+                ('num_learners_completed', models.IntegerField(null=True, blank=True)),
+                ('site', models.ForeignKey(to='sites.Site')),
+            ],
+            options={
+                'ordering': ('-month_for', 'course_id'),
+            },
+        ),
+        migrations.CreateModel(
+            name='SiteMonthlyMetrics',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, verbose_name='created', editable=False)),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, verbose_name='modified', editable=False)),
+                ('month_for', models.DateField()),
+                ('total_user_count', models.IntegerField(null=True, blank=True)),
+                ('total_enrollment_count', models.IntegerField(null=True, blank=True)),
+                ('course_count', models.IntegerField(null=True, blank=True)),
+                ('course_completions', models.IntegerField(null=True, blank=True)),
+                ('site', models.ForeignKey(to='sites.Site')),
+            ],
+            options={
+                'ordering': ('-month_for', 'site'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='sitemonthlymetrics',
+            unique_together=set([('site', 'month_for')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='coursemonthlymetrics',
+            unique_together=set([('site', 'course_id', 'month_for')]),
+        ),
+        migrations.RunPython(populate_monthly_metrics, migrations.RunPython.noop),
+    ]
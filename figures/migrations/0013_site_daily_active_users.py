@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0001_initial'),
+        ('figures', '0012_monthly_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiteDailyActiveUsers',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, verbose_name='created', editable=False)),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, verbose_name='modified', editable=False)),
+                ('date_for', models.DateField()),
+                ('user_count', models.IntegerField()),
+                ('user_ids', models.BinaryField()),
+                ('site', models.ForeignKey(to='sites.Site')),
+            ],
+            options={
+                'ordering': ('-date_for', 'site'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='sitedailyactiveusers',
+            unique_together=set([('site', 'date_for')]),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.utils.timezone
+import model_utils.fields
+
+
+BATCH_SIZE = 1000
+
+
+def populate_snapshots(apps, schema_editor):
+    """Copies the most recent grade metrics record of each learner and course
+
+    The records are streamed and the snapshots written every ``BATCH_SIZE``
+    rows, so memory use doesn't grow with the grade metrics table
+    """
+    LearnerCourseGradeMetrics = apps.get_model('figures', 'LearnerCourseGradeMetrics')
+    LearnerCourseGradeSnapshot = apps.get_model('figures', 'LearnerCourseGradeSnapshot')
+
+    most_recent_date_for = LearnerCourseGradeMetrics.objects.filter(
+        user_id=OuterRef('user_id'),
+        course_id=OuterRef('course_id')).order_by('-date_for').values('date_for')[:1]
+    snapshots = []
+    for obj in LearnerCourseGradeMetrics.objects.filter(
+            user__isnull=False,
+            date_for=Subquery(most_recent_date_for)).iterator():
+        snapshots.append(LearnerCourseGradeSnapshot(
+            site_id=obj.site_id,
+            date_for=obj.date_for,
+            user_id=obj.user_id,
+            course_id=obj.course_id,
+            points_possible=obj.points_possible,
+            points_earned=obj.points_earned,
+            sections_worked=obj.sections_worked,
+            sections_possible=obj.sections_possible))
+        if len(snapshots) >= BATCH_SIZE:
+            LearnerCourseGradeSnapshot.objects.bulk_create(snapshots)
+            snapshots = []
+    LearnerCourseGradeSnapshot.objects.bulk_create(snapshots)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('sites', '0001_initial'),
+        ('figures', '0013_site_daily_active_users'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LearnerCourseGradeSnapshot',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, verbose_name='created', editable=False)),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, verbose_name='modified', editable=False)),
+                ('date_for', models.DateField()),
+                ('course_id', models.CharField(max_length=255)),
+                ('points_possible', models.FloatField()),
+                ('points_earned', models.FloatField()),
+                ('sections_worked', models.IntegerField()),
+                ('sections_possible', models.IntegerField()),
+                ('site', models.ForeignKey(to='sites.Site')),
+                ('user', models.ForeignKey(to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('user', 'course_id'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='learnercoursegradesnapshot',
+            unique_together=set([('user', 'course_id')]),
+        ),
+        migrations.RunPython(populate_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def delete_duplicate_site_daily_metrics(apps, schema_editor):
+    """Keeps the most recently modified SiteDailyMetrics record of each site
+    and date
+    """
+    SiteDailyMetrics = apps.get_model('figures', 'SiteDailyMetrics')
+    duplicates = SiteDailyMetrics.objects.order_by().values(
+        'site_id', 'date_for').annotate(records=Count('id')).filter(records__gt=1)
+    for rec in duplicates:
+        kept = SiteDailyMetrics.objects.filter(
+            site_id=rec['site_id'],
+            date_for=rec['date_for']).order_by('-modified', '-id').first()
+        SiteDailyMetrics.objects.filter(
+            site_id=rec['site_id'],
+            date_for=rec['date_for']).exclude(id=kept.id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0001_initial'),
+        ('figures', '0014_learner_course_grade_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_site_daily_metrics, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='sitedailymetrics',
+            unique_together=set([('site', 'date_for')]),
+        ),
+        migrations.AddIndex(
+            model_name='coursedailymetrics',
+            index=models.Index(fields=['site', 'date_for'], name='figures_cdm_site_date'),
+        ),
+        migrations.AddIndex(
+            model_name='coursedailymetrics',
+            index=models.Index(fields=['site', 'course_id', 'date_for'], name='figures_cdm_site_course_date'),
+        ),
+        migrations.AddIndex(
+            model_name='learnercoursegrademetrics',
+            index=models.Index(fields=['course_id', 'date_for'], name='figures_lcgm_course_date'),
+        ),
+        migrations.AddIndex(
+            model_name='learnercoursegradesnapshot',
+            index=models.Index(fields=['course_id', 'date_for'], name='figures_lcgs_course_date'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import jsonfield.fields
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('sites', '0001_initial'),
+        ('figures', '0016_org_user_membership'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, verbose_name='created', editable=False)),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, verbose_name='modified', editable=False)),
+                ('org', models.CharField(max_length=255, blank=True)),
+                ('report_type', models.CharField(max_length=255, choices=[('learner_progress', 'Learner progress'), ('course_details', 'Course details')])),
+                ('filters', jsonfield.fields.JSONField()),
+                ('filters_hash', models.CharField(max_length=40)),
+                ('date_for', models.DateField()),
+                ('status', models.CharField(default='PENDING', max_length=255, choices=[('PENDING', 'Pending'), ('STARTED', 'Started'), ('SUCCEEDED', 'Succeeded'), ('FAILED', 'Failed')])),
+                ('result_file', models.FileField(upload_to='figures/reports', blank=True)),
+                ('row_count', models.IntegerField(null=True, blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('finished_at', models.DateTimeField(null=True, blank=True)),
+                ('restricted_to', models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to=settings.AUTH_USER_MODEL, null=True)),
+                ('site', models.ForeignKey(to='sites.Site')),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='reportjob',
+            unique_together=set([('site', 'org', 'report_type', 'filters_hash', 'date_for')]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('figures', '0017_report_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrgUserMembershipLoad',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, verbose_name='created', editable=False)),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, verbose_name='modified', editable=False)),
+                ('loaded_until', models.DateTimeField()),
+                ('created_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-loaded_until'],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import struct
+import zlib
+
+from django.db import migrations
+
+
+def unpack_bitmap(data):
+    '''Returns the user ids of a bitmap stored by migration 0013's pipeline
+
+    The bitmap is a zlib compressed big-endian integer with the bit of each
+    user id set
+    '''
+    raw = bytearray(zlib.decompress(bytes(data)) if data else b'')
+    raw.reverse()
+    return [i * 8 + bit for i, byte in enumerate(raw)
+            for bit in range(8) if byte & (1 << bit)]
+
+
+def pack_user_ids(user_ids):
+    '''Copy of ``figures.user_id_sets.pack_user_ids`` when this migration was
+    written
+    '''
+    deltas = []
+    prev_id = 0
+    for user_id in sorted(set(user_ids)):
+        deltas.append(user_id - prev_id)
+        prev_id = user_id
+    return zlib.compress(struct.pack('<{}I'.format(len(deltas)), *deltas))
+
+
+def convert_bitmaps(apps, schema_editor):
+    '''Stores the active users of each day as a packed id list
+    '''
+    SiteDailyActiveUsers = apps.get_model('figures', 'SiteDailyActiveUsers')
+    for rec_id, data in SiteDailyActiveUsers.objects.values_list(
+            'id', 'user_ids').iterator():
+        SiteDailyActiveUsers.objects.filter(id=rec_id).update(
+            user_ids=pack_user_ids(unpack_bitmap(data)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('figures', '0018_org_user_membership_load'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_bitmaps, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('figures', '0019_site_daily_active_users_id_lists'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orgusermembershipload',
+            name='deleted_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
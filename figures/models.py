@@ -6,6 +6,7 @@ from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models import OuterRef, Subquery
 from django.utils.encoding import python_2_unicode_compatible
 
 from jsonfield import JSONField
@@ -43,11 +44,24 @@ class CourseDailyMetrics(TimeStampedModel):
         )
 
     average_days_to_complete = models.IntegerField(blank=True, null=True)
+    # Distribution of the days to complete, as the average alone hides the
+    # spread between fast and slow learners
+    median_days_to_complete = models.IntegerField(blank=True, null=True)
+    days_to_complete_p25 = models.IntegerField(blank=True, null=True)
+    days_to_complete_p75 = models.IntegerField(blank=True, null=True)
+    days_to_complete_p90 = models.IntegerField(blank=True, null=True)
     num_learners_completed = models.IntegerField()
 
     class Meta:
         unique_together = ('course_id', 'date_for',)
         ordering = ('-date_for', 'course_id',)
+        # The site metrics filter by site and date range and the course
+        # metrics by site, course and date range
+        indexes = [
+            models.Index(fields=['site', 'date_for'], name='figures_cdm_site_date'),
+            models.Index(fields=['site', 'course_id', 'date_for'],
+                         name='figures_cdm_site_course_date'),
+        ]
 
     # Any other data we want?
 
@@ -72,18 +86,7 @@ class SiteDailyMetrics(TimeStampedModel):
     total_enrollment_count = models.IntegerField()
 
     class Meta:
-        """
-        SiteDailyMetrics view and serializer tests fail when we include 'site'
-        in the `unique_together` fields:
-
-            unique_together = ['site', 'date_for']
-
-            ValueError: Cannot assign "1": "SiteDailyMetrics.site" must be a
-            "Site" instance
-
-        Since we do want to constrain uniqueness per site+day, we'll need to fix
-        this
-        """
+        unique_together = ('site', 'date_for',)
         ordering = ['-date_for', 'site']
 
     def __str__(self):
@@ -91,6 +94,36 @@ class SiteDailyMetrics(TimeStampedModel):
             self.id, self.date_for, self.site.domain)
 
 
+class LearnerCourseGradesMixin(object):
+    """Progress properties for the models storing learner course grades
+    """
+    @property
+    def progress_percent(self):
+        """Returns the sections worked divided by the sections possible
+
+        If sections possible is zero then returns 0
+
+        Sections possible can be zero when there are no graded sections in a
+        course.
+        """
+        if self.sections_possible:
+            return float(self.sections_worked) / float(self.sections_possible)
+        else:
+            return 0.0
+
+    @property
+    def progress_details(self):
+        """This method gets the progress details.
+        This method is a temporary fix until the serializers are updated.
+        """
+        return dict(
+            points_possible=self.points_possible,
+            points_earned=self.points_earned,
+            sections_worked=self.sections_worked,
+            sections_possible=self.sections_possible,
+        )
+
+
 class LearnerCourseGradeMetricsManager(models.Manager):
     """Custom model manager for LearnerCourseGrades model
     """
@@ -98,9 +131,25 @@ class LearnerCourseGradeMetricsManager(models.Manager):
         return self.filter(
             user=user, course_id=str(course_id)).order_by('-date_for').first()
 
+    def as_of(self, date_for, **filter_args):
+        """Returns the most recent record of each learner and course on or
+        before ``date_for``
+
+        Records are only written when a learner's grades change and older
+        history is compacted, so a date may have no record for a learner.
+        Their grades on that date are the ones of their previous record
+        """
+        most_recent_date_for = self.filter(
+            user_id=OuterRef('user_id'),
+            course_id=OuterRef('course_id'),
+            date_for__lte=date_for).order_by('-date_for').values('date_for')[:1]
+        return self.filter(
+            date_for__lte=date_for, **filter_args).filter(
+            date_for=Subquery(most_recent_date_for))
+
 
 @python_2_unicode_compatible
-class LearnerCourseGradeMetrics(TimeStampedModel):
+class LearnerCourseGradeMetrics(LearnerCourseGradesMixin, TimeStampedModel):
     """This model stores metrics for a learner and course on a given date
 
     THIS MODEL IS EVOLVING
@@ -108,6 +157,12 @@ class LearnerCourseGradeMetrics(TimeStampedModel):
     Purpose is primarliy to improve performance for the front end. In addition,
     data collected can be used for course progress over time
 
+    A record is only written when the learner's points or sections change
+    from their previous record, see ``figures.pipeline.loaders``. Records
+    older than the daily retention window are compacted, see
+    ``figures.pipeline.grade_metrics_compaction``. Use ``objects.as_of`` to
+    read the grades on a date
+
     We're capturing data from figures.metrics.LearnerCourseGrades
 
     Note: We're probably going to move ``LearnerCourseGrades`` to figures.pipeline
@@ -139,36 +194,109 @@ class LearnerCourseGradeMetrics(TimeStampedModel):
     class Meta:
         unique_together = ('user', 'course_id', 'date_for',)
         ordering = ('date_for', 'user__username', 'course_id',)
+        # The unique index serves the per learner reads. Course wide reads
+        # filter by course and date
+        indexes = [
+            models.Index(fields=['course_id', 'date_for'], name='figures_lcgm_course_date'),
+        ]
 
     def __str__(self):
         return "{} {} {} {}".format(
             self.id, self.date_for, self.user.username, self.course_id)
 
-    @property
-    def progress_percent(self):
-        """Returns the sections worked divided by the sections possible
 
-        If sections possible is zero then returns 0
-
-        Sections possible can be zero when there are no graded sections in a
-        course.
-        """
-        if self.sections_possible:
-            return float(self.sections_worked) / float(self.sections_possible)
-        else:
-            return 0.0
+class LearnerCourseGradeSnapshotManager(models.Manager):
+    """Custom model manager for the LearnerCourseGradeSnapshot model
+    """
+    def for_learner_courses(self, learner_courses):
+        """Returns the snapshots for (user id, course id) pairs with one query
 
-    @property
-    def progress_details(self):
-        """This method gets the progress details.
-        This method is a temporary fix until the serializers are updated.
+        Returns a dict of (user id, course id string) to snapshot. Pairs
+        without a snapshot are left out
         """
+        keys = set((user_id, str(course_id)) for user_id, course_id in learner_courses)
+        if not keys:
+            return {}
+        snapshots = self.filter(
+            user_id__in=set(key[0] for key in keys),
+            course_id__in=set(key[1] for key in keys))
         return dict(
-            points_possible=self.points_possible,
-            points_earned=self.points_earned,
-            sections_worked=self.sections_worked,
-            sections_possible=self.sections_possible,
-        )
+            ((obj.user_id, obj.course_id), obj) for obj in snapshots
+            if (obj.user_id, obj.course_id) in keys)
+
+
+@python_2_unicode_compatible
+class LearnerCourseGradeSnapshot(LearnerCourseGradesMixin, TimeStampedModel):
+    """The most recent grade metrics of a learner in a course
+
+    This model holds a copy of the most recent ``LearnerCourseGradeMetrics``
+    record of a learner, so reading a learner's current progress is a unique
+    key lookup. The pipeline updates it when it saves the grade metrics.
+    ``date_for`` is the last date the grades were saved for, which is later
+    than the date of the copied record when the grades have not changed since
+    """
+    site = models.ForeignKey(Site)
+    date_for = models.DateField()
+    user = models.ForeignKey(settings.AUTH_USER_MODEL)
+    course_id = models.CharField(max_length=255)
+    points_possible = models.FloatField()
+    points_earned = models.FloatField()
+    sections_worked = models.IntegerField()
+    sections_possible = models.IntegerField()
+
+    objects = LearnerCourseGradeSnapshotManager()
+
+    class Meta:
+        unique_together = ('user', 'course_id',)
+        ordering = ('user', 'course_id',)
+        indexes = [
+            models.Index(fields=['course_id', 'date_for'], name='figures_lcgs_course_date'),
+        ]
+
+    def __str__(self):
+        return "{} {} {} {}".format(
+            self.id, self.date_for, self.user_id, self.course_id)
+
+
+@python_2_unicode_compatible
+class OrgUserMembership(TimeStampedModel):
+    """A user enrolled in a course of a TMA microsite org
+
+    Holds the distinct (org, user) pairs of the enrollments in the non
+    Vodeclic courses, so the users of a microsite are read by the indexed org
+    instead of joining the enrollments to the course overviews. ``org`` is the
+    ``CourseOverview.org`` of the enrolled course. Enrollment signals and the
+    pipeline maintain it, see ``figures.pipeline.org_user_memberships``
+    """
+    org = models.CharField(max_length=255)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL)
+
+    class Meta:
+        unique_together = ('org', 'user',)
+        ordering = ('org', 'user',)
+
+    def __str__(self):
+        return "{} {} {}".format(self.id, self.org, self.user_id)
+
+
+@python_2_unicode_compatible
+class OrgUserMembershipLoad(TimeStampedModel):
+    """A pipeline load of the ``OrgUserMembership`` table
+
+    ``loaded_until`` is the high-water mark of the load: the memberships of
+    all the enrollments created before it were loaded. Until the first load
+    has run, the table only holds the memberships the enrollment signals
+    added, and ``figures.sites.get_users_for_org`` does not read it
+    """
+    loaded_until = models.DateTimeField()
+    created_count = models.IntegerField(default=0)
+    deleted_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-loaded_until']
+
+    def __str__(self):
+        return "{} {} {}".format(self.id, self.loaded_until, self.created_count)
 
 
 class PipelineError(TimeStampedModel):
@@ -201,3 +329,227 @@ class PipelineError(TimeStampedModel):
 
     def __str__(self):
         return "{}, {}, {}".format(self.id, self.created, self.error_type)
+
+
+@python_2_unicode_compatible
+class PipelineRun(TimeStampedModel):
+    """
+    Tracks a run of the Figures daily metrics pipeline for a site and date
+
+    The course level progress is stored in ``PipelineCourseRun`` records. These
+    serve as checkpoints so that an interrupted run can be resumed without
+    reprocessing the courses it already completed
+    """
+    STARTED = 'STARTED'
+    FINISHED = 'FINISHED'
+
+    STATUS_CHOICES = (
+        (STARTED, 'Started'),
+        (FINISHED, 'Finished'),
+        )
+    site = models.ForeignKey(Site)
+    date_for = models.DateField()
+    status = models.CharField(
+        max_length=255, choices=STATUS_CHOICES, default=STARTED)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return "id:{}, date_for:{}, site:{}, status:{}".format(
+            self.id, self.date_for, self.site.domain, self.status)
+
+
+@python_2_unicode_compatible
+class PipelineCourseRun(TimeStampedModel):
+    """
+    Checkpoint for a course processed in a ``PipelineRun``
+    """
+    PENDING = 'PENDING'
+    STARTED = 'STARTED'
+    SUCCEEDED = 'SUCCEEDED'
+    FAILED = 'FAILED'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (STARTED, 'Started'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        )
+    run = models.ForeignKey(PipelineRun, related_name='course_runs')
+    course_id = models.CharField(max_length=255)
+    status = models.CharField(
+        max_length=255, choices=STATUS_CHOICES, default=PENDING)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    # Number of learners with grade metrics saved for the course and date
+    learner_grades_count = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('run', 'course_id',)
+        ordering = ('run', 'course_id',)
+
+    def __str__(self):
+        return "id:{}, run:{}, course_id:{}, status:{}".format(
+            self.id, self.run_id, self.course_id, self.status)
+
+    @property
+    def elapsed_seconds(self):
+        if self.started_at and self.finished_at:
+            return (self.finished_at - self.started_at).total_seconds()
+
+
+@python_2_unicode_compatible
+class CourseDetailsSnapshot(TimeStampedModel):
+    """
+    Precomputed course details data, served by the course details endpoint
+
+    ``data`` holds the ``CourseDetailsSerializer`` output for the course,
+    including the monthly metric histories. The pipeline refreshes the
+    snapshot for each course after populating its daily metrics
+    """
+    site = models.ForeignKey(Site)
+    course_id = models.CharField(max_length=255, unique=True)
+    date_for = models.DateField()
+    data = JSONField()
+
+    class Meta:
+        ordering = ('course_id',)
+
+    def __str__(self):
+        return "id:{}, course_id:{}, date_for:{}".format(
+            self.id, self.course_id, self.date_for)
+
+
+@python_2_unicode_compatible
+class SiteMonthlyMetrics(TimeStampedModel):
+    """
+    Rollup of the SiteDailyMetrics records for a site and calendar month
+
+    ``month_for`` is the first day of the month. The values are the raw
+    aggregates of the daily records the ``figures.metrics`` monthly metrics
+    read. The pipeline recomputes the month whenever it writes daily records
+    for it, so closed months stay as they are while the current month is
+    refreshed each night
+    """
+    site = models.ForeignKey(Site)
+    month_for = models.DateField()
+    total_user_count = models.IntegerField(blank=True, null=True)
+    total_enrollment_count = models.IntegerField(blank=True, null=True)
+    course_count = models.IntegerField(blank=True, null=True)
+    course_completions = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('site', 'month_for',)
+        ordering = ('-month_for', 'site',)
+
+    def __str__(self):
+        return "id:{}, month_for:{}, site:{}".format(
+            self.id, self.month_for, self.site.domain)
+
+
+@python_2_unicode_compatible
+class CourseMonthlyMetrics(TimeStampedModel):
+    """
+    Rollup of the CourseDailyMetrics records for a course and calendar month
+
+    See ``SiteMonthlyMetrics``
+    """
+    site = models.ForeignKey(Site)
+    course_id = models.CharField(max_length=255)
+    month_for = models.DateField()
+    enrollment_count = models.IntegerField(blank=True, null=True)
+    average_progress = models.DecimalField(
+        max_digits=12, decimal_places=6, blank=True, null=True)
+    average_days_to_complete = models.FloatField(blank=True, null=True)
+    num_learners_completed = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('site', 'course_id', 'month_for',)
+        ordering = ('-month_for', 'course_id',)
+
+    def __str__(self):
+        return "id:{}, month_for:{}, course_id:{}".format(
+            self.id, self.month_for, self.course_id)
+
+
+@python_2_unicode_compatible
+class SiteDailyActiveUsers(TimeStampedModel):
+    """
+    The users active on a site on a given day
+
+    ``user_ids`` holds the ids of the users with courseware activity on the
+    day, serialized by ``figures.user_id_sets.pack_user_ids``, and their
+    number in ``user_count``. The active users of any date range are the union
+    of its days' users, so the dashboard counts monthly active users without
+    reading courseware records
+    """
+    site = models.ForeignKey(Site)
+    date_for = models.DateField()
+    user_count = models.IntegerField()
+    user_ids = models.BinaryField()
+
+    class Meta:
+        unique_together = ('site', 'date_for',)
+        ordering = ('-date_for', 'site',)
+
+    def __str__(self):
+        return "id:{}, date_for:{}, site:{}, user_count:{}".format(
+            self.id, self.date_for, self.site.domain, self.user_count)
+
+
+@python_2_unicode_compatible
+class ReportJob(TimeStampedModel):
+    """
+    A report built by a Celery task and stored as a gzip CSV file
+
+    Jobs are deduplicated on the site, org, report type, filters and date, so
+    requesting the same report again returns the existing job and its file.
+    ``restricted_to`` is the user the report is restricted to, for users
+    without staff access. It is part of ``filters_hash``. The task building
+    the report updates ``heartbeat_at`` while it runs. See
+    ``figures.reports``
+    """
+    PENDING = 'PENDING'
+    STARTED = 'STARTED'
+    SUCCEEDED = 'SUCCEEDED'
+    FAILED = 'FAILED'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (STARTED, 'Started'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        )
+
+    LEARNER_PROGRESS = 'learner_progress'
+    COURSE_DETAILS = 'course_details'
+
+    REPORT_TYPE_CHOICES = (
+        (LEARNER_PROGRESS, 'Learner progress'),
+        (COURSE_DETAILS, 'Course details'),
+        )
+    site = models.ForeignKey(Site)
+    org = models.CharField(max_length=255, blank=True)
+    report_type = models.CharField(max_length=255, choices=REPORT_TYPE_CHOICES)
+    filters = JSONField()
+    filters_hash = models.CharField(max_length=40)
+    date_for = models.DateField()
+    restricted_to = models.ForeignKey(
+        settings.AUTH_USER_MODEL, blank=True, null=True, on_delete=models.SET_NULL)
+    status = models.CharField(
+        max_length=255, choices=STATUS_CHOICES, default=PENDING)
+    result_file = models.FileField(upload_to='figures/reports', blank=True)
+    row_count = models.IntegerField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('site', 'org', 'report_type', 'filters_hash', 'date_for',)
+        ordering = ['-created']
+
+    def __str__(self):
+        return "id:{}, report_type:{}, date_for:{}, site:{}, status:{}".format(
+            self.id, self.report_type, self.date_for, self.site.domain, self.status)
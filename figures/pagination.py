@@ -2,10 +2,25 @@
 
 '''
 
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
 
 
 class FiguresLimitOffsetPagination(LimitOffsetPagination):
     '''Custom Figures paginator to make the number of records returned consistent
     '''
     default_limit = None
+
+
+class FiguresKeysetPagination(CursorPagination):
+    '''Cursor paginator for the user and enrollment endpoints
+
+    Pages are ordered on the primary key and each page is read with a
+    ``WHERE id > <last id of the previous page>`` query, so a page costs the
+    same however deep the client pages. Clients follow the ``next`` links.
+    There is no total count. The page size can be set with the ``page_size``
+    query parameter, up to ``max_page_size``
+    '''
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -0,0 +1,379 @@
+'''Backfills CourseDailyMetrics and SiteDailyMetrics for a range of dates
+
+Running the daily pipeline once per day to fill in history extracts all the
+source data again for every day. Instead, the backfill reads each source table
+once for the whole date range, buckets the rows by day and bulk creates the
+daily metrics records.
+
+Differences from the daily pipeline:
+
+* Learner grades are not read. Historical grades are not available, so the
+  course average progress for a day comes from the LearnerCourseGradeMetrics
+  history. A learner's progress on a day is their most recent record on or
+  before the day, as records are only written when grades change. It is left
+  empty until the course has a record
+* Learner grade metrics records are not created
+
+'''
+
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+from courseware.models import StudentModule
+from student.models import (
+    CourseAccessRole,
+    CourseEnrollment,
+    CourseEnrollmentAllowed,
+)
+
+from figures.compat import GeneratedCertificate
+from figures.course_roles import EXCLUDED_COURSE_ROLES
+from figures.helpers import (
+    as_course_key,
+    as_date,
+    as_datetime,
+    days_from,
+    next_day,
+    pipeline_batch_size,
+)
+from figures.models import (
+    CourseDailyMetrics,
+    LearnerCourseGradeMetrics,
+    SiteDailyActiveUsers,
+    SiteDailyMetrics,
+)
+from figures.pipeline.course_daily_metrics import (
+    as_rounded_int,
+    calc_average_days_to_complete,
+    calc_days_to_complete_distribution,
+)
+from figures.pipeline.monthly_metrics import update_monthly_metrics
+from figures.pipeline.site_daily_metrics import (
+    get_previous_cumulative_active_user_count,
+)
+from figures.site_metrics_cache import invalidate_site_metrics
+import figures.sites
+from figures.user_id_sets import pack_user_ids
+
+
+def date_range(start_date, end_date):
+    '''Returns the list of dates from ``start_date`` to ``end_date`` inclusive
+    '''
+    start_date = as_date(start_date)
+    return [days_from(start_date, i)
+            for i in range((as_date(end_date) - start_date).days + 1)]
+
+
+def cumulative_daily_counts(queryset, field, days):
+    '''Returns a dict of day to the count of records created before the day ends
+
+    ``field`` is the datetime field holding the record creation time. Uses one
+    count for the records before the first day and one query grouped by day
+    for the records in the date range
+    '''
+    total = queryset.filter(**{field + '__lt': as_datetime(days[0])}).count()
+    per_day = dict(queryset.filter(**{
+        field + '__gte': as_datetime(days[0]),
+        field + '__lt': as_datetime(next_day(days[-1])),
+        }).annotate(day=TruncDate(field)).order_by().values_list(
+        'day').annotate(count=Count('id')))
+    counts = {}
+    for day in days:
+        total += per_day.get(day, 0)
+        counts[day] = total
+    return counts
+
+
+class CourseSourceData(object):
+    '''Source data for the courses of a site, read once for the date range
+
+    Enrollments and certificates are kept in memory as sorted lists per course
+    so counts for any day are a binary search. Active learners and average
+    progress are grouped by day in the database
+    '''
+    def __init__(self, course_ids, days):
+        self.course_keys = [as_course_key(course_id) for course_id in course_ids]
+        self.course_ids = [str(course_key) for course_key in self.course_keys]
+        self.days = days
+        self.end = as_datetime(next_day(days[-1]))
+        self.load_enrollments()
+        self.load_certificates()
+        self.load_active_learners()
+        self.load_average_progress()
+        self.invited_counts = {
+            course_id: CourseEnrollmentAllowed.may_enroll_and_unenrolled(
+                course_id).count() for course_id in self.course_ids
+        }
+
+    def load_enrollments(self):
+        excluded = set(
+            (str(course_id), user_id) for course_id, user_id in
+            CourseAccessRole.objects.filter(
+                course_id__in=self.course_keys,
+                role__in=EXCLUDED_COURSE_ROLES).values_list('course_id', 'user_id'))
+        self.enrolled = defaultdict(list)
+        self.enrollment_created = {}
+        enrollments = CourseEnrollment.objects.filter(
+            course_id__in=self.course_keys,
+            created__lt=self.end).values_list(
+            'course_id', 'user_id', 'created', 'is_active')
+        for course_id, user_id, created, is_active in enrollments.iterator():
+            key = (str(course_id), user_id)
+            self.enrollment_created.setdefault(key, created)
+            if is_active and key not in excluded:
+                self.enrolled[key[0]].append(created)
+        for created_list in self.enrolled.values():
+            created_list.sort()
+
+    def load_certificates(self):
+        '''Collects certificate dates and days to complete per course
+        '''
+        self.certificate_dates = defaultdict(list)
+        completions = defaultdict(list)
+        certificates = GeneratedCertificate.objects.filter(
+            course_id__in=self.course_keys,
+            created_date__lt=self.end).values_list(
+            'course_id', 'user_id', 'created_date')
+        for course_id, user_id, created_date in certificates.iterator():
+            course_id = str(course_id)
+            self.certificate_dates[course_id].append(created_date)
+            enrolled = self.enrollment_created.get((course_id, user_id))
+            if enrolled:
+                completions[course_id].append((created_date, (created_date - enrolled).days))
+        for dates in self.certificate_dates.values():
+            dates.sort()
+        # Days to complete stats for each day. Like ``get_days_to_complete``,
+        # a day counts the completions up to its start
+        self.days_to_complete = {}
+        for course_id, course_completions in completions.items():
+            course_completions.sort()
+            completed_days = []
+            i = 0
+            for day in self.days:
+                while (i < len(course_completions) and
+                       course_completions[i][0] <= as_datetime(day)):
+                    insort(completed_days, course_completions[i][1])
+                    i += 1
+                stats = calc_days_to_complete_distribution(completed_days)
+                stats['average_days_to_complete'] = calc_average_days_to_complete(
+                    completed_days)
+                self.days_to_complete[(course_id, day)] = stats
+
+    def load_active_learners(self):
+        self.active_learners = dict(
+            ((str(rec['course_id']), rec['day']), rec['learners']) for rec in
+            StudentModule.objects.filter(
+                course_id__in=self.course_keys,
+                modified__gte=as_datetime(self.days[0]),
+                modified__lt=self.end,
+            ).annotate(day=TruncDate('modified')).order_by().values(
+                'course_id', 'day').annotate(learners=Count('student_id', distinct=True)))
+
+    def load_average_progress(self):
+        '''Collects the average progress of each course and day
+
+        The grades on the first day are each learner's most recent record on
+        or before it. Only the records of the later days are read after that,
+        so the history before the days is never loaded
+        '''
+        fields = ('course_id', 'user_id', 'date_for', 'sections_worked', 'sections_possible')
+        seed = LearnerCourseGradeMetrics.objects.as_of(
+            self.days[0], course_id__in=self.course_ids)
+        changes = LearnerCourseGradeMetrics.objects.filter(
+            course_id__in=self.course_ids,
+            date_for__gt=self.days[0],
+            date_for__lte=self.days[-1],
+        ).order_by('date_for')
+        history = defaultdict(list)
+        for records in (seed, changes):
+            for course_id, user_id, date_for, sections_worked, sections_possible in (
+                    records.values_list(*fields).iterator()):
+                progress = (float(sections_worked) / sections_possible
+                            if sections_possible else 0.0)
+                history[course_id].append((date_for, user_id, progress))
+        self.average_progress = {}
+        for course_id, records in history.items():
+            learners = {}
+            index = 0
+            for day in self.days:
+                while index < len(records) and records[index][0] <= day:
+                    learners[records[index][1]] = records[index][2]
+                    index += 1
+                if learners:
+                    self.average_progress[(course_id, day)] = (
+                        sum(learners.values()) / len(learners))
+
+    def course_daily_data(self, course_id, day):
+        '''Returns the CourseDailyMetrics field values for the course and day
+        '''
+        day_end = as_datetime(next_day(day))
+        days_to_complete = dict(
+            (field, as_rounded_int(value)) for field, value in
+            self.days_to_complete.get((course_id, day), {}).items())
+        average_progress = self.average_progress.get((course_id, day))
+        if average_progress is not None:
+            average_progress = str(round(average_progress, 2))
+        return dict(
+            enrollment_count=bisect_left(
+                self.enrolled.get(course_id, []), day_end) + self.invited_counts[course_id],
+            active_learners_today=self.active_learners.get((course_id, day), 0),
+            average_progress=average_progress,
+            average_days_to_complete=days_to_complete.pop('average_days_to_complete', 0),
+            num_learners_completed=bisect_left(
+                self.certificate_dates.get(course_id, []), day_end),
+            **days_to_complete)
+
+
+def backfill_course_daily_metrics(course_ids, days, force_update=False):
+    '''Creates the CourseDailyMetrics records for the courses and days
+
+    Existing records are kept unless ``force_update`` is true, in which case
+    they are replaced. Returns the list of records for the courses and days
+    '''
+    source = CourseSourceData(course_ids=course_ids, days=days)
+    existing = CourseDailyMetrics.objects.filter(
+        course_id__in=source.course_ids,
+        date_for__gte=days[0],
+        date_for__lte=days[-1])
+    if force_update:
+        existing.delete()
+        kept = []
+    else:
+        kept = list(existing)
+    kept_keys = set((cdm.course_id, cdm.date_for) for cdm in kept)
+
+    new_records = []
+    for course_id in source.course_ids:
+        site = figures.sites.get_org_for_course(course_id)
+        for day in days:
+            if (course_id, day) not in kept_keys:
+                new_records.append(CourseDailyMetrics(
+                    site=site,
+                    course_id=course_id,
+                    date_for=day,
+                    **source.course_daily_data(course_id, day)))
+    CourseDailyMetrics.objects.bulk_create(new_records, batch_size=pipeline_batch_size())
+    return kept + new_records
+
+
+def backfill_site_daily_metrics(site, days, course_daily_metrics, force_update=False,
+                                site_context=None):
+    '''Creates the SiteDailyMetrics records for the site and days
+
+    Site totals for a day are summed from the ``course_daily_metrics`` of the
+    site, as the daily pipeline does. The records of other sites are skipped,
+    as in TMA microsite mode every site sees all the courses. Returns the
+    number of records created
+    '''
+    site_context = site_context or figures.sites.SiteContext(site)
+    existing = SiteDailyMetrics.objects.filter(
+        site=site, date_for__gte=days[0], date_for__lte=days[-1])
+    if force_update:
+        existing.delete()
+        kept = {}
+    else:
+        kept = dict((sdm.date_for, sdm) for sdm in existing)
+
+    active_users = defaultdict(int)
+    enrollments = defaultdict(int)
+    for cdm in course_daily_metrics:
+        if cdm.site_id != site.id:
+            continue
+        active_users[cdm.date_for] += cdm.active_learners_today
+        enrollments[cdm.date_for] += cdm.enrollment_count
+
+    # The TMA org of the site is the SiteContext org
+    user_counts = cumulative_daily_counts(site_context.org_users, 'date_joined', days)
+    course_counts = cumulative_daily_counts(site_context.org_courses, 'created', days)
+
+    cumulative_active_users = get_previous_cumulative_active_user_count(site, days[0])
+    new_records = []
+    for day in days:
+        if day in kept:
+            cumulative_active_users = kept[day].cumulative_active_user_count or 0
+            continue
+        cumulative_active_users += active_users[day]
+        new_records.append(SiteDailyMetrics(
+            site=site,
+            date_for=day,
+            todays_active_user_count=active_users[day],
+            cumulative_active_user_count=cumulative_active_users,
+            total_user_count=user_counts[day],
+            course_count=course_counts[day],
+            total_enrollment_count=enrollments[day]))
+    SiteDailyMetrics.objects.bulk_create(new_records, batch_size=pipeline_batch_size())
+    return len(new_records)
+
+
+def backfill_site_daily_active_users(site, days, force_update=False, site_context=None):
+    '''Creates the SiteDailyActiveUsers records for the site and days
+
+    Reads the active user ids for all the days with one query grouped by day,
+    and keeps the site's users of the ``SiteContext``. Returns the number of
+    records created
+    '''
+    existing = SiteDailyActiveUsers.objects.filter(
+        site=site, date_for__gte=days[0], date_for__lte=days[-1])
+    if force_update:
+        existing.delete()
+        kept = set()
+    else:
+        kept = set(existing.values_list('date_for', flat=True))
+
+    site_user_ids = (site_context or figures.sites.SiteContext(site)).user_ids
+    user_ids = defaultdict(list)
+    for day, user_id in StudentModule.objects.filter(
+            modified__gte=as_datetime(days[0]),
+            modified__lt=as_datetime(next_day(days[-1])),
+    ).annotate(day=TruncDate('modified')).order_by().values_list(
+            'day', 'student_id').distinct().iterator():
+        if user_id in site_user_ids:
+            user_ids[day].append(user_id)
+
+    new_records = []
+    for day in days:
+        if day in kept:
+            continue
+        day_user_ids = set(user_ids[day])
+        new_records.append(SiteDailyActiveUsers(
+            site=site,
+            date_for=day,
+            user_count=len(day_user_ids),
+            user_ids=pack_user_ids(day_user_ids)))
+    SiteDailyActiveUsers.objects.bulk_create(new_records, batch_size=pipeline_batch_size())
+    return len(new_records)
+
+
+def backfill_daily_metrics(site, start_date, end_date, force_update=False):
+    '''Backfills the course and site daily metrics for a site and date range
+
+    Runs in a single transaction so a failed backfill leaves no partial data.
+    The site's daily active users are backfilled and the monthly rollups for
+    the months in the range are recomputed too.
+    Returns a dict with the number of course and site records for the range
+    '''
+    days = date_range(start_date, end_date)
+    if not days:
+        return dict(course_daily_metrics=0, site_daily_metrics=0)
+    site_context = figures.sites.SiteContext(site)
+    course_ids = [course.id for course in site_context.courses]
+    with transaction.atomic():
+        course_daily_metrics = backfill_course_daily_metrics(
+            course_ids=course_ids, days=days, force_update=force_update)
+        sdm_count = backfill_site_daily_metrics(
+            site=site,
+            days=days,
+            course_daily_metrics=course_daily_metrics,
+            force_update=force_update,
+            site_context=site_context)
+        backfill_site_daily_active_users(
+            site=site, days=days, force_update=force_update, site_context=site_context)
+        update_monthly_metrics(site, days[0], days[-1])
+    invalidate_site_metrics(site)
+    return dict(
+        course_daily_metrics=len(course_daily_metrics),
+        site_daily_metrics=sdm_count)
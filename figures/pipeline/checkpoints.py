@@ -0,0 +1,116 @@
+'''Checkpoints for resumable Figures pipeline runs
+
+A ``PipelineRun`` is created for each site and date the pipeline processes.
+Each course in the run gets a ``PipelineCourseRun`` checkpoint recording its
+status, timings and the number of learners with grades saved for the course.
+
+When a run is resumed, courses whose checkpoint says they succeeded are
+skipped, so we don't pay again for their grade computation. A finished run
+with failed or interrupted courses is reopened so those courses are retried
+
+'''
+
+from contextlib import contextmanager
+
+from django.db.models import Max
+from django.utils.timezone import now
+
+from figures.helpers import as_date
+from figures.models import (
+    LearnerCourseGradeMetrics,
+    LearnerCourseGradeSnapshot,
+    PipelineCourseRun,
+    PipelineRun,
+)
+
+
+def start_pipeline_run(site, date_for, resume=False):
+    '''Returns the ``PipelineRun`` to use for the site and date
+
+    If ``resume`` is true, returns the most recent run for the site and date
+    if there is one. If that run finished but some of its courses failed or
+    did not complete, it is reopened so they are retried. The run is still
+    finished only if all its courses succeeded, callers then skip the site.
+    Otherwise creates a new run
+    '''
+    date_for = as_date(date_for)
+    if resume:
+        run = PipelineRun.objects.filter(
+            site=site,
+            date_for=date_for).order_by('-created', '-id').first()
+        if run:
+            if run.status == PipelineRun.FINISHED and run.course_runs.exclude(
+                    status=PipelineCourseRun.SUCCEEDED).exists():
+                run.status = PipelineRun.STARTED
+                run.finished_at = None
+                run.save()
+            return run
+    return PipelineRun.objects.create(site=site, date_for=date_for)
+
+
+def finish_pipeline_run(run):
+    run.status = PipelineRun.FINISHED
+    run.finished_at = now()
+    run.save()
+    return run
+
+
+def last_activity(run):
+    '''Returns the time the run or one of its courses last started or finished
+    '''
+    times = run.course_runs.aggregate(
+        started_at=Max('started_at'), finished_at=Max('finished_at'))
+    return max([run.created] + [val for val in times.values() if val])
+
+
+def completed_course_ids(run):
+    '''Returns the set of course id strings that succeeded in the run
+    '''
+    return set(run.course_runs.filter(
+        status=PipelineCourseRun.SUCCEEDED).values_list('course_id', flat=True))
+
+
+def saved_learner_grades_count(course_run):
+    '''Returns the number of learners whose grades the course run saved
+
+    These are the learners whose grade metrics record or snapshot for the
+    run's date was written since the course run started. Counting all the
+    snapshots for the date would miss the learners whose snapshot has since
+    moved to a later date
+    '''
+    filter_args = dict(
+        course_id=course_run.course_id,
+        date_for=course_run.run.date_for,
+        modified__gte=course_run.started_at)
+    user_ids = set(LearnerCourseGradeSnapshot.objects.filter(
+        **filter_args).values_list('user_id', flat=True))
+    user_ids.update(LearnerCourseGradeMetrics.objects.filter(
+        **filter_args).values_list('user_id', flat=True))
+    return len(user_ids)
+
+
+@contextmanager
+def course_checkpoint(run, course_id):
+    '''Records the status and timing of the course processed in the block
+
+    Marks the course as started on entry. If the block raises, the course is
+    marked as failed and the exception propagates. Otherwise the course is
+    marked as succeeded along with its count of learners with grades saved
+    '''
+    course_run, _ = PipelineCourseRun.objects.get_or_create(
+        run=run, course_id=str(course_id))
+    course_run.status = PipelineCourseRun.STARTED
+    course_run.started_at = now()
+    course_run.finished_at = None
+    course_run.save()
+    try:
+        yield course_run
+    except Exception:
+        course_run.status = PipelineCourseRun.FAILED
+        course_run.finished_at = now()
+        course_run.save()
+        raise
+    course_run.status = PipelineCourseRun.SUCCEEDED
+    course_run.finished_at = now()
+    course_run.learner_grades_count = saved_learner_grades_count(course_run)
+    course_run.save()
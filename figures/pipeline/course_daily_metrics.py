@@ -11,24 +11,46 @@ Future: add a remote mode to pull data via REST API
 
 # TODO: Move extractors to figures.pipeline.extract module
 """
+from collections import defaultdict
 import datetime
 import logging
 
+from celery.exceptions import SoftTimeLimitExceeded
 from django.db import transaction
+from django.db.models import Count, Max
 from django.utils.timezone import utc
 
 from courseware.models import StudentModule
 from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
 from student.models import CourseEnrollment, CourseEnrollmentAllowed
-from student.roles import CourseCcxCoachRole, CourseInstructorRole, CourseStaffRole
 
-from figures.helpers import as_course_key, as_datetime, next_day, prev_day
+from figures.course_roles import get_excluded_user_ids
+from figures.helpers import (
+    as_course_key,
+    as_date,
+    as_datetime,
+    chunks,
+    incremental_grades_enabled,
+    next_day,
+    pipeline_batch_size,
+    prev_day,
+)
 import figures.metrics
-from figures.models import CourseDailyMetrics, PipelineError
+from figures.models import (
+    CourseDailyMetrics,
+    LearnerCourseGradeSnapshot,
+    PipelineCourseRun,
+    PipelineError,
+)
 from figures.pipeline.logger import log_error
+from figures.pipeline.monthly_metrics import update_course_monthly_metrics
 import figures.pipeline.loaders
 from figures.serializers import CourseIndexSerializer
-from figures.compat import GeneratedCertificate
+from figures.compat import (
+    GeneratedCertificate,
+    iter_course_grades,
+    prefetch_persisted_grades,
+)
 import figures.sites
 
 
@@ -43,21 +65,13 @@ def get_enrolled_and_invited_exclude_admins(course_id, date_for=None):
 
     If no date is provided then the date is not used as a filter
     """
-    course_locator = as_course_key(course_id)
-
-    if getattr(course_id, 'ccx', None):
-        course_locator = course_id.to_course_locator()
-
-    staff = CourseStaffRole(course_locator).users_with_role()
-    admins = CourseInstructorRole(course_locator).users_with_role()
-    coaches = CourseCcxCoachRole(course_locator).users_with_role()
     filter_args = dict(course_id=course_id, is_active=1)
 
     if date_for:
         filter_args.update(dict(created__lt=as_datetime(next_day(date_for))))
 
     return CourseEnrollment.objects.filter(**filter_args).exclude(
-        user__in=staff).exclude(user__in=admins).exclude(user__in=coaches)
+        user_id__in=get_excluded_user_ids(course_id))
 
 
 def get_enrolled_in_exclude_admins(course_id, date_for=None):
@@ -68,70 +82,246 @@ def get_enrolled_in_exclude_admins(course_id, date_for=None):
     If no date is provided then the date is not used as a filter
 
     """
-    course_locator = as_course_key(course_id)
-
-    if getattr(course_id, 'ccx', None):
-        course_locator = course_id.to_course_locator()
-
-    staff = CourseStaffRole(course_locator).users_with_role()
-    admins = CourseInstructorRole(course_locator).users_with_role()
-    coaches = CourseCcxCoachRole(course_locator).users_with_role()
     filter_args = dict(course_id=course_id, is_active=1)
 
     if date_for:
         filter_args.update(dict(created__lt=as_datetime(next_day(date_for))))
 
     return CourseEnrollment.objects.filter(**filter_args).exclude(
-        user__in=staff).exclude(user__in=admins).exclude(user__in=coaches)
+        user_id__in=get_excluded_user_ids(course_id))
 
 
 def get_active_learner_ids_today(course_id, date_for):
     """Get unique user ids for learners who are active today for the given
     course and date
 
-    Note: When Figures no longer has to support Django 1.8, we can simplify
-    this date check:
-        https://docs.djangoproject.com/en/1.9/ref/models/querysets/#date
+    Filters on a half-open datetime range for the day instead of the
+    ``modified`` date parts, so the database can use the index on ``modified``
     """
-    date_for_as_datetime = as_datetime(date_for)
+    date_for = as_date(date_for)
     return StudentModule.objects.filter(
         course_id=as_course_key(course_id),
-        modified__year=date_for_as_datetime.year,
-        modified__month=date_for_as_datetime.month,
-        modified__day=date_for_as_datetime.day,
+        modified__gte=as_datetime(date_for),
+        modified__lt=as_datetime(next_day(date_for)),
         ).values_list('student__id', flat=True).distinct()
 
 
-def get_average_progress(course_id, date_for, course_enrollments):
+def get_active_learner_counts(course_ids, date_for):
+    """Returns a dict of course id string to the count of learners active on
+    the date, for all the given courses
+
+    This is the site level counterpart of ``get_active_learner_ids_today``. It
+    scans ``StudentModule`` once with a query grouped by course instead of
+    once per course. Courses without activity are not in the dict
+    """
+    date_for = as_date(date_for)
+    counts = StudentModule.objects.filter(
+        course_id__in=[as_course_key(course_id) for course_id in course_ids],
+        modified__gte=as_datetime(date_for),
+        modified__lt=as_datetime(next_day(date_for)),
+        ).order_by().values('course_id').annotate(
+        learners=Count('student_id', distinct=True))
+    return dict((str(rec['course_id']), rec['learners']) for rec in counts)
+
+
+def get_last_successful_run_date(course_id, date_for):
+    """Returns the date of the most recent pipeline run before ``date_for``
+    in which the course succeeded, None if there is none
+    """
+    dates = PipelineCourseRun.objects.filter(
+        course_id=str(course_id),
+        status=PipelineCourseRun.SUCCEEDED,
+        run__date_for__lt=as_date(date_for),
+        ).order_by('-run__date_for').values_list('run__date_for', flat=True)[:1]
+    return dates[0] if dates else None
+
+
+class CarryForwardGrades(object):
+    """Previous grade metrics for learners inactive since they were saved
+
+    A learner's snapshot moves to the date of every run that saves their
+    grades. So after the last run in which the course succeeded, the
+    learners it handled have a snapshot on or after that date. Only their
+    ``StudentModule`` changes since that date are read, and only the
+    learners active since then are held in memory. Learners whose snapshot is
+    older, like the ones whose grades failed, are not carried forward.
+
+    Without a successful run before ``date_for`` no learner is carried
+    forward. Learners without a snapshot are not included, so their grades
+    get read. Grade changes that do not touch ``StudentModule``, like a
+    grading policy change, are not detected
+    """
+    def __init__(self, course_id, date_for):
+        self.course_id = str(course_id)
+        self.date_for = as_date(date_for)
+        self.since = get_last_successful_run_date(course_id, self.date_for)
+        if self.since:
+            self.last_modified = dict(StudentModule.objects.filter(
+                course_id=as_course_key(course_id),
+                modified__gte=as_datetime(self.since),
+                ).order_by().values('student_id').annotate(
+                last_modified=Max('modified')).values_list('student_id', 'last_modified'))
+        else:
+            self.last_modified = {}
+
+    def for_users(self, user_ids):
+        """Returns a dict of user id to the ``LearnerCourseGradeSnapshot`` of
+        each of the users to carry forward
+
+        Reads the snapshots of the users only, so the course's snapshots are
+        read one batch of learners at a time
+        """
+        if self.since is None:
+            return {}
+        snapshots = LearnerCourseGradeSnapshot.objects.filter(
+            course_id=self.course_id,
+            user_id__in=user_ids,
+            date_for__gte=self.since,
+            date_for__lt=self.date_for)
+        return {
+            obj.user_id: obj for obj in snapshots
+            if obj.user_id not in self.last_modified or
+            self.last_modified[obj.user_id] < as_datetime(obj.date_for)
+        }
+
+
+def carry_forward_progress(learner_course_grades):
+    """Returns a ``LearnerCourseGrades.course_progress`` dict for saved metrics
+    """
+    details = dict(
+        points_possible=learner_course_grades.points_possible,
+        points_earned=learner_course_grades.points_earned,
+        sections_worked=learner_course_grades.sections_worked,
+        count=learner_course_grades.sections_possible,
+    )
+    return dict(
+        course_progress_details=details,
+        progress_percent=learner_course_grades.progress_percent)
+
+
+def get_course_grades_for_enrollments(course, course_enrollments):
+    """Returns a dict of user id to ``(course_grade, error)`` tuples
+
+    Prefetches the persisted grades for the learners in ``course_enrollments``
+    then reads all their grades against the already loaded ``course``
+    """
+    users = [ce.user for ce in course_enrollments]
+    prefetch_persisted_grades(course.id, users)
+    return {
+        user.id: (course_grade, error) for user, course_grade, error
+        in iter_course_grades(users, course)
+    }
+
+
+def save_batch_grades(site, date_for, course_id, batch_grades):
+    """Bulk saves learner grade metrics, logging an error if the write fails
+    """
+    if not batch_grades:
+        return
+    try:
+        figures.pipeline.loaders.bulk_save_learner_course_grades(
+            site=site, date_for=date_for, course_grades=batch_grades)
+    except SoftTimeLimitExceeded:
+        raise
+    except Exception as e:  # pylint: disable=broad-except
+        error_data = dict(
+            msg='Unable to save learner course grades',
+            course_id=str(course_id),
+            learner_count=len(batch_grades),
+            exception=str(e),
+            )
+        log_error(
+            error_data=error_data,
+            error_type=PipelineError.GRADES_DATA,
+            course_id=course_id,
+            )
+
+
+def get_average_progress(course_id, date_for, course_enrollments, site_context=None):
     """Collects and aggregates raw course grades data
+
+    The course is loaded from the modulestore once and shared by all the
+    learners. Grades are read in batches of ``pipeline_batch_size()`` learners
+    so that persisted grades are fetched with one query per batch instead of
+    per learner
+
+    If the course cannot be loaded, we fall back to reading each learner's
+    grades on their own so that failures are logged per learner as before.
+    ``SoftTimeLimitExceeded`` is never caught, so the parallel pipeline's
+    course time limit stops the course
+
+    Learner grade metrics are saved with one bulk write per batch.
+
+    When ``incremental_grades_enabled()`` is true, learners returned by
+    ``CarryForwardGrades`` get their previous metrics saved for ``date_for``
+    instead of having their grades read
+
+    The grade metrics site is read from ``site_context``, the
+    ``figures.sites.SiteContext`` of the pipeline, when it is given
     """
+    try:
+        course = figures.metrics.LearnerCourseGrades.load_course(course_id)
+    except SoftTimeLimitExceeded:
+        raise
+    except Exception:  # pylint: disable=broad-except
+        course = None
+
+    if incremental_grades_enabled():
+        carry_forward_grades = CarryForwardGrades(course_id, date_for)
+    else:
+        carry_forward_grades = None
+
+    if site_context:
+        site = site_context.get_site_for_course(course_id)
+    else:
+        site = figures.sites.get_site_for_course(course_id)
     progress = []
-    for ce in course_enrollments:
-        try:
-            course_progress = figures.metrics.LearnerCourseGrades.course_progress(ce)
-            figures.pipeline.loaders.save_learner_course_grades(
-                site=figures.sites.get_site_for_course(course_id),
-                date_for=date_for,
-                course_enrollment=ce,
-                course_progress_details=course_progress['course_progress_details'])
-        except Exception as e:
-            error_data = dict(
-                msg='Unable to get course blocks',
-                username=ce.user.username,
-                course_id=str(ce.course_id),
-                exception=str(e),
-                )
-            log_error(
-                error_data=error_data,
-                error_type=PipelineError.GRADES_DATA,
-                user=ce.user,
-                course_id=ce.course_id,
-                )
-            course_progress = dict(
-                progress_percent=0.0,
-                course_progress_details=None)
-        if course_progress:
-            progress.append(course_progress)
+    enrollments = course_enrollments.select_related('user').iterator()
+    for batch in chunks(enrollments, pipeline_batch_size()):
+        if carry_forward_grades:
+            carry_forward = carry_forward_grades.for_users([ce.user.id for ce in batch])
+        else:
+            carry_forward = {}
+        to_grade = [ce for ce in batch if ce.user.id not in carry_forward]
+        if course and to_grade:
+            grades = get_course_grades_for_enrollments(course, to_grade)
+        else:
+            grades = {}
+        batch_grades = []
+        for ce in batch:
+            try:
+                if ce.user.id in carry_forward:
+                    course_progress = carry_forward_progress(carry_forward[ce.user.id])
+                else:
+                    course_grade, error = grades.get(ce.user.id, (None, None))
+                    if error:
+                        raise error
+                    kwargs = dict(
+                        course=course, course_grade=course_grade) if course_grade else {}
+                    course_progress = figures.metrics.LearnerCourseGrades.course_progress(
+                        ce, **kwargs)
+                batch_grades.append((ce, course_progress['course_progress_details']))
+            except SoftTimeLimitExceeded:
+                raise
+            except Exception as e:
+                error_data = dict(
+                    msg='Unable to get course blocks',
+                    username=ce.user.username,
+                    course_id=str(ce.course_id),
+                    exception=str(e),
+                    )
+                log_error(
+                    error_data=error_data,
+                    error_type=PipelineError.GRADES_DATA,
+                    user=ce.user,
+                    course_id=ce.course_id,
+                    )
+                course_progress = dict(
+                    progress_percent=0.0,
+                    course_progress_details=None)
+            if course_progress:
+                progress.append(course_progress)
+        save_batch_grades(site, date_for, course_id, batch_grades)
     if len(progress):
         progress_percent = [rec['progress_percent'] for rec in progress]
         average_progress = float(sum(progress_percent)) / float(len(progress_percent))
@@ -144,42 +334,52 @@ def get_average_progress(course_id, date_for, course_enrollments):
 def get_days_to_complete(course_id, date_for):
     """Return a dict with a list of days to complete and errors
 
+    Reads the certificates and the enrollments of the certified learners in
+    two queries and joins them in memory, instead of querying the enrollment
+    for each certificate
+
     NOTE: This is a work in progress, as it has issues to resolve:
     * It returns the delta in days, so working in ints
     * This means if a learner starts at midnight and finished just before
       midnight, then 0 days will be given
 
-    NOTE: This has limited scaling. We ought to test it with
-    1k, 10k, 100k cert records
-
     TODO: change to use start_date, end_date with defaults that
     start_date is open and end_date is today
 
     TODO: Consider collecting the total seconds rather than days
     This will improve accuracy, but may actually not be that important
     TODO: Analyze the error based on number of completions
-
-    When we have to support scale, we can look into optimization
-    techinques.
     """
+    course_key = as_course_key(course_id)
     certificates = GeneratedCertificate.objects.filter(
-        course_id=as_course_key(course_id),
+        course_id=course_key,
         created_date__lte=as_datetime(date_for))
 
+    enrollments = defaultdict(list)
+    for user_id, created in CourseEnrollment.objects.filter(
+            course_id=course_key,
+            user_id__in=certificates.values('user_id')).values_list('user_id', 'created'):
+        enrollments[user_id].append(created)
+
     days = []
     errors = []
-    for cert in certificates:
-        ce = CourseEnrollment.objects.filter(
-            course_id=as_course_key(course_id),
-            user=cert.user)
+    for user_id, created_date in certificates.values_list('user_id', 'created_date'):
+        enrolled = enrollments.get(user_id)
+        if not enrolled:
+            errors.append(
+                dict(msg='No CE record',
+                     course_id=str(course_id),
+                     user_id=user_id,
+                     ))
+            continue
         # How do we want to handle multiples?
-        if ce.count() > 1:
+        if len(enrolled) > 1:
             errors.append(
                 dict(msg='Multiple CE records',
-                     course_id=course_id,
-                     user_id=cert.user.id,
+                     course_id=str(course_id),
+                     user_id=user_id,
                      ))
-        days.append((cert.created_date - ce[0].created).days)
+        days.append((created_date - enrolled[0]).days)
     return dict(days=days, errors=errors)
 
 
@@ -191,6 +391,44 @@ def calc_average_days_to_complete(days):
         return 0.0
 
 
+def calc_percentile(sorted_values, percent):
+    """Returns the percentile of a sorted list, interpolating between ranks
+
+    Returns None if the list is empty
+    """
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * percent / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (
+        sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+# CourseDailyMetrics fields for the days to complete distribution
+DAYS_TO_COMPLETE_PERCENTILES = (
+    ('days_to_complete_p25', 25),
+    ('median_days_to_complete', 50),
+    ('days_to_complete_p75', 75),
+    ('days_to_complete_p90', 90),
+)
+
+
+def calc_days_to_complete_distribution(days):
+    """Returns a dict of the days to complete percentiles
+
+    The keys are the CourseDailyMetrics field names. Values are None if there
+    are no completions
+    """
+    sorted_days = sorted(days)
+    return dict((field, calc_percentile(sorted_days, percent))
+                for field, percent in DAYS_TO_COMPLETE_PERCENTILES)
+
+
+def as_rounded_int(value):
+    return None if value is None else int(round(value))
+
+
 def get_average_days_to_complete(course_id, date_for):
 
     days_to_complete = get_days_to_complete(course_id, date_for)
@@ -234,8 +472,11 @@ class CourseDailyMetricsExtractor(object):
     BUT, we will then need to find a transform
     """
 
-    def extract(self, course_id, date_for=None, **kwargs):
+    def extract(self, course_id, date_for=None, site_context=None, **kwargs):
         """
+        ``site_context`` is the ``figures.sites.SiteContext`` the site
+        pipeline shares between its courses
+
             defaults = dict(
                 enrollment_count=data['enrollment_count'],
                 active_learners_today=data['active_learners_today'],
@@ -269,18 +510,27 @@ class CourseDailyMetricsExtractor(object):
         
         data['enrollment_count'] = course_enrollments.count() + learners_invited_to_course.count()
 
-        active_learner_ids_today = get_active_learner_ids_today(
-            course_id, date_for,)
-        if active_learner_ids_today:
-            active_learners_today = active_learner_ids_today.count()
-        else:
-            active_learners_today = 0
+        # The site pipeline passes in the count from ``get_active_learner_counts``
+        active_learners_today = kwargs.get('active_learners_today')
+        if active_learners_today is None:
+            active_learners_today = get_active_learner_ids_today(
+                course_id, date_for,).count()
 
         data['active_learners_today'] = active_learners_today
         data['average_progress'] = get_average_progress(
-            course_id, date_for, course_enrollments,)
-        data['average_days_to_complete'] = get_average_days_to_complete(
-            course_id, date_for,)
+            course_id, date_for, course_enrollments, site_context=site_context)
+        days_to_complete = get_days_to_complete(course_id, date_for)
+        if days_to_complete['errors']:
+            log_error(
+                error_data=dict(
+                    msg='Unable to get days to complete for some certificates',
+                    errors=days_to_complete['errors']),
+                error_type=PipelineError.COURSE_DATA,
+                course_id=course_id,
+                )
+        data['average_days_to_complete'] = calc_average_days_to_complete(
+            days_to_complete['days'])
+        data.update(calc_days_to_complete_distribution(days_to_complete['days']))
         data['num_learners_completed'] = get_num_learners_completed(
             course_id, date_for,)
 
@@ -289,16 +539,19 @@ class CourseDailyMetricsExtractor(object):
 
 class CourseDailyMetricsLoader(object):
 
-    def __init__(self, course_id):
+    def __init__(self, course_id, site_context=None):
         self.course_id = course_id
         # TODO: Consider adding extractor as optional param
         self.extractor = CourseDailyMetricsExtractor()
         self.site = figures.sites.get_org_for_course(self.course_id)
+        self.site_context = site_context
 
-    def get_data(self, date_for):
+    def get_data(self, date_for, **kwargs):
         return self.extractor.extract(
             course_id=self.course_id,
-            date_for=date_for)
+            date_for=date_for,
+            site_context=self.site_context,
+            **kwargs)
 
     @transaction.atomic
     def save_metrics(self, date_for, data):
@@ -317,10 +570,15 @@ class CourseDailyMetricsLoader(object):
                 active_learners_today=data['active_learners_today'],
                 average_progress=str(round(data['average_progress'], 2)),
                 average_days_to_complete=int(round(data['average_days_to_complete'])),
+                median_days_to_complete=as_rounded_int(data.get('median_days_to_complete')),
+                days_to_complete_p25=as_rounded_int(data.get('days_to_complete_p25')),
+                days_to_complete_p75=as_rounded_int(data.get('days_to_complete_p75')),
+                days_to_complete_p90=as_rounded_int(data.get('days_to_complete_p90')),
                 num_learners_completed=data['num_learners_completed'],
             )
         )
         cdm.clean_fields()
+        update_course_monthly_metrics(self.site, self.course_id, date_for)
         return (cdm, created,)
 
     def load(self, date_for=None, force_update=False, **kwargs):
@@ -337,6 +595,9 @@ class CourseDailyMetricsLoader(object):
 
         Raises ValidationError if invalid data is attempted to be saved to the
         course daily metrics model instance
+
+        Extra keyword arguments are passed to the extractor. See
+        ``CourseDailyMetricsExtractor.extract``
         """
         if not date_for:
             date_for = prev_day(
@@ -353,5 +614,5 @@ class CourseDailyMetricsLoader(object):
             # record not found, move on to creating
             pass
 
-        data = self.get_data(date_for=date_for)
+        data = self.get_data(date_for=date_for, **kwargs)
         return self.save_metrics(date_for=date_for, data=data)
@@ -0,0 +1,46 @@
+'''Course details snapshots
+
+``CourseDetailsSerializer`` runs the monthly history metrics and the TMA
+learner counts for each course it serializes, hundreds of queries per course.
+The pipeline stores its output in a ``CourseDetailsSnapshot`` record per
+course, so the course details endpoint reads a page of courses with one query.
+
+Courses without a snapshot, like courses created since the last pipeline run,
+are serialized live
+'''
+
+from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
+
+from figures.helpers import as_course_key, as_date
+from figures.models import CourseDetailsSnapshot
+from figures.serializers import CourseDetailsSerializer
+
+
+def load_course_details_snapshot(course_id, date_for):
+    '''Creates or updates the snapshot for the course
+
+    Returns a tuple of the snapshot and whether it was created
+    '''
+    course_overview = CourseOverview.objects.get(id=as_course_key(course_id))
+    serializer = CourseDetailsSerializer(course_overview)
+    data = serializer.data
+    return CourseDetailsSnapshot.objects.update_or_create(
+        course_id=str(course_overview.id),
+        defaults=dict(
+            # Assigned by the serializer
+            site=serializer.site,
+            date_for=as_date(date_for),
+            data=data,
+        ))
+
+
+def get_course_details_data(course_overviews):
+    '''Returns the list of course details data for the courses, in order
+
+    Reads the snapshots for all the courses in one query
+    '''
+    snapshots = dict(CourseDetailsSnapshot.objects.filter(
+        course_id__in=[str(co.id) for co in course_overviews]).values_list(
+        'course_id', 'data'))
+    return [snapshots.get(str(co.id)) or CourseDetailsSerializer(co).data
+            for co in course_overviews]
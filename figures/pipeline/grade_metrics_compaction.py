@@ -0,0 +1,95 @@
+'''Compacts the LearnerCourseGradeMetrics history
+
+The pipeline only writes a grade metrics record when a learner's points or
+sections change, see ``figures.pipeline.loaders``. History written before
+that has a record per learner and course each day. Records older than the
+retention window, ``grade_metrics_retention_days()`` days, are compacted with
+one of these sampling policies:
+
+* ``change`` keeps the records where the learner's grades changed from their
+  previous record
+* ``week`` and ``month`` keep the last record of each learner and course in
+  the week or month
+
+Records in the retention window are never deleted. A learner's grades on a
+date are those of their most recent record on or before the date, see
+``LearnerCourseGradeMetricsManager.as_of``, which holds on the compacted
+history. With ``change`` the grades on every date are kept. With ``week`` and
+``month`` they are kept at the end of each period
+'''
+
+import datetime
+
+from django.utils.timezone import now
+
+from figures.helpers import (
+    as_date,
+    chunks,
+    days_from,
+    grade_metrics_compaction_sampling,
+    grade_metrics_retention_days,
+    pipeline_batch_size,
+)
+from figures.models import LearnerCourseGradeMetrics
+from figures.pipeline.loaders import LEARNER_COURSE_GRADE_FIELDS
+
+
+SAMPLING_CHOICES = ('change', 'week', 'month')
+
+
+def sample_period(date_for, sampling):
+    '''Returns the first day of the week or month of ``date_for``
+    '''
+    if sampling == 'week':
+        return date_for - datetime.timedelta(days=date_for.weekday())
+    return date_for.replace(day=1)
+
+
+def get_compacted_ids(records, sampling):
+    '''Yields the ids of the records the sampling policy drops
+
+    ``records`` are dicts with the id, user_id, course_id, date_for and grade
+    fields, ordered by user, course and date
+    '''
+    previous = None
+    for rec in records:
+        grades = tuple(rec[field] for field in LEARNER_COURSE_GRADE_FIELDS)
+        if previous and (previous['user_id'], previous['course_id']) == (
+                rec['user_id'], rec['course_id']):
+            if sampling == 'change':
+                if grades == previous['grades']:
+                    yield rec['id']
+                    continue
+            elif sample_period(rec['date_for'], sampling) == sample_period(
+                    previous['date_for'], sampling):
+                yield previous['id']
+        previous = dict(rec, grades=grades)
+
+
+def compact_learner_course_grades(date_for=None, retention_days=None, sampling=None):
+    '''Deletes the grade metrics records the sampling policy drops
+
+    Only records older than ``retention_days`` before ``date_for`` are
+    compacted. Defaults to today, ``grade_metrics_retention_days()`` and
+    ``grade_metrics_compaction_sampling()``. Reads the records with one query
+    and deletes the dropped ones in batches of ``pipeline_batch_size()`` as
+    they are read, so the ids to delete are never all held in memory
+
+    Returns the number of records deleted
+    '''
+    date_for = as_date(date_for) if date_for else as_date(now())
+    if retention_days is None:
+        retention_days = grade_metrics_retention_days()
+    sampling = sampling or grade_metrics_compaction_sampling()
+    if sampling not in SAMPLING_CHOICES:
+        raise ValueError('Unknown grade metrics sampling "{}"'.format(sampling))
+
+    records = LearnerCourseGradeMetrics.objects.filter(
+        date_for__lt=days_from(date_for, -retention_days)).order_by(
+        'user_id', 'course_id', 'date_for').values(
+        'id', 'user_id', 'course_id', 'date_for', *LEARNER_COURSE_GRADE_FIELDS)
+    deleted_count = 0
+    for ids in chunks(get_compacted_ids(records.iterator(), sampling),
+                      pipeline_batch_size()):
+        deleted_count += LearnerCourseGradeMetrics.objects.filter(id__in=ids).delete()[0]
+    return deleted_count
@@ -2,27 +2,193 @@
 
 """
 
-from figures.models import LearnerCourseGradeMetrics
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.utils.timezone import now
 
+from figures.helpers import as_date, chunks, pipeline_batch_size
+from figures.models import LearnerCourseGradeMetrics, LearnerCourseGradeSnapshot
 
-def save_learner_course_grades(site, date_for, course_enrollment, course_progress_details):
-    """
 
-    ``course_progress_details`` data are the ``course_progress_details`` from the
-    ``LearnerCourseGrades.course_progress method``
+LEARNER_COURSE_GRADE_FIELDS = (
+    'points_possible',
+    'points_earned',
+    'sections_worked',
+    'sections_possible',
+)
+
 
+def learner_course_grades_data(course_progress_details):
+    """Maps ``course_progress_details`` to ``LearnerCourseGradeMetrics`` fields
     """
-    # details = course_progress['course_progress_details']
-    data = dict(
+    return dict(
         points_possible=course_progress_details['points_possible'],
         points_earned=course_progress_details['points_earned'],
         sections_worked=course_progress_details['sections_worked'],
         sections_possible=course_progress_details['count']
         )
-    obj, created = LearnerCourseGradeMetrics.objects.update_or_create(
-        site=site,
-        user=course_enrollment.user,
-        course_id=str(course_enrollment.course_id),
-        date_for=date_for,
-        defaults=data)
+
+
+def save_learner_course_grades(site, date_for, course_enrollment, course_progress_details):
+    """
+
+    ``course_progress_details`` data are the ``course_progress_details`` from the
+    ``LearnerCourseGrades.course_progress method``
+
+    No record is written when the grades are the same as the learner's most
+    recent record, which is then returned with ``created`` false. See
+    ``bulk_save_learner_course_grades``
+    """
+    # details = course_progress['course_progress_details']
+    data = learner_course_grades_data(course_progress_details)
+    course_id = str(course_enrollment.course_id)
+    snapshots = get_learner_course_grade_snapshots(course_id, [course_enrollment.user_id])
+    if is_unchanged_grades(snapshots.get(course_enrollment.user_id), date_for, data) and (
+            not LearnerCourseGradeMetrics.objects.filter(
+                user_id=course_enrollment.user_id,
+                course_id=course_id,
+                date_for=date_for).exists()):
+        obj = LearnerCourseGradeMetrics.objects.most_recent_for_learner_course(
+            course_enrollment.user, course_id)
+        created = False
+    else:
+        obj, created = LearnerCourseGradeMetrics.objects.update_or_create(
+            site=site,
+            user=course_enrollment.user,
+            course_id=course_id,
+            date_for=date_for,
+            defaults=data)
+    save_learner_course_grade_snapshots(
+        site, date_for, course_id, {course_enrollment.user_id: data}, snapshots=snapshots)
     return obj, created
+
+
+def bulk_update_fields(model_class, objs, fields):
+    """Updates ``fields`` for all of ``objs`` with a single UPDATE query
+
+    Django 1.11 does not provide ``bulk_update``, so we build a CASE expression
+    per field keyed on the primary key. The ``modified`` timestamp is set
+    explicitly as ``QuerySet.update`` bypasses ``save``
+    """
+    if not objs:
+        return 0
+    values = {}
+    for field in fields:
+        values[field] = Case(
+            *[When(pk=obj.pk, then=Value(getattr(obj, field))) for obj in objs],
+            output_field=model_class._meta.get_field(field))  # pylint: disable=protected-access
+    return model_class.objects.filter(
+        pk__in=[obj.pk for obj in objs]).update(modified=now(), **values)
+
+
+def get_learner_course_grade_snapshots(course_id, user_ids):
+    """Returns a dict of user id to LearnerCourseGradeSnapshot for the course
+    """
+    return {
+        obj.user_id: obj for obj in LearnerCourseGradeSnapshot.objects.filter(
+            course_id=str(course_id), user_id__in=list(user_ids))
+    }
+
+
+def is_unchanged_grades(snapshot, date_for, data):
+    """Returns true if ``data`` are the grades the learner already had on
+    ``date_for`` according to their snapshot
+
+    The grade metrics history only gets a record when a learner's points or
+    sections change, so unchanged days are not written again
+    """
+    return bool(snapshot and snapshot.date_for <= as_date(date_for) and all(
+        getattr(snapshot, key) == val for key, val in data.items()))
+
+
+def save_learner_course_grade_snapshots(site, date_for, course_id, grades_data,
+                                        snapshots=None):
+    """Updates the LearnerCourseGradeSnapshot records of learners in a course
+
+    ``grades_data`` is a dict of user id to ``LearnerCourseGradeMetrics``
+    field values for ``date_for``. Snapshots of a later date are kept, so
+    saving older grade metrics does not roll them back. ``snapshots`` are the
+    existing snapshots if the caller already read them. Uses one query to read
+    the existing snapshots, one ``bulk_create`` and one UPDATE
+    """
+    date_for = as_date(date_for)
+    if snapshots is None:
+        snapshots = get_learner_course_grade_snapshots(course_id, grades_data.keys())
+    to_create = []
+    to_update = []
+    for user_id, data in grades_data.items():
+        obj = snapshots.get(user_id)
+        if obj is None:
+            to_create.append(LearnerCourseGradeSnapshot(
+                site=site,
+                user_id=user_id,
+                course_id=course_id,
+                date_for=date_for,
+                **data))
+        elif obj.date_for <= date_for:
+            obj.date_for = date_for
+            for key, val in data.items():
+                setattr(obj, key, val)
+            to_update.append(obj)
+    LearnerCourseGradeSnapshot.objects.bulk_create(to_create)
+    bulk_update_fields(
+        LearnerCourseGradeSnapshot, to_update,
+        ('date_for',) + LEARNER_COURSE_GRADE_FIELDS)
+
+
+def bulk_save_learner_course_grades(site, date_for, course_grades, batch_size=None):
+    """Saves grade metrics for many learners in a course on a date
+
+    ``course_grades`` is a list of ``(course_enrollment, course_progress_details)``
+    tuples for the same course.
+
+    Records are written in chunks of ``batch_size`` learners, defaulting to
+    ``pipeline_batch_size()``. Each chunk runs in its own transaction with one
+    query to read the existing records, one to read the learners' grade
+    snapshots, one ``bulk_create`` for new records and one UPDATE for changed
+    records. Unchanged records are left as is. A learner whose grades are the
+    same as their most recent record gets no new record, only their snapshot
+    moves to ``date_for``. The snapshots are updated in the same transaction.
+
+    Returns a tuple with the number of records created and updated
+    """
+    date_for = as_date(date_for)
+    created_count = updated_count = 0
+    for chunk in chunks(course_grades, batch_size or pipeline_batch_size()):
+        course_id = str(chunk[0][0].course_id)
+        user_ids = [ce.user_id for ce, _ in chunk]
+        with transaction.atomic():
+            existing = {
+                obj.user_id: obj for obj in LearnerCourseGradeMetrics.objects.filter(
+                    course_id=course_id,
+                    date_for=date_for,
+                    user_id__in=user_ids)
+            }
+            snapshots = get_learner_course_grade_snapshots(course_id, user_ids)
+            grades_data = {}
+            to_create = []
+            to_update = []
+            for ce, course_progress_details in chunk:
+                data = learner_course_grades_data(course_progress_details)
+                grades_data[ce.user_id] = data
+                obj = existing.get(ce.user_id)
+                if obj is None:
+                    if not is_unchanged_grades(snapshots.get(ce.user_id), date_for, data):
+                        to_create.append(LearnerCourseGradeMetrics(
+                            site=site,
+                            user_id=ce.user_id,
+                            course_id=course_id,
+                            date_for=date_for,
+                            **data))
+                elif any(getattr(obj, key) != val for key, val in data.items()):
+                    for key, val in data.items():
+                        setattr(obj, key, val)
+                    to_update.append(obj)
+            LearnerCourseGradeMetrics.objects.bulk_create(to_create)
+            bulk_update_fields(
+                LearnerCourseGradeMetrics, to_update, LEARNER_COURSE_GRADE_FIELDS)
+            save_learner_course_grade_snapshots(
+                site, date_for, course_id, grades_data, snapshots=snapshots)
+        created_count += len(to_create)
+        updated_count += len(to_update)
+    return created_count, updated_count
@@ -0,0 +1,71 @@
+'''Updates the SiteMonthlyMetrics and CourseMonthlyMetrics rollups
+
+The monthly metrics in ``figures.metrics`` read a whole month from its rollup
+record, see ``figures.aggregates``. A rollup is recomputed from the daily
+records of its month each time the pipeline writes daily records for the
+month. The nightly run refreshes the current month. Closed months are only
+recomputed when their daily records are written again, as by a backfill
+'''
+
+from figures.aggregates import month_bounds
+from figures.helpers import as_date, next_day
+from figures.metrics import COURSE_MONTHLY_AGGREGATES, SITE_MONTHLY_AGGREGATES
+from figures.models import (
+    CourseDailyMetrics,
+    CourseMonthlyMetrics,
+    SiteMonthlyMetrics,
+)
+
+
+def get_rollup_values(aggregates, site, month_for, **filter_args):
+    '''Returns a dict of rollup field to the raw aggregate for the month
+    '''
+    start_date, end_date = month_bounds(month_for)
+    return dict((aggregate.rollup_field, aggregate.get_raw_value(
+        site, start_date, end_date, **filter_args)) for aggregate in aggregates)
+
+
+def update_site_monthly_metrics(site, date_for):
+    '''Recomputes the site rollup for the month of ``date_for``
+
+    Returns a tuple of the rollup record and whether it was created
+    '''
+    month_for = month_bounds(date_for)[0]
+    return SiteMonthlyMetrics.objects.update_or_create(
+        site=site,
+        month_for=month_for,
+        defaults=get_rollup_values(SITE_MONTHLY_AGGREGATES, site, month_for))
+
+
+def update_course_monthly_metrics(site, course_id, date_for):
+    '''Recomputes the course rollup for the month of ``date_for``
+
+    Returns a tuple of the rollup record and whether it was created
+    '''
+    month_for = month_bounds(date_for)[0]
+    return CourseMonthlyMetrics.objects.update_or_create(
+        site=site,
+        course_id=str(course_id),
+        month_for=month_for,
+        defaults=get_rollup_values(
+            COURSE_MONTHLY_AGGREGATES, site, month_for, course_id=str(course_id)))
+
+
+def update_monthly_metrics(site, start_date, end_date):
+    '''Recomputes the site and course rollups for the months in the date range
+
+    Only the courses with daily records in the date range are updated
+    '''
+    start_date = month_bounds(start_date)[0]
+    end_date = as_date(end_date)
+    month_for = start_date
+    while month_for <= end_date:
+        course_ids = CourseDailyMetrics.objects.filter(
+            site=site,
+            date_for__gte=month_for,
+            date_for__lte=month_bounds(month_for)[1]).order_by().values_list(
+            'course_id', flat=True).distinct()
+        for course_id in course_ids:
+            update_course_monthly_metrics(site, course_id, month_for)
+        update_site_monthly_metrics(site, month_for)
+        month_for = next_day(month_bounds(month_for)[1])
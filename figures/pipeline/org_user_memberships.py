@@ -0,0 +1,139 @@
+'''Maintains the OrgUserMembership table of the TMA microsites
+
+``figures.sites.get_users_for_org`` reads the users of a microsite from this
+table. A membership is added when an enrollment is created in a non Vodeclic
+course, by the ``CourseEnrollment`` post save receiver below. The daily
+pipeline then adds the memberships of the enrollments created since its
+previous load, which catches the enrollments created without signals, like
+bulk created ones. Each load is recorded with its high-water mark in an
+``OrgUserMembershipLoad``, so skipped runs are caught up by the next one. The
+first load reads all the enrollments. Each load then deletes the memberships
+left without an enrollment in a non Vodeclic course of their org, like when a
+course became a Vodeclic course or an enrollment was deleted.
+
+Memberships are only maintained when ``FIGURES_HAS_MICROSITES`` is true
+'''
+
+import datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from student.models import CourseEnrollment
+
+from figures.helpers import chunks, has_microsites, pipeline_batch_size
+from figures.models import OrgUserMembership, OrgUserMembershipLoad
+
+
+# Enrollments created shortly before the previous load's high-water mark are
+# read again, in case their transaction committed after the load read them
+LOAD_OVERLAP = datetime.timedelta(hours=1)
+
+
+def get_enrollment_org_users(course_enrollments):
+    '''Returns the distinct (org, user id) pairs of the course enrollments in
+    the non Vodeclic courses
+    '''
+    return course_enrollments.filter(
+        course__tmacourseoverview__is_vodeclic=False).order_by().values_list(
+        'course__org', 'user_id').distinct()
+
+
+def get_org_enrollments(course_enrollments, org):
+    '''Filters the course enrollments to the non Vodeclic courses of the org
+    '''
+    return course_enrollments.filter(
+        course__org=org, course__tmacourseoverview__is_vodeclic=False)
+
+
+def get_stale_memberships():
+    '''Returns the memberships without an enrollment in a non Vodeclic course
+    of their org
+    '''
+    return OrgUserMembership.objects.annotate(enrolled=Exists(get_org_enrollments(
+        CourseEnrollment.objects.filter(user_id=OuterRef('user_id')),
+        OuterRef('org')))).filter(enrolled=False)
+
+
+def prune_org_user_memberships():
+    '''Deletes the stale memberships, see ``get_stale_memberships``
+
+    Reads the stale membership ids with one query, then deletes them in
+    batches of ``pipeline_batch_size()``, with two queries per batch. Each
+    batch checks the memberships are still stale, in case an enrollment was
+    created meanwhile. Returns the number of memberships deleted
+    '''
+    deleted_count = 0
+    stale_ids = list(get_stale_memberships().values_list('id', flat=True))
+    for batch in chunks(stale_ids, pipeline_batch_size()):
+        still_stale_ids = list(get_stale_memberships().filter(
+            id__in=batch).values_list('id', flat=True))
+        deleted_count += OrgUserMembership.objects.filter(
+            id__in=still_stale_ids).delete()[0]
+    return deleted_count
+
+
+def load_org_user_memberships(org_users):
+    '''Creates the memberships missing for the (org, user id) pairs
+
+    Reads the existing memberships and creates the missing ones in batches of
+    ``pipeline_batch_size()`` pairs. Returns the number of memberships created
+    '''
+    created_count = 0
+    for batch in chunks(org_users, pipeline_batch_size()):
+        existing = set(OrgUserMembership.objects.filter(
+            org__in=set(org for org, _ in batch),
+            user_id__in=set(user_id for _, user_id in batch)).values_list(
+            'org', 'user_id'))
+        memberships = [
+            OrgUserMembership(org=org, user_id=user_id)
+            for org, user_id in set(batch) if (org, user_id) not in existing]
+        try:
+            with transaction.atomic():
+                OrgUserMembership.objects.bulk_create(memberships)
+        except IntegrityError:
+            # An enrollment signal added some of them meanwhile
+            memberships = [
+                obj for obj in memberships if OrgUserMembership.objects.get_or_create(
+                    org=obj.org, user_id=obj.user_id)[1]]
+        created_count += len(memberships)
+    return created_count
+
+
+def update_org_user_memberships():
+    '''Adds the memberships of the enrollments created since the previous
+    load, or of all the enrollments for the first load, then deletes the
+    stale memberships
+
+    Records the load, its high-water mark and its counts in an
+    ``OrgUserMembershipLoad``. Returns the number of memberships created
+    '''
+    if not has_microsites():
+        return 0
+    loaded_until = now()
+    course_enrollments = CourseEnrollment.objects.filter(created__lt=loaded_until)
+    previous_load = OrgUserMembershipLoad.objects.first()
+    if previous_load:
+        course_enrollments = course_enrollments.filter(
+            created__gte=previous_load.loaded_until - LOAD_OVERLAP)
+    created_count = load_org_user_memberships(
+        get_enrollment_org_users(course_enrollments).iterator())
+    deleted_count = prune_org_user_memberships()
+    OrgUserMembershipLoad.objects.create(
+        loaded_until=loaded_until,
+        created_count=created_count,
+        deleted_count=deleted_count)
+    return created_count
+
+
+@receiver(post_save, sender=CourseEnrollment,
+          dispatch_uid='figures.pipeline.org_user_memberships.course_enrollment_saved')
+def add_enrollment_org_user_membership(sender, instance, created, **kwargs):
+    '''Adds the membership of a new enrollment
+    '''
+    if created and has_microsites():
+        load_org_user_memberships(get_enrollment_org_users(
+            CourseEnrollment.objects.filter(id=instance.id)))
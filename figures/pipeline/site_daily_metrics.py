@@ -11,9 +11,14 @@ import datetime
 from django.utils.timezone import utc
 from django.db.models import Sum
 
-from figures.helpers import as_course_key, as_datetime, next_day, prev_day
-from figures.models import CourseDailyMetrics, SiteDailyMetrics
+from courseware.models import StudentModule
+
+from figures.helpers import as_course_key, as_date, as_datetime, next_day, prev_day
+from figures.models import CourseDailyMetrics, SiteDailyActiveUsers, SiteDailyMetrics
+from figures.pipeline.monthly_metrics import update_site_monthly_metrics
+from figures.site_metrics_cache import invalidate_site_metrics
 import figures.sites
+from figures.user_id_sets import pack_user_ids
 
 # TMA IMPORTS
 import logging
@@ -72,6 +77,36 @@ def get_active_user_count_for_date(site, date_for, course_daily_metrics=None):
     return todays_active_user_count
 
 
+def get_active_user_ids_for_date(site, date_for, site_context=None):
+    '''Returns the ids of the site's users with courseware activity on the day
+
+    The users active on the day are read with one query, then checked against
+    the site's user ids of the ``SiteContext``
+    '''
+    date_for = as_date(date_for)
+    site_context = site_context or figures.sites.SiteContext(site)
+    return [user_id for user_id in StudentModule.objects.filter(
+        modified__gte=as_datetime(date_for),
+        modified__lt=as_datetime(next_day(date_for)),
+    ).values_list('student_id', flat=True).distinct().iterator()
+        if user_id in site_context.user_ids]
+
+
+def load_site_daily_active_users(site, date_for, site_context=None):
+    '''Creates or updates the SiteDailyActiveUsers record for the site and day
+
+    Returns a tuple of the record and whether it was created
+    '''
+    user_ids = set(get_active_user_ids_for_date(site, date_for, site_context))
+    return SiteDailyActiveUsers.objects.update_or_create(
+        site=site,
+        date_for=as_date(date_for),
+        defaults=dict(
+            user_count=len(user_ids),
+            user_ids=pack_user_ids(user_ids),
+        ))
+
+
 def get_previous_cumulative_active_user_count(site, date_for):
     ''' Returns the cumulative site-wide active user count for the previous day
 
@@ -124,15 +159,15 @@ class SiteDailyMetricsExtractor(object):
 
         data = dict()
 
-        # TMA retrieve org 
-        org = site.domain.split('.')[0]
+        # The TMA org of the site is the SiteContext org
+        site_context = kwargs.get('site_context') or figures.sites.SiteContext(site)
 
         # Specific TMA function :
-        site_users = figures.sites.get_users_for_org(org)
+        site_users = site_context.org_users
         user_count = site_users.filter(
             date_joined__lt=as_datetime(next_day(date_for))).count()
         # Specific TMA function :
-        site_courses = figures.sites.get_courses_for_org(org)
+        site_courses = site_context.org_courses
         course_count = site_courses.filter(
             created__lt=as_datetime(next_day(date_for))).count()
 
@@ -181,7 +216,9 @@ class SiteDailyMetricsLoader(object):
                 # proceed normally
                 pass
 
-        data = self.extractor.extract(site=site, date_for=date_for)
+        site_context = kwargs.get('site_context') or figures.sites.SiteContext(site)
+        data = self.extractor.extract(
+            site=site, date_for=date_for, site_context=site_context)
         site_metrics, created = SiteDailyMetrics.objects.update_or_create(
             date_for=date_for,
             site=site,
@@ -193,5 +230,7 @@ class SiteDailyMetricsLoader(object):
                 total_enrollment_count=data['total_enrollment_count'],
             )
         )
-        
+        load_site_daily_active_users(site, date_for, site_context)
+        update_site_monthly_metrics(site, date_for)
+        invalidate_site_metrics(site)
         return site_metrics, created
@@ -0,0 +1,322 @@
+'''Figures reports
+
+Builds the rows of a site's learner progress report, one per course
+enrollment, and writes them as CSV or NDJSON lines. The learners are read in
+chunks of ``report_batch_size()`` ordered by id, each chunk with a
+``WHERE id > <last id of the previous chunk>`` query. The enrollments,
+certificates, grades and TMA enrollments are read for a whole chunk at once,
+see ``figures.serializers.LearnerCourseData``. Only one chunk is held in
+memory, so the memory used is the same for 1k or 500k learners.
+
+The grades are those of the ``LearnerCourseGradeSnapshot``, the learner's
+most recent ``LearnerCourseGradeMetrics``
+
+Large reports are built in the background as ``ReportJob`` records. A Celery
+task, ``figures.tasks.run_report_job``, writes the report rows to a gzip CSV
+file in the default storage. Jobs are deduplicated on the site, org, report
+type, filters and date, so a report is built once a day for the same request.
+Reports are built from the current data, so jobs are only requested for today.
+A job whose task stopped sending heartbeats is queued again
+'''
+
+from collections import OrderedDict
+import csv
+import datetime
+import gzip
+import hashlib
+import json
+import tempfile
+
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import six
+from django.utils.timezone import now
+
+from student.models import CourseAccessRole
+
+from figures.filters import CourseOverviewFilter, UserFilterSet
+from figures.helpers import chunks, report_batch_size, report_job_timeout
+from figures.models import ReportJob
+from figures.pipeline.course_details import get_course_details_data
+from figures.serializers import CourseDetailsSerializer, LearnerCourseData
+from figures.sites import SiteContext
+
+
+LEARNER_PROGRESS_FIELDS = (
+    'user_id', 'username', 'email', 'name', 'rpid', 'iug', 'date_joined',
+    'course_id', 'course_name', 'date_enrolled', 'enrollment_active',
+    'course_completed', 'progress_percent', 'points_earned', 'points_possible',
+    'sections_worked', 'sections_possible', 'completion_rate',
+    'best_student_grade', 'has_validated_course',
+)
+
+DATE_FORMAT = '%Y-%m-%d'
+
+# Seconds between the heartbeats of a running report job
+REPORT_JOB_HEARTBEAT_INTERVAL = 60
+
+
+def user_chunks(users, size):
+    '''Yields lists of up to ``size`` users ordered by id
+
+    Each chunk is read with its own query starting after the last id of the
+    previous chunk
+    '''
+    users = users.select_related('profile').order_by('id')
+    chunk = list(users[:size])
+    while chunk:
+        yield chunk
+        chunk = list(users.filter(id__gt=chunk[-1].id)[:size])
+
+
+def format_date(val):
+    return val.strftime(DATE_FORMAT) if val else None
+
+
+def learner_progress_row(user, course_enrollment, learner_course_data):
+    '''Returns the report row of a course enrollment as an OrderedDict
+    '''
+    key = (user.id, str(course_enrollment.course_id))
+    profile = getattr(user, 'profile', None)
+    grades = learner_course_data.grade_metrics.get(key)
+    tma_enrollment = learner_course_data.tma_enrollments.get(course_enrollment.id)
+    return OrderedDict([
+        ('user_id', user.id),
+        ('username', user.username),
+        ('email', user.email),
+        ('name', getattr(profile, 'name', None)),
+        ('rpid', getattr(profile, 'rpid', None)),
+        ('iug', getattr(profile, 'iug', None)),
+        ('date_joined', format_date(user.date_joined)),
+        ('course_id', str(course_enrollment.course_id)),
+        ('course_name', course_enrollment.course_overview.display_name),
+        ('date_enrolled', format_date(course_enrollment.created)),
+        ('enrollment_active', course_enrollment.is_active),
+        ('course_completed', format_date(learner_course_data.certificates.get(key))),
+        ('progress_percent', grades.progress_percent if grades else 0.0),
+        ('points_earned', grades.points_earned if grades else None),
+        ('points_possible', grades.points_possible if grades else None),
+        ('sections_worked', grades.sections_worked if grades else None),
+        ('sections_possible', grades.sections_possible if grades else None),
+        ('completion_rate', getattr(tma_enrollment, 'completion_rate', None)),
+        ('best_student_grade', getattr(tma_enrollment, 'best_student_grade', None)),
+        ('has_validated_course', getattr(tma_enrollment, 'has_validated_course', None)),
+    ])
+
+
+def learner_progress_rows(users, site_context):
+    '''Yields the report rows of the users' course enrollments on the site
+
+    ``site_context`` is the ``figures.sites.SiteContext`` of the site
+    '''
+    for chunk in user_chunks(users, report_batch_size()):
+        learner_course_data = LearnerCourseData.for_users(chunk, site_context)
+        for user in chunk:
+            for course_enrollment in learner_course_data.get_course_enrollments(user):
+                yield learner_progress_row(user, course_enrollment, learner_course_data)
+
+
+class Echo(object):
+    '''File-like object returning what is written, so ``csv.writer`` returns
+    the lines instead of buffering them
+    '''
+    def write(self, value):
+        return value
+
+
+def csv_value(val):
+    if val is None:
+        return ''
+    if isinstance(val, (dict, list)):
+        val = json.dumps(val, cls=DjangoJSONEncoder)
+    if six.PY2 and isinstance(val, six.text_type):
+        return val.encode('utf-8')
+    return val
+
+
+def csv_lines(rows, fields=LEARNER_PROGRESS_FIELDS):
+    '''Yields the header then a CSV line per row
+    '''
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([csv_value(row.get(field)) for field in fields])
+
+
+def ndjson_lines(rows):
+    '''Yields a JSON object line per row
+    '''
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+EXPORT_FORMATS = OrderedDict([
+    ('csv', (csv_lines, 'text/csv')),
+    ('ndjson', (ndjson_lines, 'application/x-ndjson')),
+])
+
+
+#
+# Report jobs
+#
+
+COURSE_DETAILS_FIELDS = tuple(CourseDetailsSerializer.Meta.fields)
+
+
+def course_details_rows(courses):
+    '''Yields the course details of the courses, read in chunks
+
+    See ``figures.pipeline.course_details``
+    '''
+    for chunk in chunks(courses.iterator(), report_batch_size()):
+        for data in get_course_details_data(chunk):
+            yield data
+
+
+def learner_progress_report(site_context, filters, restricted_to=None):
+    '''Returns the fields and rows of the learner progress report
+
+    ``filters`` are the ``LearnerDetailsViewSet`` query parameters
+    '''
+    users = UserFilterSet(filters, queryset=site_context.org_users).qs
+    return LEARNER_PROGRESS_FIELDS, learner_progress_rows(users, site_context)
+
+
+def course_details_report(site_context, filters, restricted_to=None):
+    '''Returns the fields and rows of the course details report
+
+    ``filters`` are the ``CourseDetailsViewSet`` query parameters. As in the
+    view, users without staff access only get the courses they have a role in
+    '''
+    courses = CourseOverviewFilter(filters, queryset=site_context.org_courses).qs
+    if restricted_to:
+        courses = courses.filter(id__in=CourseAccessRole.objects.filter(
+            user_id=restricted_to.id).values_list('course_id', flat=True))
+    return COURSE_DETAILS_FIELDS, course_details_rows(courses)
+
+
+REPORTS = {
+    ReportJob.LEARNER_PROGRESS: learner_progress_report,
+    ReportJob.COURSE_DETAILS: course_details_report,
+}
+
+
+def get_filters_hash(filters, restricted_to=None):
+    '''Returns the hash identifying the job filters and restriction
+    '''
+    key = json.dumps(dict(
+        filters=filters,
+        restricted_to=restricted_to.id if restricted_to else None), sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_or_create_report_job(site, org, report_type, filters, date_for, restricted_to=None):
+    '''Returns the report job for the request and whether it needs to run
+
+    An existing job is returned as is unless it needs to run again, see
+    ``is_report_job_requeued``, in which case it is reset to pending
+    '''
+    job, created = ReportJob.objects.get_or_create(
+        site=site,
+        org=org,
+        report_type=report_type,
+        filters_hash=get_filters_hash(filters, restricted_to),
+        date_for=date_for,
+        defaults=dict(filters=filters, restricted_to=restricted_to))
+    if created:
+        return job, True
+    if is_report_job_requeued(job):
+        job.status = ReportJob.PENDING
+        job.error = ''
+        job.save()
+        return job, True
+    return job, False
+
+
+def is_report_job_requeued(job):
+    '''Returns whether an existing job must run again
+
+    That is when it failed or its file is missing. It is also when it stayed
+    pending, or started without a heartbeat, longer than
+    ``report_job_timeout()`` seconds, as its task was lost or its worker died.
+    A started job keeps running as long as its task sends heartbeats
+    '''
+    if job.status == ReportJob.FAILED:
+        return True
+    if job.status == ReportJob.SUCCEEDED:
+        return not (job.result_file and job.result_file.storage.exists(job.result_file.name))
+    if job.status == ReportJob.STARTED:
+        last_seen = job.heartbeat_at or job.modified
+    else:
+        last_seen = job.modified
+    return last_seen < now() - datetime.timedelta(seconds=report_job_timeout())
+
+
+def report_job_heartbeat(job):
+    '''Returns a function recording that the job's task is alive
+
+    The function saves ``heartbeat_at`` at most every
+    ``REPORT_JOB_HEARTBEAT_INTERVAL`` seconds, with an UPDATE of that field
+    only
+    '''
+    last_beat = [now()]
+
+    def heartbeat():
+        beat_at = now()
+        if (beat_at - last_beat[0]).total_seconds() >= REPORT_JOB_HEARTBEAT_INTERVAL:
+            ReportJob.objects.filter(id=job.id).update(heartbeat_at=beat_at)
+            last_beat[0] = beat_at
+    return heartbeat
+
+
+def write_report_file(job):
+    '''Writes the report rows to a gzip CSV file and saves it on the job
+
+    The file is written to a temporary file first, so only the compressed
+    file is held on disk and the rows are never held in memory. A heartbeat
+    is sent while the rows are written, see ``report_job_heartbeat``
+    '''
+    site_context = SiteContext(job.site, org=job.org)
+    fields, rows = REPORTS[job.report_type](
+        site_context, job.filters, restricted_to=job.restricted_to)
+    heartbeat = report_job_heartbeat(job)
+    row_count = -1
+    with tempfile.TemporaryFile() as tmp:
+        with gzip.GzipFile(fileobj=tmp, mode='wb') as gzip_file:
+            for line in csv_lines(rows, fields):
+                if isinstance(line, six.text_type):
+                    line = line.encode('utf-8')
+                gzip_file.write(line)
+                row_count += 1
+                heartbeat()
+        tmp.seek(0)
+        job.result_file.save('{}-{}-{}-{}.csv.gz'.format(
+            job.site.domain, job.report_type, job.date_for, job.id), File(tmp), save=False)
+    job.row_count = row_count
+
+
+def build_report_job(job_id):
+    '''Builds the report of a pending job
+
+    Jobs already started or built by another task are skipped. Errors are
+    stored on the job, which can then be requested again
+
+    Returns the job
+    '''
+    started_at = now()
+    started = ReportJob.objects.filter(id=job_id, status=ReportJob.PENDING).update(
+        status=ReportJob.STARTED, modified=started_at, heartbeat_at=started_at)
+    job = ReportJob.objects.get(id=job_id)
+    if not started:
+        return job
+    try:
+        write_report_file(job)
+        job.status = ReportJob.SUCCEEDED
+    except Exception as e:
+        job.status = ReportJob.FAILED
+        job.error = str(e)
+        raise
+    finally:
+        job.finished_at = now()
+        job.save()
+    return job
@@ -17,11 +17,13 @@ looking at adding additional Figures models to capture:
 
 """
 
+from collections import defaultdict
 import datetime
 import json
 
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
 from django_countries import Countries
 from rest_framework import serializers
 
@@ -35,6 +37,7 @@ from openedx.core.djangoapps.user_api.accounts.serializers import (
 from student.models import CourseAccessRole, CourseEnrollment
 
 from figures.compat import GeneratedCertificate
+from figures.course_roles import get_excluded_user_ids
 from figures.helpers import as_course_key
 from figures.metrics import (
     get_course_enrolled_users_for_time_period,
@@ -46,15 +49,15 @@ from figures.metrics import (
 from figures.models import (
     CourseDailyMetrics,
     SiteDailyMetrics,
-    LearnerCourseGradeMetrics,
+    LearnerCourseGradeSnapshot,
     PipelineError,
+    ReportJob,
     )
 from figures.pipeline.logger import log_error
 import figures.sites
 
 # TMA imports
 from lms.djangoapps.tma_apps.models import TmaCourseOverview, TmaCourseEnrollment
-from student.roles import CourseCcxCoachRole, CourseInstructorRole, CourseStaffRole
 from student.models import User, CourseEnrollmentAllowed
 from django.db.models import Avg
 import logging
@@ -191,8 +194,12 @@ class CourseDailyMetricsSerializer(serializers.ModelSerializer):
 
 class SiteDailyMetricsSerializer(serializers.ModelSerializer):
     """Proviedes summary data about the LMS site
+
+    ``site`` is read only. Nested writes are not supported and a writable site
+    would make DRF validate the site and date uniqueness against the nested
+    site data
     """
-    site = SiteSerializer()
+    site = SiteSerializer(read_only=True)
 
     class Meta:
         model = SiteDailyMetrics
@@ -288,7 +295,7 @@ class GeneralCourseDataSerializer(serializers.Serializer):
         We do this because the figures.metrics calls we are making require the
         site object as a parameter
         """
-        self.site = figures.sites.get_org_for_course(instance)
+        self.site = figures.sites.get_org_for_course(instance.id)
         ret = super(GeneralCourseDataSerializer, self).to_representation(instance)
         return ret
 
@@ -333,26 +340,12 @@ def get_course_history_metric(site, course_id, func, date_for, months_back):
     :returns: a dict with the current month metric and list of metrics for
     previous months
     """
-    # wrapper_func = lambda start_date, end_date: func(
-    #         start_date=start_date,
-    #         end_date=end_date,
-    #         course_id=course_id)
-
-    # def wrapper_func(start_date, end_date):
-    #         start_date=start_date,
-    #         end_date=end_date,
-    #         course_id=course_id
-
     return get_monthly_history_metric(
-        func=lambda site, start_date, end_date: func(
-            site=site,
-            start_date=start_date,
-            end_date=end_date,
-            # site=site,
-            course_id=course_id),
+        func=func,
         site=site,
         date_for=date_for,
         months_back=months_back,
+        course_id=course_id,
         )
 
 
@@ -411,7 +404,7 @@ class CourseDetailsSerializer(serializers.ModelSerializer):
         We do this because the figures.metrics calls we are making require the
         site object as a parameter
         """
-        self.site = figures.sites.get_org_for_course(instance)
+        self.site = figures.sites.get_org_for_course(instance.id)
         ret = super(CourseDetailsSerializer, self).to_representation(instance)
         return ret
 
@@ -485,11 +478,9 @@ class CourseDetailsSerializer(serializers.ModelSerializer):
         Retrieves all learners who have has_validated_course=True in TmaCourseEnrollment
         Excludes Staff-Admins-Coaches
         """
-        staff = CourseStaffRole(course_overview.id).users_with_role()
-        admins = CourseInstructorRole(course_overview.id).users_with_role()
-        coaches = CourseCcxCoachRole(course_overview.id).users_with_role()
+        excluded_user_ids = get_excluded_user_ids(course_overview.id)
 
-        qs = TmaCourseEnrollment.objects.filter(course_enrollment_edx__course_id=course_overview.id, has_validated_course=True).exclude(course_enrollment_edx__user__in=staff).exclude(course_enrollment_edx__user__in=admins).exclude(course_enrollment_edx__user__in=coaches)
+        qs = TmaCourseEnrollment.objects.filter(course_enrollment_edx__course_id=course_overview.id, has_validated_course=True).exclude(course_enrollment_edx__user_id__in=excluded_user_ids)
         if qs:
             return qs.count()
         else:
@@ -550,11 +541,9 @@ class CourseDetailsSerializer(serializers.ModelSerializer):
         Calculate the average of all best student grades (in TmaCourseEnrollment) for learners who passed the course (has_validated_course=True)
         Excludes Staff-Admins-Coaches
         """
-        staff = CourseStaffRole(course_overview.id).users_with_role()
-        admins = CourseInstructorRole(course_overview.id).users_with_role()
-        coaches = CourseCcxCoachRole(course_overview.id).users_with_role()
-        
-        qs = TmaCourseEnrollment.objects.filter(course_enrollment_edx__course_id=course_overview.id, has_validated_course=True).exclude(course_enrollment_edx__user__in=staff).exclude(course_enrollment_edx__user__in=admins).exclude(course_enrollment_edx__user__in=coaches).aggregate(Avg('best_student_grade'))
+        excluded_user_ids = get_excluded_user_ids(course_overview.id)
+
+        qs = TmaCourseEnrollment.objects.filter(course_enrollment_edx__course_id=course_overview.id, has_validated_course=True).exclude(course_enrollment_edx__user_id__in=excluded_user_ids).aggregate(Avg('best_student_grade'))
         if qs:
             return qs.get("best_student_grade__avg")
         else:
@@ -565,11 +554,9 @@ class CourseDetailsSerializer(serializers.ModelSerializer):
         Calculate the average of all best student grades (in TmaCourseEnrollment) for learners who have a best student grade > 0
         Excludes Staff-Admins-Coaches
         """
-        staff = CourseStaffRole(course_overview.id).users_with_role()
-        admins = CourseInstructorRole(course_overview.id).users_with_role()
-        coaches = CourseCcxCoachRole(course_overview.id).users_with_role()
-        
-        qs = TmaCourseEnrollment.objects.filter(course_enrollment_edx__course_id=course_overview.id, best_student_grade__gt=0).exclude(course_enrollment_edx__user__in=staff).exclude(course_enrollment_edx__user__in=admins).exclude(course_enrollment_edx__user__in=coaches).aggregate(Avg('best_student_grade'))
+        excluded_user_ids = get_excluded_user_ids(course_overview.id)
+
+        qs = TmaCourseEnrollment.objects.filter(course_enrollment_edx__course_id=course_overview.id, best_student_grade__gt=0).exclude(course_enrollment_edx__user_id__in=excluded_user_ids).aggregate(Avg('best_student_grade'))
         if qs:
             return qs.get("best_student_grade__avg")
         else:
@@ -701,6 +688,50 @@ class UserDemographicSerializer(serializers.Serializer):
         read_only=True)
 
 
+class LearnerCourseData(object):
+    """
+    The per enrollment data ``LearnerCourseDetailsSerializer`` reads, loaded
+    for a list of course enrollments at once
+
+    Reads the certificates, the LearnerCourseGradeSnapshot records and the
+    TMA enrollments with one query each, instead of several queries per
+    enrollment. The certificates and grade metrics are keyed by
+    (user id, course id string), the TMA enrollments by course enrollment id
+    """
+    def __init__(self, course_enrollments):
+        course_enrollments = list(course_enrollments)
+        user_ids = set(ce.user_id for ce in course_enrollments)
+        self.user_course_enrollments = defaultdict(list)
+        for ce in course_enrollments:
+            self.user_course_enrollments[ce.user_id].append(ce)
+
+        self.certificates = {}
+        for user_id, course_id, created_date in GeneratedCertificate.objects.filter(
+                user_id__in=user_ids).values_list('user_id', 'course_id', 'created_date'):
+            self.certificates.setdefault((user_id, str(course_id)), created_date)
+
+        self.grade_metrics = LearnerCourseGradeSnapshot.objects.for_learner_courses(
+            (ce.user_id, ce.course_id) for ce in course_enrollments)
+
+        self.tma_enrollments = dict(
+            (tma_enrollment.course_enrollment_edx_id, tma_enrollment)
+            for tma_enrollment in TmaCourseEnrollment.objects.filter(
+                course_enrollment_edx_id__in=[ce.id for ce in course_enrollments]))
+
+    @classmethod
+    def for_users(cls, users, site_context):
+        """Loads the data for the users' course enrollments on the site
+
+        ``site_context`` is the ``figures.sites.SiteContext`` of the site
+        """
+        return cls(site_context.course_enrollments.filter(
+            user_id__in=[user.id for user in users]).select_related(
+            'course_overview', 'user'))
+
+    def get_course_enrollments(self, user):
+        return self.user_course_enrollments.get(user.id, [])
+
+
 class LearnerCourseDetailsSerializer(serializers.ModelSerializer):
     """
             {
@@ -742,36 +773,26 @@ class LearnerCourseDetailsSerializer(serializers.ModelSerializer):
         TODO: Add this to metrics, then we'll need to store per-user progress data
         For initial implementation, we get the
 
-        TODO: We will cache course grades, so we'll refactor this method to  use
-        the cache, so we'll likely change the call to LearnerCourseGrades
+        Reads the certificate, latest grade metrics and TMA enrollment from the
+        ``learner_course_data`` context, a ``LearnerCourseData`` instance. If
+        there is none, they are read for this enrollment only
         """
-        log.info(course_enrollment.user.email)
-        log.info(TmaCourseEnrollment(course_enrollment_edx=course_enrollment).best_student_grade)
+        learner_course_data = self.context.get(
+            'learner_course_data') or LearnerCourseData([course_enrollment])
+        key = (course_enrollment.user_id, str(course_enrollment.course_id))
 
-        cert = GeneratedCertificate.objects.filter(
-            user=course_enrollment.user,
-            course_id=course_enrollment.course_id,
-            )
+        course_completed = learner_course_data.certificates.get(key, False)
 
-        if cert:
-            course_completed = cert[0].created_date
-        else:
-            course_completed = False
-
-        try:
-            obj = LearnerCourseGradeMetrics.objects.most_recent_for_learner_course(
-                user=course_enrollment.user,
-                course_id=str(course_enrollment.course_id))
+        obj = learner_course_data.grade_metrics.get(key)
+        if obj:
             course_progress = dict(
                 progress_percent=obj.progress_percent,
                 course_progress_details=obj.progress_details)
-
-        except Exception as e:
+        else:
             error_data = dict(
                 msg='Unable to get learner course metrics',
                 username=course_enrollment.user.username,
                 course_id=str(course_enrollment.course_id),
-                exception=str(e)
                 )
             log_error(
                 error_data=error_data,
@@ -786,16 +807,14 @@ class LearnerCourseDetailsSerializer(serializers.ModelSerializer):
         course_progress_history = []
 
         # TMA add score to course_progress_details
-        if course_progress['course_progress_details']:
-            try:
-                course_progress['course_progress_details'].update(
-                    {
-                        'best_student_grade': TmaCourseEnrollment.objects.get(course_enrollment_edx=course_enrollment).best_student_grade,
-                        'completion_rate': TmaCourseEnrollment.objects.get(course_enrollment_edx=course_enrollment).completion_rate
-                    }
-                )
-            except:
-                pass
+        tma_enrollment = learner_course_data.tma_enrollments.get(course_enrollment.id)
+        if course_progress['course_progress_details'] and tma_enrollment:
+            course_progress['course_progress_details'].update(
+                {
+                    'best_student_grade': tma_enrollment.best_student_grade,
+                    'completion_rate': tma_enrollment.completion_rate
+                }
+            )
 
         data = dict(
             course_completed=course_completed,
@@ -898,10 +917,18 @@ class LearnerDetailsSerializer(serializers.ModelSerializer):
         This method is a hack until I figure out customizing DRF fields and/or
         related serializers to explicitly link models not linked via FK
 
+        Reads the enrollments from the ``learner_course_data`` context if the
+        view loaded it for the whole page of users
         """
-        course_enrollments = figures.sites.get_course_enrollments_for_site(
-            self.context.get('site')).filter(user=user)
-        return LearnerCourseDetailsSerializer(course_enrollments, many=True).data
+        learner_course_data = self.context.get('learner_course_data')
+        if learner_course_data is None:
+            site_context = self.context.get('site_context') or figures.sites.SiteContext(
+                self.context.get('site'))
+            learner_course_data = LearnerCourseData.for_users([user], site_context)
+        return LearnerCourseDetailsSerializer(
+            learner_course_data.get_course_enrollments(user),
+            many=True,
+            context=dict(learner_course_data=learner_course_data)).data
 
     def get_profile_image(self, user):
         if hasattr(user, 'profile'):
@@ -913,3 +940,36 @@ class LearnerDetailsSerializer(serializers.ModelSerializer):
 class ProgramNameSerializer(serializers.Serializer):
 
     program_name = serializers.CharField()
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    """Serializes a ``figures.models.ReportJob``
+
+    ``filters`` are the query parameters of the report's list endpoint.
+    ``date_for`` can only be today, as reports are built from the current
+    data. ``download_url`` is set once the report file is built
+    """
+    filters = serializers.DictField(child=serializers.CharField(), required=False)
+    date_for = serializers.DateField(required=False)
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = ('id', 'report_type', 'filters', 'date_for', 'status', 'row_count',
+                  'error', 'created', 'finished_at', 'download_url',)
+        read_only_fields = ('id', 'status', 'row_count', 'error', 'created',
+                            'finished_at', 'download_url',)
+
+    def validate_date_for(self, value):
+        if value != datetime.date.today():
+            raise serializers.ValidationError(
+                'Reports are built from the current data, only today is accepted.')
+        return value
+
+    def get_download_url(self, job):
+        request = self.context.get('request')
+        if job.status != ReportJob.SUCCEEDED or not getattr(request, 'resolver_match', None):
+            return None
+        return request.build_absolute_uri(reverse(
+            '{}:report-jobs-download'.format(request.resolver_match.namespace),
+            kwargs=dict(pk=job.id)))
@@ -26,13 +26,26 @@ def update_celerybeat_schedule(celerybeat_schedule_settings, figures_env_tokens)
     Figures pipeline job schedule configuration in CELERYBEAT_SCHEDULE.
     """
     if figures_env_tokens.get('ENABLE_DAILY_METRICS_IMPORT', True):
+        if figures_env_tokens.get('ENABLE_PARALLEL_DAILY_METRICS_IMPORT', False):
+            task = 'figures.tasks.parallel_populate_daily_metrics'
+        else:
+            task = 'figures.tasks.populate_daily_metrics'
         celerybeat_schedule_settings['figures-populate-daily-metrics'] = {
-            'task': 'figures.tasks.populate_daily_metrics',
+            'task': task,
             'schedule': crontab(
                 hour=figures_env_tokens.get('DAILY_METRICS_IMPORT_HOUR', 2),
                 minute=figures_env_tokens.get('DAILY_METRICS_IMPORT_MINUTE', 0),
                 ),
             }
+    if figures_env_tokens.get('ENABLE_GRADE_METRICS_COMPACTION', False):
+        celerybeat_schedule_settings['figures-compact-learner-course-grades'] = {
+            'task': 'figures.tasks.compact_learner_course_grades',
+            'schedule': crontab(
+                day_of_week=figures_env_tokens.get('GRADE_METRICS_COMPACTION_DAY_OF_WEEK', 0),
+                hour=figures_env_tokens.get('GRADE_METRICS_COMPACTION_HOUR', 4),
+                minute=0,
+                ),
+            }
 
 
 def plugin_settings(settings):
@@ -54,6 +67,14 @@ def plugin_settings(settings):
             "ENABLE_DAILY_METRICS_IMPORT": false
         },
 
+    Set ``ENABLE_PARALLEL_DAILY_METRICS_IMPORT`` to true to schedule the
+    parallel pipeline task, ``parallel_populate_daily_metrics``, instead. This
+    requires a Celery result backend.
+
+    Set ``ENABLE_GRADE_METRICS_COMPACTION`` to true to schedule a weekly
+    ``compact_learner_course_grades`` task, which compacts the learner grade
+    metrics history older than the retention window.
+
     """
     settings.ENV_TOKENS.setdefault('FIGURES', {})
     update_webpack_loader(settings.WEBPACK_LOADER, settings.ENV_TOKENS['FIGURES'])
@@ -0,0 +1,70 @@
+'''Cached general site metrics
+
+The general site metrics endpoint computes five monthly series for the site.
+The series only change when the pipeline writes the site daily metrics, so
+this module caches them per site, date and number of months.
+
+Cache entries are versioned on the most recent modification time of the
+site's ``SiteDailyMetrics`` records. The version is cached too, and cleared by
+``invalidate_site_metrics`` when the pipeline or the backfill writes site
+daily metrics. The endpoint also uses the version for its ETag and
+Last-Modified headers
+'''
+
+import datetime
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Max
+
+from figures.helpers import as_date, site_metrics_cache_timeout
+from figures.models import SiteDailyMetrics
+
+
+def site_metrics_version_cache_key(site):
+    return 'figures.site_metrics_cache.version.{}'.format(site.id)
+
+
+def get_site_metrics_version(site):
+    '''Returns the modification time of the site's latest daily metrics
+
+    Returns None if the site has no daily metrics
+    '''
+    key = site_metrics_version_cache_key(site)
+    version = cache.get(key)
+    if version is None:
+        version = SiteDailyMetrics.objects.filter(site=site).aggregate(
+            modified=Max('modified'))['modified'] or ''
+        cache.set(key, version, site_metrics_cache_timeout())
+    return version or None
+
+
+def invalidate_site_metrics(site):
+    cache.delete(site_metrics_version_cache_key(site))
+
+
+def site_metrics_cache_key(site, date_for, months_back, version):
+    return 'figures.site_metrics_cache.metrics.{}.{}.{}.{}'.format(
+        site.id, date_for, months_back,
+        version.isoformat() if version else 'none')
+
+
+def site_metrics_etag(cache_key):
+    return '"{}"'.format(hashlib.md5(cache_key.encode('utf-8')).hexdigest())
+
+
+def get_site_metrics(site, date_for, months_back, metrics_method):
+    '''Returns the site metrics, computing them with ``metrics_method`` on a
+    cache miss
+
+    ``date_for`` defaults to the current date. Returns a tuple of the data,
+    the version and the ETag of the data
+    '''
+    date_for = as_date(date_for) if date_for else datetime.datetime.utcnow().date()
+    version = get_site_metrics_version(site)
+    key = site_metrics_cache_key(site, date_for, months_back, version)
+    data = cache.get(key)
+    if data is None:
+        data = metrics_method(site=site, date_for=date_for, months_back=months_back)
+        cache.set(key, data, site_metrics_cache_timeout())
+    return data, version, site_metrics_etag(key)
@@ -10,9 +10,15 @@ TODO:
 Document how organization site mapping works
 """
 
+from uuid import uuid4
+
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.functional import cached_property
 
 # TODO: Add exception handling
 import organizations
@@ -23,6 +29,7 @@ from openedx.core.djangoapps.content.course_overviews.models import (
 from student.models import UserProfile, CourseEnrollment
 
 from figures.helpers import as_course_key
+from figures.models import OrgUserMembership, OrgUserMembershipLoad
 import figures.helpers
 
 # TMA IMPORTS
@@ -82,20 +89,69 @@ def get_site_for_course(course_id):
     return site
 
 
+ORG_SITE_INDEX_VERSION_CACHE_KEY = 'figures.sites.org_site_index_version'
+
+# Process wide org to site index, see ``get_org_site_index``. It is replaced,
+# never changed in place, so concurrent readers always see a complete index
+_org_site_index = {}
+
+
+def get_org_site_index_version():
+    """Returns the version stamp of the org to site index
+
+    The stamp is kept in the Django cache so that all the processes rebuild
+    their index when a site changes
+    """
+    version = cache.get(ORG_SITE_INDEX_VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(ORG_SITE_INDEX_VERSION_CACHE_KEY, uuid4().hex, None)
+        version = cache.get(ORG_SITE_INDEX_VERSION_CACHE_KEY)
+    return version
+
+
+def get_org_site_index():
+    """Returns a tuple of the dict of org to site and the default site
+
+    The org of a site is the first label of its domain, lower cased. The
+    index is built with one Site query and kept for the process until the
+    version stamp changes
+    """
+    global _org_site_index
+    version = get_org_site_index_version()
+    index = _org_site_index
+    if version is None or index.get('version') != version:
+        sites = list(Site.objects.all())
+        index = dict(
+            version=version,
+            orgs=dict((site.domain.split('.')[0].lower(), site) for site in sites),
+            default=next((site for site in sites if site.id == settings.SITE_ID), None))
+        _org_site_index = index
+    return index['orgs'], index['default']
+
+
+@receiver(post_save, sender=Site, dispatch_uid='figures.sites.site_saved')
+@receiver(post_delete, sender=Site, dispatch_uid='figures.sites.site_deleted')
+def invalidate_org_site_index(sender, **kwargs):
+    global _org_site_index
+    _org_site_index = {}
+    cache.set(ORG_SITE_INDEX_VERSION_CACHE_KEY, uuid4().hex, None)
+
+
 def get_org_for_course(course_id):
     """
     If "FIGURES_HAS_MICROSITES" setting is true : returns the site based on the org related to the course_id
 
+    The site is the one whose org, see ``get_org_site_index``, is the org of
+    the course key, ignoring case. Courses without a matching site and single
+    site mode get the default site. Uses the org to site index, so this does
+    not query the sites
+
     This function is specific to TMA multi-microsites platforms.
     """
-    site = Site.objects.get(id=settings.SITE_ID)
+    orgs, site = get_org_site_index()
     if bool(settings.FEATURES.get('FIGURES_HAS_MICROSITES', False)):
-        for site_obj in Site.objects.all():
-            org = site_obj.domain.split('.')[0]
-            if org in str(course_id):
-                site = site_obj
-    else:
-        # Operating in single site / standalone mode, return the default site
+        site = orgs.get(as_course_key(course_id).org.lower(), site)
+    if site is None:
         site = Site.objects.get(id=settings.SITE_ID)
     return site
 
@@ -140,10 +196,7 @@ def get_courses_for_org(org):
     """
 
     if bool(settings.FEATURES.get('FIGURES_HAS_MICROSITES', False)):
-        course_overviews = CourseOverview.objects.filter(org=org)
-        course_ids = course_overviews.values_list('id', flat=True)
-        course_keys = [as_course_key(cid) for cid in course_ids]
-        courses = CourseOverview.objects.filter(id__in=course_keys, tmacourseoverview__is_vodeclic=False)
+        courses = CourseOverview.objects.filter(org=org, tmacourseoverview__is_vodeclic=False)
     else:
         courses = CourseOverview.objects.filter(tmacourseoverview__is_vodeclic=False)
     return courses
@@ -169,15 +222,46 @@ def get_users_for_site(site):
     return users
 
 
+def get_org_membership_orgs(org):
+    """Returns the list of course orgs of the TMA microsite ``org``, the orgs
+    containing it, to read its users from the OrgUserMembership table
+
+    Returns None until the first pipeline load of the table, recorded as an
+    ``OrgUserMembershipLoad``
+    """
+    if not OrgUserMembershipLoad.objects.exists():
+        return None
+    return sorted(set(CourseOverview.objects.filter(org__contains=org).values_list(
+        'org', flat=True)))
+
+
+def get_org_users(org, membership_orgs):
+    """Returns the users of the TMA microsite ``org``
+
+    ``membership_orgs`` is the result of ``get_org_membership_orgs``. The users
+    are read from the OrgUserMembership table by these orgs, or from the
+    course enrollments if the table was not loaded yet
+    """
+    if membership_orgs is not None:
+        user_ids = OrgUserMembership.objects.filter(
+            org__in=membership_orgs).values('user_id')
+    else:
+        user_ids = CourseEnrollment.objects.filter(course__org__contains=org, course__tmacourseoverview__is_vodeclic=False).values_list('user_id', flat=True)
+    return get_user_model().objects.filter(id__in=user_ids)
+
+
 def get_users_for_org(org):
     """
     If "FIGURES_HAS_MICROSITES" setting is true : returns the users registered in a specific microsite (the info is stored in auth_userprofile.custom_field)
 
+    See ``get_org_users``. Each call checks the OrgUserMembership table was
+    loaded and reads the course orgs, ``SiteContext.org_users`` does it once
+    per request
+
     This function is specific to TMA multi-microsites platforms.
     """
-    if bool(settings.FEATURES.get('FIGURES_HAS_MICROSITES', False)):
-        ce = CourseEnrollment.objects.filter(course__org__contains=org, course__tmacourseoverview__is_vodeclic=False).values_list('user_id', flat=True)
-        users = get_user_model().objects.filter(id__in=ce)
+    if figures.helpers.has_microsites():
+        users = get_org_users(org, get_org_membership_orgs(org))
     else:
         users = get_user_model().objects.all()
     return users
@@ -198,4 +282,86 @@ def get_course_enrollments_for_org(org):
         ce = CourseEnrollment.objects.filter(course__org__contains=org, course__tmacourseoverview__is_vodeclic=False)
     else:
         ce = CourseEnrollment.objects.filter(course__tmacourseoverview__is_vodeclic=False)
-    return ce
\ No newline at end of file
+    return ce
+
+
+class SiteContext(object):
+    """Memoizes the course and user membership data of a site
+
+    Create one per request or pipeline run and pass it to the code serving
+    it. Each membership set is built once for the lifetime of the context,
+    so changes made meanwhile are not seen. Do not keep a context beyond the
+    request or run.
+
+    The course keys and the site's user ids are read once, into a list and a
+    frozenset, so the pipeline checks users against the site in memory
+    instead of joining the membership tables in each query. ``org`` is the
+    TMA microsite org, defaulting to the first label of the site domain
+
+    The user, course and enrollment members are querysets, as the views
+    filter, order and paginate them in the database. They are built once from
+    the memoized data, like the course keys, and are never evaluated by the
+    context itself
+    """
+    def __init__(self, site, org=None):
+        self.site = site
+        self.org = site.domain.split('.')[0] if org is None else org
+
+    @cached_property
+    def course_keys(self):
+        return get_course_keys_for_site(self.site)
+
+    @cached_property
+    def course_key_set(self):
+        return frozenset(self.course_keys)
+
+    @cached_property
+    def courses(self):
+        if figures.helpers.is_multisite():
+            return CourseOverview.objects.filter(id__in=self.course_keys).exclude(
+                tmacourseoverview__is_vodeclic=True)
+        return get_courses_for_site(self.site)
+
+    @cached_property
+    def user_ids(self):
+        return frozenset(get_user_ids_for_site(self.site))
+
+    @cached_property
+    def default_site(self):
+        if self.site.id == settings.SITE_ID:
+            return self.site
+        return Site.objects.get(id=settings.SITE_ID)
+
+    def get_site_for_course(self, course_id):
+        """Returns the site of the course, see ``get_site_for_course``
+
+        The site's own courses and standalone mode are answered without
+        queries
+        """
+        if not figures.helpers.is_multisite():
+            return self.default_site
+        if as_course_key(course_id) in self.course_key_set:
+            return self.site
+        return get_site_for_course(course_id)
+
+    @cached_property
+    def users(self):
+        return get_users_for_site(self.site)
+
+    @cached_property
+    def course_enrollments(self):
+        return CourseEnrollment.objects.filter(course_id__in=self.course_keys)
+
+    @cached_property
+    def org_courses(self):
+        return get_courses_for_org(self.org)
+
+    @cached_property
+    def org_membership_orgs(self):
+        return get_org_membership_orgs(self.org)
+
+    @cached_property
+    def org_users(self):
+        if figures.helpers.has_microsites():
+            return get_org_users(self.org, self.org_membership_orgs)
+        return get_users_for_org(self.org)
@@ -6,19 +6,42 @@ import datetime
 import time
 
 from django.contrib.sites.models import Site
-from django.utils.timezone import utc
+from django.utils.timezone import now, utc
 
-from celery import chord
+from celery import chain, chord
 from celery.app import shared_task
+from celery.exceptions import SoftTimeLimitExceeded
 from celery.utils.log import get_task_logger
 
-from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
 from student.models import CourseEnrollment
 
-from figures.helpers import as_course_key, as_date
-from figures.models import PipelineError
-from figures.pipeline.course_daily_metrics import CourseDailyMetricsLoader
+from figures.helpers import (
+    as_course_key,
+    as_date,
+    pipeline_course_max_retries,
+    pipeline_course_time_limit,
+    pipeline_max_parallel_tasks,
+)
+from figures.models import PipelineError, PipelineRun
+from figures.pipeline.backfill import backfill_daily_metrics as backfill_site_metrics
+from figures.pipeline.checkpoints import (
+    completed_course_ids,
+    course_checkpoint,
+    finish_pipeline_run,
+    last_activity,
+    start_pipeline_run,
+)
+from figures.pipeline.course_details import load_course_details_snapshot
+from figures.pipeline.grade_metrics_compaction import (
+    compact_learner_course_grades as compact_grade_metrics,
+)
+from figures.pipeline.course_daily_metrics import (
+    CourseDailyMetricsLoader,
+    get_active_learner_counts,
+)
+from figures.pipeline.org_user_memberships import update_org_user_memberships
 from figures.pipeline.site_daily_metrics import SiteDailyMetricsLoader
+from figures.reports import build_report_job
 import figures.sites
 from figures.pipeline.logger import log_error_to_db
 
@@ -33,9 +56,38 @@ logger = get_task_logger(__name__)
 # logger.setLevel('INFO')
 
 
+def log_course_error(exception, msg, date_for, course_id, site=None):
+    '''Captures a course metrics exception to the Figures pipeline error table
+
+    We always capture CDM load exceptions, regardless of the
+    ``FIGURES_LOG_PIPELINE_ERRORS_TO_DB`` setting
+    '''
+    error_data = dict(
+        date_for=date_for,
+        msg=msg,
+        exception_class=exception.__class__.__name__,
+        )
+    if hasattr(exception, 'message_dict'):
+        error_data['message_dict'] = exception.message_dict
+    log_error_to_db(
+        error_data=error_data,
+        error_type=PipelineError.COURSE_DATA,
+        course_id=str(course_id),
+        site=site,
+        logger=logger,
+        log_pipeline_errors_to_db=True,
+        )
+
+
 @shared_task
-def populate_single_cdm(course_id, date_for=None, force_update=False):
+def populate_single_cdm(course_id, date_for=None, force_update=False,
+                        active_learners_today=None, site_context=None):
     '''Populates a CourseDailyMetrics record for the given date and course
+
+    The site pipelines pass ``active_learners_today`` from a single query for
+    all the site's courses. If it is None, the course is queried on its own.
+    ``site_context`` is the ``figures.sites.SiteContext`` shared by the
+    courses of a site
     '''
     if date_for:
         date_for = as_date(date_for)
@@ -49,13 +101,37 @@ def populate_single_cdm(course_id, date_for=None, force_update=False):
 
     start_time = time.time()
 
-    cdm_obj, created = CourseDailyMetricsLoader(
-        course_id).load(date_for=date_for, force_update=force_update)
+    cdm_obj, created = CourseDailyMetricsLoader(course_id, site_context=site_context).load(
+        date_for=date_for,
+        force_update=force_update,
+        active_learners_today=active_learners_today)
     elapsed_time = time.time() - start_time
     logger.info('done. Elapsed time (seconds)={}. cdm_obj={}'.format(
         elapsed_time, cdm_obj))
 
 
+def populate_course_details_snapshot(course_id, date_for, site=None):
+    '''Refreshes the course details snapshot after the course daily metrics
+
+    Errors are logged and not raised. The course metrics are already saved,
+    and the course details endpoint falls back to the previous snapshot or to
+    live data
+    '''
+    try:
+        load_course_details_snapshot(course_id=course_id, date_for=date_for)
+    except SoftTimeLimitExceeded:
+        raise
+    except Exception as e:
+        logger.exception('populate_course_details_snapshot failed for course "{}"'.format(
+            course_id))
+        log_course_error(
+            exception=e,
+            msg='figures.tasks.populate_course_details_snapshot failed',
+            date_for=date_for,
+            course_id=course_id,
+            site=site)
+
+
 @shared_task
 def populate_site_daily_metrics(site_id, **kwargs):
     '''Populate a SiteDailyMetrics record
@@ -72,20 +148,27 @@ def populate_site_daily_metrics(site_id, **kwargs):
 
 
 @shared_task
-def populate_daily_metrics(date_for=None, force_update=False):
+def populate_daily_metrics(date_for=None, force_update=False, resume=False):
     '''Populates the daily metrics models for the given date
 
-    This method populates CourseDailyMetrics for all the courses in the site,
-    then populates SiteDailyMetrics
+    This method first adds the org user memberships of the new enrollments,
+    see ``figures.pipeline.org_user_memberships``. Then it populates
+    CourseDailyMetrics and the course details snapshot for all the courses in
+    the site, then populates SiteDailyMetrics
+
+    Progress is recorded per site in a ``PipelineRun`` with a checkpoint per
+    course. If ``resume`` is true, we continue the last run for the site and
+    date, skipping the courses it already completed, and populate the site
+    metrics again. Sites whose last run finished with all its courses
+    completed are skipped
 
     It calls the individual tasks, ``populate_single_cdm`` and
     ``populate_site_daily_metrics`` as immediate calls so that no courses are
     missed when the site daily metrics record is populated.
 
-    NOTE: We have an experimental task that runs the course populators in
-
-    parallel, then when they are all done, populates the site metrics. See the
-    function ``experimental_populate_daily_metrics`` docstring for details
+    NOTE: The task ``parallel_populate_daily_metrics`` runs the course
+    populators in parallel, then when they are all done, populates the site
+    metrics. See its docstring for details
 
     TODO: Add error handling and error logging
     TODO: Create and add decorator to assign 'date_for' if None
@@ -98,91 +181,301 @@ def populate_daily_metrics(date_for=None, force_update=False):
     logger.info('Starting task "figures.populate_daily_metrics" for date "{}"'.format(
         date_for))
 
+    update_org_user_memberships()
     for site in Site.objects.all():
-        for course in figures.sites.get_courses_for_site(site):
+        run = start_pipeline_run(site=site, date_for=date_for, resume=resume)
+        if run.status == PipelineRun.FINISHED:
+            logger.info('Skipping site "{}", finished in run {}'.format(
+                site.domain, run.id))
+            continue
+        skip_course_ids = completed_course_ids(run)
+        site_context = figures.sites.SiteContext(site)
+        courses = figures.sites.get_courses_for_site(site)
+        active_learner_counts = get_active_learner_counts(
+            [course.id for course in courses], date_for)
+        for course in courses:
+            if str(course.id) in skip_course_ids:
+                logger.info('Skipping course "{}", completed in run {}'.format(
+                    course.id, run.id))
+                continue
             try:
-                populate_single_cdm(
-                    course_id=course.id,
-                    date_for=date_for,
-                    force_update=force_update)
+                with course_checkpoint(run, course.id):
+                    populate_single_cdm(
+                        course_id=course.id,
+                        date_for=date_for,
+                        force_update=force_update,
+                        active_learners_today=active_learner_counts.get(
+                            str(course.id), 0),
+                        site_context=site_context)
+                populate_course_details_snapshot(
+                    course_id=course.id, date_for=date_for, site=site)
             except Exception as e:
                 logger.exception('figures.tasks.populate_daily_metrics failed')
-                # Always capture CDM load exceptions to the Figures pipeline
-                # error table
-                error_data = dict(
-                    date_for=date_for,
+                log_course_error(
+                    exception=e,
                     msg='figures.tasks.populate_daily_metrics failed',
-                    exception_class=e.__class__.__name__,
-                    )
-                if hasattr(e, 'message_dict'):
-                    error_data['message_dict'] = e.message_dict
-                log_error_to_db(
-                    error_data=error_data,
-                    error_type=PipelineError.COURSE_DATA,
-                    course_id=str(course.id),
-                    site=site,
-                    logger=logger,
-                    log_pipeline_errors_to_db=True,
-                    )
+                    date_for=date_for,
+                    course_id=course.id,
+                    site=site)
         populate_site_daily_metrics(
             site_id=site.id,
             date_for=date_for,
-            force_update=force_update)
+            force_update=force_update or resume)
+        finish_pipeline_run(run)
 
     logger.info('Finished task "figures.populate_daily_metrics" for date "{}"'.format(
         date_for))
 
 
 #
-# Experimental tasks
+# Parallel pipeline tasks
 #
 
 
+@shared_task(bind=True)
+def populate_course_daily_metrics(self, course_id, run_id, date_for=None, force_update=False,
+                                  active_learners_today=None):
+    '''Populates a CourseDailyMetrics record as part of the parallel pipeline
+
+    The course is checkpointed in the ``PipelineRun`` identified by ``run_id``
+
+    Failed runs are retried up to ``pipeline_course_max_retries()`` times.
+    After that, or if the task runs out of time, the error is logged to the
+    PipelineError table and the task returns normally. This is so that the
+    rest of the site's course tasks and the site metrics callback still run
+
+    Returns True if the course metrics were populated, else False
+    '''
+    run = PipelineRun.objects.get(id=run_id)
+    try:
+        with course_checkpoint(run, course_id):
+            populate_single_cdm(
+                course_id=course_id,
+                date_for=date_for,
+                force_update=force_update,
+                active_learners_today=active_learners_today)
+        populate_course_details_snapshot(
+            course_id=course_id, date_for=date_for, site=run.site)
+        return True
+    except SoftTimeLimitExceeded as e:
+        logger.error('populate_course_daily_metrics timed out for course "{}"'.format(
+            course_id))
+        error = e
+    except Exception as e:
+        if self.request.retries < pipeline_course_max_retries():
+            raise self.retry(
+                exc=e,
+                countdown=60,
+                max_retries=pipeline_course_max_retries())
+        logger.exception('populate_course_daily_metrics failed for course "{}"'.format(
+            course_id))
+        error = e
+    log_course_error(
+        exception=error,
+        msg='figures.tasks.populate_course_daily_metrics failed',
+        date_for=date_for,
+        course_id=course_id,
+        site=run.site)
+    return False
+
+
+def complete_site_daily_metrics(site_id, run_id, **kwargs):
+    '''Populates the site metrics of a parallel run and finishes the run
+
+    If the run was already finished, the site metrics are populated again
+    with ``force_update``, as course tasks may have completed since
+    '''
+    run = PipelineRun.objects.get(id=run_id)
+    if run.status == PipelineRun.FINISHED:
+        kwargs['force_update'] = True
+    populate_site_daily_metrics(site_id=site_id, **kwargs)
+    finish_pipeline_run(run)
+
+
 @shared_task
-def experimental_populate_daily_metrics(date_for=None, force_update=False):
-    '''Experimental task to populate daily metrics
+def populate_site_daily_metrics_callback(course_results, site_id, run_id, **kwargs):
+    '''Chord callback to populate SiteDailyMetrics after the course tasks
+
+    ``course_results`` holds the return value of the last course task of each
+    lane and is not used. We populate the site metrics whether or not some
+    courses failed, as failures are already logged to the PipelineError table
+    '''
+    logger.debug('course tasks done for site_id={}'.format(site_id))
+    complete_site_daily_metrics(site_id=site_id, run_id=run_id, **kwargs)
+
+
+def pipeline_stall_timeout():
+    '''Returns the seconds without course task activity after which a
+    parallel run is considered stalled
+
+    That is past the hard time limit of a course task plus its retry delay
+    '''
+    return pipeline_course_time_limit() + 180
 
-    WARNING: In Ginkgo devstack, this task tends to gets stuck in the middle of
-    processing course metrics. Not all the courses get processed and the site
-    metrics doesn't get called.
 
-    We're keeping it in the tasks so that we can continue to debug this.
-    Enabling parallel course tasks will improve the pipeline performance
+@shared_task(bind=True)
+def finalize_site_daily_metrics(self, site_id, run_id, **kwargs):
+    '''Populates the site metrics of a parallel run the chord callback missed
 
+    Runs independently of the chord. A course task killed by the hard time
+    limit, or any other failed task, breaks its lane and the chord callback
+    never runs. This task checks the run every ``pipeline_stall_timeout()``
+    seconds. Once the run is finished it stops. Once no course started or
+    finished for that long, it populates the site metrics and finishes the
+    run
     '''
-    def include_course(course_overview, threshold=50):
-        '''This function let's us skip over courses with many enrollments, speeding
-        up testing. Do not use for production
-        '''
-        count = CourseEnrollment.objects.filter(course_id=course_overview.id).count()
-        return False if count > threshold else True
+    run = PipelineRun.objects.get(id=run_id)
+    if run.status == PipelineRun.FINISHED:
+        return
+    stall_timeout = pipeline_stall_timeout()
+    if (now() - last_activity(run)).total_seconds() < stall_timeout:
+        raise self.retry(countdown=stall_timeout, max_retries=None)
+    logger.warning('Pipeline run {} for site_id={} stalled, populating site metrics'.format(
+        run_id, site_id))
+    complete_site_daily_metrics(site_id=site_id, run_id=run_id, **kwargs)
+
+
+def course_task_lanes(course_ids, max_lanes):
+    '''Distributes course ids round robin into at most ``max_lanes`` lists
+    '''
+    lanes = [[] for i in range(max(max_lanes, 1))]
+    for i, course_id in enumerate(course_ids):
+        lanes[i % len(lanes)].append(course_id)
+    return [lane for lane in lanes if lane]
+
+
+def site_daily_metrics_workflow(site, run, date_for, force_update=False, resume=False):
+    '''Builds the Celery workflow to populate daily metrics for a site
+
+    Each course gets its own task, so it gets its own retries and time limit.
+    The course tasks are split into at most ``pipeline_max_parallel_tasks()``
+    lanes. Tasks in a lane run one after the other, lanes run in parallel.
+    When all the lanes are done, the chord callback populates the site metrics
+
+    Course tasks only raise if they hit the hard time limit, which is set a
+    minute past the soft limit. That stops the rest of the lane and the
+    callback, so ``finalize_site_daily_metrics`` is launched next to the
+    workflow to populate the site metrics of stalled runs
 
+    The courses completed in ``run``, the site's ``PipelineRun``, are left
+    out. If ``resume`` is true, the site metrics are populated again, as the
+    retried courses change them. Active learner counts for all the courses are
+    read here in one query and passed to the course tasks
+    '''
+    skip_course_ids = completed_course_ids(run)
+    time_limit = pipeline_course_time_limit()
+    options = dict(soft_time_limit=time_limit, time_limit=time_limit + 60)
+    site_kwargs = dict(date_for=date_for, force_update=force_update or resume)
+    course_ids = [str(course.id) for course in figures.sites.get_courses_for_site(site)
+                  if str(course.id) not in skip_course_ids]
+    if not course_ids:
+        return populate_site_daily_metrics_callback.si(
+            [], site_id=site.id, run_id=run.id, **site_kwargs)
+    active_learner_counts = get_active_learner_counts(course_ids, date_for)
+    lanes = []
+    for lane in course_task_lanes(course_ids, pipeline_max_parallel_tasks()):
+        lanes.append(chain(*[
+            populate_course_daily_metrics.si(
+                course_id=course_id,
+                run_id=run.id,
+                date_for=date_for,
+                force_update=force_update,
+                active_learners_today=active_learner_counts.get(course_id, 0),
+                ).set(**options)
+            for course_id in lane]))
+    return chord(lanes, populate_site_daily_metrics_callback.s(
+        site_id=site.id, run_id=run.id, **site_kwargs))
+
+
+@shared_task
+def parallel_populate_daily_metrics(date_for=None, force_update=False, resume=False):
+    '''Populates the daily metrics models in parallel
+
+    Launches a workflow per site, see ``site_daily_metrics_workflow``. The
+    nightly run then takes about as long as the slowest lane instead of the
+    sum of all courses
+
+    Requires a Celery result backend, as chords need one
+    '''
     if date_for:
         date_for = as_date(date_for)
     else:
         date_for = datetime.datetime.utcnow().replace(tzinfo=utc).date()
     date_for = date_for.strftime("%Y-%m-%d")
     logger.info(
-        'Starting task "figures.experimental_populate_daily_metrics" for date "{}"'.format(
+        'Starting task "figures.parallel_populate_daily_metrics" for date "{}"'.format(
             date_for))
 
-    courses = CourseOverview.objects.all()
-    cdm_tasks = [
-        populate_single_cdm.s(
-            course_id=unicode(course.id),
+    update_org_user_memberships()
+    for site in Site.objects.all():
+        run = start_pipeline_run(site=site, date_for=date_for, resume=resume)
+        if run.status == PipelineRun.FINISHED:
+            logger.info('Skipping site "{}", finished for date "{}"'.format(
+                site.domain, date_for))
+            continue
+        site_daily_metrics_workflow(
+            site=site,
+            run=run,
             date_for=date_for,
-            force_update=force_update) for course in courses if include_course(course)
-    ]
-    results = chord(cdm_tasks)(populate_site_daily_metrics.s(
-        date_for=date_for, force_update=force_update))
-
-    # TODO: Are we going to update the SDM for the day if
-    # * course records were created, meaning there are data not added to the SDM
-    # * the SDM record already exists
-    # * force_update is not true
+            force_update=force_update,
+            resume=resume).apply_async()
+        finalize_site_daily_metrics.apply_async(
+            kwargs=dict(site_id=site.id, run_id=run.id, date_for=date_for,
+                        force_update=force_update or resume),
+            countdown=pipeline_stall_timeout())
 
     logger.info(
-        'Finished task "figures.experimental_populate_daily_metrics" for date "{}"'.format(
+        'Finished launching "figures.parallel_populate_daily_metrics" for date "{}"'.format(
             date_for))
 
-    return results
+
+@shared_task
+def backfill_daily_metrics(start_date, end_date, site_id=None, force_update=False):
+    '''Backfills the daily metrics models for a date range
+
+    Backfills all sites unless ``site_id`` is given. See
+    ``figures.pipeline.backfill`` for how the backfill differs from running
+    ``populate_daily_metrics`` for each date
+    '''
+    logger.info(
+        'Starting task "figures.backfill_daily_metrics" for dates "{}" to "{}"'.format(
+            start_date, end_date))
+    update_org_user_memberships()
+    sites = Site.objects.filter(id=site_id) if site_id else Site.objects.all()
+    for site in sites:
+        counts = backfill_site_metrics(
+            site=site,
+            start_date=start_date,
+            end_date=end_date,
+            force_update=force_update)
+        logger.info('Backfilled site "{}": {}'.format(site.domain, counts))
+
+    logger.info(
+        'Finished task "figures.backfill_daily_metrics" for dates "{}" to "{}"'.format(
+            start_date, end_date))
+
+
+@shared_task
+def compact_learner_course_grades(date_for=None, retention_days=None, sampling=None):
+    '''Compacts the learner grade metrics history older than the retention window
+
+    See ``figures.pipeline.grade_metrics_compaction``
+    '''
+    logger.info('Starting task "figures.compact_learner_course_grades"')
+    deleted_count = compact_grade_metrics(
+        date_for=date_for, retention_days=retention_days, sampling=sampling)
+    logger.info(
+        'Finished task "figures.compact_learner_course_grades". Deleted {} records'.format(
+            deleted_count))
+
+
+@shared_task
+def run_report_job(job_id):
+    '''Builds the report file of a report job
+
+    See ``figures.reports``
+    '''
+    logger.info('Starting task "figures.run_report_job" for job {}'.format(job_id))
+    job = build_report_job(job_id)
+    logger.info('Finished task "figures.run_report_job" for job {}. Status {}'.format(
+        job_id, job.status))
@@ -61,6 +61,11 @@ router.register(
     views.LearnerDetailsViewSet,
     base_name='users-detail')
 
+router.register(
+    r'reports',
+    views.ReportJobViewSet,
+    base_name='report-jobs')
+
 router.register(
     r'program-name',
     views.ProgramNameViewSet,
@@ -82,6 +87,9 @@ urlpatterns = [
     url(r'^$', views.figures_home, name='figures-home'),
 
     # REST API
+    url(r'^api/users/progress-export\.(?P<export_format>csv|ndjson)$',
+        views.LearnerProgressExportView.as_view(),
+        name='learner-progress-export'),
     url(r'^api/', include(router.urls, namespace='api')),
     url(r'^api/general-site-metrics', views.GeneralSiteMetricsView.as_view(),
         name='general-site-metrics'),
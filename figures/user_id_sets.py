@@ -0,0 +1,37 @@
+'''Compact sets of user ids
+
+A set of user ids is stored as its sorted ids, each encoded as the difference
+from the previous id in a 4 byte little-endian unsigned integer, then zlib
+compressed. The differences are small for the active users of a day, so the
+bytes compress well. Reading a set costs time in the number of its users, not
+in the largest user id of the site
+
+The union of sets is done with Python sets, the size of a stored set is kept
+in its record's count field
+'''
+
+import struct
+import zlib
+
+
+def pack_user_ids(user_ids):
+    '''Serializes the distinct user ids to bytes
+    '''
+    deltas = []
+    prev_id = 0
+    for user_id in sorted(set(user_ids)):
+        deltas.append(user_id - prev_id)
+        prev_id = user_id
+    return zlib.compress(struct.pack('<{}I'.format(len(deltas)), *deltas))
+
+
+def unpack_user_ids(data):
+    '''Deserializes the list of sorted user ids serialized by ``pack_user_ids``
+    '''
+    raw = zlib.decompress(bytes(data)) if data else b''
+    user_ids = []
+    user_id = 0
+    for delta in struct.unpack('<{}I'.format(len(raw) // 4), raw):
+        user_id += delta
+        user_ids.append(user_id)
+    return user_ids
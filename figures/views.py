@@ -1,21 +1,34 @@
 '''
 
 '''
+import calendar
+import os
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required, user_passes_test
 import django.contrib.sites.shortcuts
 from django.contrib.sites.models import Site
-from django.http import HttpResponseRedirect, HttpResponse
+from django.db import transaction
+from django.http import (
+    FileResponse,
+    HttpResponseRedirect,
+    HttpResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, render
+from django.utils.cache import get_conditional_response
+from django.utils.functional import cached_property
+from django.utils.http import http_date
 from django.views.decorators.csrf import ensure_csrf_cookie
 
-from rest_framework import viewsets
+from rest_framework import mixins, status, viewsets
 from rest_framework.authentication import (
     BasicAuthentication,
     SessionAuthentication,
     TokenAuthentication,
 )
-from rest_framework.exceptions import NotFound
+from rest_framework.decorators import detail_route
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.filters import DjangoFilterBackend
 from rest_framework.response import Response
@@ -39,22 +52,28 @@ from .filters import (
     UserFilterSet,
     ProgramNameFilter,
 )
-from .models import CourseDailyMetrics, SiteDailyMetrics
+from .models import CourseDailyMetrics, ReportJob, SiteDailyMetrics
 from .serializers import (
     CourseDailyMetricsSerializer,
     CourseDetailsSerializer,
     CourseEnrollmentSerializer,
     CourseIndexSerializer,
     GeneralCourseDataSerializer,
+    LearnerCourseData,
     LearnerDetailsSerializer,
     SiteDailyMetricsSerializer,
     SiteSerializer,
     UserIndexSerializer,
     GeneralUserDataSerializer,
-    ProgramNameSerializer
+    ProgramNameSerializer,
+    ReportJobSerializer,
 )
 from figures import metrics
-from figures.pagination import FiguresLimitOffsetPagination
+from figures.pagination import FiguresKeysetPagination, FiguresLimitOffsetPagination
+from figures.pipeline.course_details import get_course_details_data
+from figures.reports import EXPORT_FORMATS, get_or_create_report_job, learner_progress_rows
+from figures.tasks import run_report_job
+from figures.site_metrics_cache import get_site_metrics
 import figures.permissions
 import figures.helpers
 import figures.sites
@@ -135,13 +154,46 @@ class StaffUserOnDefaultSiteAuthMixin(object):
         figures.permissions.IsStaffUserOnDefaultSite,
     )
 
+
+def get_current_org(default_org='phileas'):
+    '''Returns the TMA org of the current microsite
+
+    The org is the first org whitelisted for the site, else ``default_org``.
+    Returns an empty string when ``FIGURES_HAS_MICROSITES`` is false
+    '''
+    if not bool(settings.FEATURES.get('FIGURES_HAS_MICROSITES', False)):
+        return ''
+    org_whitelist, _ = get_org_black_and_whitelist_for_site()
+    return org_whitelist[0] if org_whitelist else default_org
+
+
+class SiteContextMixin(object):
+    '''Provides the ``figures.sites.SiteContext`` of the request
+
+    A view instance serves a single request, so the site membership data
+    are computed once per request. The context is also passed to the
+    serializers as ``site_context``
+    '''
+    default_org = 'phileas'
+
+    @cached_property
+    def site_context(self):
+        return figures.sites.SiteContext(
+            site=django.contrib.sites.shortcuts.get_current_site(self.request),
+            org=get_current_org(self.default_org))
+
+    def get_serializer_context(self):
+        context = super(SiteContextMixin, self).get_serializer_context()
+        context['site_context'] = self.site_context
+        return context
+
 #
 # Views for data in edX platform
 #
 
 
 # @view_auth_classes(is_authenticated=True)
-class CoursesIndexViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class CoursesIndexViewSet(CommonAuthMixin, SiteContextMixin, viewsets.ReadOnlyModelViewSet):
     '''Provides a list of courses with abbreviated details
 
     Uses figures.filters.CourseOverviewFilter to select subsets of
@@ -165,20 +217,10 @@ class CoursesIndexViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
     filter_class = CourseOverviewFilter
 
     def get_queryset(self):
-        if bool(settings.FEATURES.get('FIGURES_HAS_MICROSITES', False)):
-            # Get current org
-            org_whitelist,org_blacklist = get_org_black_and_whitelist_for_site()
-            org = "phileas"
-            if org_whitelist:
-                org = org_whitelist[0]
-        else:
-            org = ""
-
-        queryset = figures.sites.get_courses_for_org(org)
-        return queryset
+        return self.site_context.org_courses
 
 
-class UserIndexViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class UserIndexViewSet(CommonAuthMixin, SiteContextMixin, viewsets.ReadOnlyModelViewSet):
     '''Provides a list of users with abbreviated details
 
     Uses figures.filters.UserFilter to select subsets of User objects
@@ -190,22 +232,18 @@ class UserIndexViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
     filter_class = UserFilterSet
 
     def get_queryset(self):
-        site = django.contrib.sites.shortcuts.get_current_site(self.request)
-        queryset = figures.sites.get_users_for_site(site)
-        return queryset
+        return self.site_context.users
 
 
-class CourseEnrollmentViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class CourseEnrollmentViewSet(CommonAuthMixin, SiteContextMixin, viewsets.ReadOnlyModelViewSet):
     model = CourseEnrollment
-    pagination_class = FiguresLimitOffsetPagination
+    pagination_class = FiguresKeysetPagination
     serializer_class = CourseEnrollmentSerializer
     filter_backends = (DjangoFilterBackend, )
     filter_class = CourseEnrollmentFilter
 
     def get_queryset(self):
-        site = django.contrib.sites.shortcuts.get_current_site(self.request)
-        queryset = figures.sites.get_course_enrollments_for_site(site)
-        return queryset
+        return self.site_context.course_enrollments
 
 #
 # Views for Figures models
@@ -254,6 +292,8 @@ class GeneralSiteMetricsView(CommonAuthMixin, APIView):
     '''
 
     pagination_class = FiguresLimitOffsetPagination
+    default_months_back = 6
+    max_months_back = 24
 
     @property
     def metrics_method(self):
@@ -264,22 +304,52 @@ class GeneralSiteMetricsView(CommonAuthMixin, APIView):
         '''
         return metrics.get_monthly_site_metrics
 
+    def get_months_back(self, request):
+        '''Returns the ``months_back`` query parameter clamped to
+        1..``max_months_back``
+
+        Raises ``ValidationError`` (400) if it is not an integer
+        '''
+        months_back = request.query_params.get('months_back', self.default_months_back)
+        try:
+            months_back = int(months_back)
+        except (TypeError, ValueError):
+            raise ValidationError({'months_back': 'A valid integer is required.'})
+        return max(1, min(months_back, self.max_months_back))
+
     def get(self, request, format=None):
         '''
         Does not yet support multi-tenancy
+
+        The metrics are cached until the pipeline writes new site daily
+        metrics, see ``figures.site_metrics_cache``. The ETag and Last-Modified
+        headers let clients revalidate with a conditional request
         '''
         site = django.contrib.sites.shortcuts.get_current_site(request)
         date_for = request.query_params.get('date_for')
-        data = self.metrics_method(site=site, date_for=date_for)
-        log.info(data)
+        months_back = self.get_months_back(request)
+        data, version, etag = get_site_metrics(
+            site=site,
+            date_for=date_for,
+            months_back=months_back,
+            metrics_method=self.metrics_method)
+        last_modified = calendar.timegm(version.utctimetuple()) if version else None
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
         if not data:
             data = {
                 'error': 'no metrics data available',
             }
-        return Response(data)
+        response = Response(data)
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
 
 
-class GeneralCourseDataViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class GeneralCourseDataViewSet(CommonAuthMixin, SiteContextMixin, viewsets.ReadOnlyModelViewSet):
     '''
 
     '''
@@ -288,16 +358,7 @@ class GeneralCourseDataViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = GeneralCourseDataSerializer
 
     def get_queryset(self):
-        if bool(settings.FEATURES.get('FIGURES_HAS_MICROSITES', False)):
-            # Get current org
-            org_whitelist,org_blacklist = get_org_black_and_whitelist_for_site()
-            org = "phileas"
-            if org_whitelist:
-                org = org_whitelist[0]
-        else:
-            org = ""
-
-        queryset = figures.sites.get_courses_for_org(org)
+        queryset = self.site_context.org_courses
 
         ### TMA ###
         # If user is_staff or _is_superuser : access to all courses
@@ -323,7 +384,7 @@ class GeneralCourseDataViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
         return Response(GeneralCourseDataSerializer(course_overview).data)
 
 
-class CourseDetailsViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class CourseDetailsViewSet(CommonAuthMixin, SiteContextMixin, viewsets.ReadOnlyModelViewSet):
     '''
 
     '''
@@ -334,16 +395,7 @@ class CourseDetailsViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
     filter_class = CourseOverviewFilter
 
     def get_queryset(self):
-        if bool(settings.FEATURES.get('FIGURES_HAS_MICROSITES', False)):
-            # Get current org
-            org_whitelist,org_blacklist = get_org_black_and_whitelist_for_site()
-            org = "phileas"
-            if org_whitelist:
-                org = org_whitelist[0]
-        else:
-            org = ""
-
-        queryset = figures.sites.get_courses_for_org(org)
+        queryset = self.site_context.org_courses
 
         ### TMA ###
         # If user is_staff or _is_superuser : access to all courses
@@ -356,6 +408,17 @@ class CourseDetailsViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
             courseids_with_access = CourseAccessRole.objects.filter(user_id=self.request.user.id).values_list('course_id', flat=True)
             return queryset.filter(id__in=courseids_with_access)
 
+    def list(self, request, *args, **kwargs):
+        """Serves the course details from the pipeline snapshots
+
+        See ``figures.pipeline.course_details``
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(get_course_details_data(page))
+        return Response(get_course_details_data(list(queryset)))
+
     def retrieve(self, request, *args, **kwargs):
         # NOTE: Duplicating code in GeneralCourseDataViewSet. Candidate to dry up
         # Make it a decorator
@@ -368,10 +431,10 @@ class CourseDetailsViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
                 raise NotFound()
         course_overview = get_object_or_404(CourseOverview, pk=course_key)
 	
-        return Response(CourseDetailsSerializer(course_overview).data)
+        return Response(get_course_details_data([course_overview])[0])
 
 
-class GeneralUserDataViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class GeneralUserDataViewSet(CommonAuthMixin, SiteContextMixin, viewsets.ReadOnlyModelViewSet):
     '''View class to serve general user data to the Figures UI
 
     See the serializer class, GeneralUserDataSerializer for the specific fields
@@ -384,43 +447,144 @@ class GeneralUserDataViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
     base. The only difference between them is the serializer
     '''
     model = get_user_model()
-    pagination_class = FiguresLimitOffsetPagination
+    pagination_class = FiguresKeysetPagination
     serializer_class = GeneralUserDataSerializer
     filter_backends = (DjangoFilterBackend, )
     filter_class = UserFilterSet
 
     def get_queryset(self):
-        site = django.contrib.sites.shortcuts.get_current_site(self.request)
-        queryset = figures.sites.get_users_for_site(site)
-        return queryset
+        return self.site_context.users
 
 
-class LearnerDetailsViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class LearnerDetailsViewSet(CommonAuthMixin, SiteContextMixin, viewsets.ReadOnlyModelViewSet):
     model = get_user_model()
-    pagination_class = FiguresLimitOffsetPagination
+    pagination_class = FiguresKeysetPagination
     serializer_class = LearnerDetailsSerializer
     filter_backends = (DjangoFilterBackend, )
     filter_class = UserFilterSet
+    default_org = ''
 
     def get_queryset(self):
-        org = ""
-        if bool(settings.FEATURES.get('FIGURES_HAS_MICROSITES', False)):
-            # Get current org
-            org_whitelist,org_blacklist = get_org_black_and_whitelist_for_site()
-            org = "phileas"
-            if org_whitelist:
-                org = org_whitelist[0]
-            else:
-                org = ""
-
-        queryset = figures.sites.get_users_for_org(org)
-        return queryset
+        return self.site_context.org_users.select_related('profile')
+
+    def list(self, request, *args, **kwargs):
+        """Serializes the page of learners from data loaded for the whole page
+
+        See ``figures.serializers.LearnerCourseData``
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        users = list(queryset) if page is None else page
+        serializer = LearnerDetailsSerializer(
+            users,
+            many=True,
+            context=dict(
+                site=self.site_context.site,
+                site_context=self.site_context,
+                learner_course_data=LearnerCourseData.for_users(users, self.site_context)))
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
     def retrieve(self, request, pk, *args, **kwargs):
-        site = django.contrib.sites.shortcuts.get_current_site(request)
         user = get_object_or_404(self.get_queryset(), pk=pk)
         return Response(LearnerDetailsSerializer(
-            instance=user, context=dict(site=site)).data)
+            instance=user,
+            context=dict(site=self.site_context.site, site_context=self.site_context)).data)
+
+
+class LearnerProgressExportView(CommonAuthMixin, SiteContextMixin, APIView):
+    """Streams the learner progress report of the site as CSV or NDJSON
+
+    The report has a row per course enrollment of the learners listed by
+    ``LearnerDetailsViewSet``, filtered with the same query parameters. The
+    rows are written as the learners are read, see ``figures.reports``
+    """
+    default_org = ''
+
+    def get(self, request, export_format='csv', *args, **kwargs):
+        users = UserFilterSet(request.GET, queryset=self.site_context.org_users).qs
+        lines, content_type = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            lines(learner_progress_rows(users, self.site_context)),
+            content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+            'learner-progress-{}-{}.{}'.format(
+                self.site_context.site.domain,
+                datetime.date.today().strftime('%Y-%m-%d'),
+                export_format))
+        return response
+
+
+class ReportJobViewSet(CommonAuthMixin, SiteContextMixin, mixins.CreateModelMixin,
+                       mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                       viewsets.GenericViewSet):
+    """Builds the learner progress and course details reports in the background
+
+    POST enqueues a job with the ``report_type`` and the ``filters`` of the
+    report's list endpoint. Reports are built from the current data, so an
+    optional ``date_for`` other than today is rejected. A job already
+    requested for the site, org, report type, filters and day is returned
+    instead, with its file if built. Jobs lost while pending, or started
+    without heartbeats, are queued again once the request's transaction
+    commits. GET polls the job status and ``download`` serves the gzip
+    CSV file. See ``figures.reports``
+
+    Users without staff access get reports restricted to them, as the course
+    details endpoint restricts them to the courses they have a role in
+    """
+    model = ReportJob
+    pagination_class = FiguresLimitOffsetPagination
+    serializer_class = ReportJobSerializer
+
+    # The report types use the default org of their list endpoint
+    default_orgs = {
+        ReportJob.LEARNER_PROGRESS: LearnerDetailsViewSet.default_org,
+        ReportJob.COURSE_DETAILS: CourseDetailsViewSet.default_org,
+    }
+
+    @cached_property
+    def restricted_to(self):
+        if figures.permissions.is_active_staff_or_superuser(self.request):
+            return None
+        return self.request.user
+
+    def get_queryset(self):
+        queryset = ReportJob.objects.filter(site=self.site_context.site)
+        if self.restricted_to:
+            queryset = queryset.filter(restricted_to=self.restricted_to)
+        return queryset
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        report_type = serializer.validated_data['report_type']
+        job, queued = get_or_create_report_job(
+            site=self.site_context.site,
+            org=get_current_org(self.default_orgs[report_type]),
+            report_type=report_type,
+            filters=serializer.validated_data.get('filters', {}),
+            date_for=serializer.validated_data.get('date_for') or datetime.date.today(),
+            restricted_to=self.restricted_to)
+        if queued:
+            # The task must not read the job before its row is committed
+            transaction.on_commit(lambda: run_report_job.delay(job.id))
+        return Response(
+            self.get_serializer(job).data,
+            status=status.HTTP_200_OK if job.status == ReportJob.SUCCEEDED
+            else status.HTTP_202_ACCEPTED)
+
+    @detail_route(methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != ReportJob.SUCCEEDED or not job.result_file:
+            raise NotFound('The report is not built')
+        response = FileResponse(
+            job.result_file.storage.open(job.result_file.name, 'rb'),
+            content_type='application/gzip')
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+            os.path.basename(job.result_file.name))
+        return response
 
 
 class SiteViewSet(StaffUserOnDefaultSiteAuthMixin, viewsets.ReadOnlyModelViewSet):
@@ -435,7 +599,7 @@ class SiteViewSet(StaffUserOnDefaultSiteAuthMixin, viewsets.ReadOnlyModelViewSet
     filter_backends = (DjangoFilterBackend, )
     filter_class = SiteFilterSet
 
-class ProgramNameViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
+class ProgramNameViewSet(CommonAuthMixin, SiteContextMixin, viewsets.ReadOnlyModelViewSet):
     '''
 
     '''
@@ -446,16 +610,7 @@ class ProgramNameViewSet(CommonAuthMixin, viewsets.ReadOnlyModelViewSet):
     filter_class = ProgramNameFilter
 
     def get_queryset(self):
-        if bool(settings.FEATURES.get('FIGURES_HAS_MICROSITES', False)):
-            # Get current org
-            org_whitelist,org_blacklist = get_org_black_and_whitelist_for_site()
-            org = "phileas"
-            if org_whitelist:
-                org = org_whitelist[0]
-        else:
-            org = ""
-
-        queryset = figures.sites.get_courses_for_org(org)
+        queryset = self.site_context.org_courses
 
         ### TMA ###
         # If user is_staff or _is_superuser : access to all courses
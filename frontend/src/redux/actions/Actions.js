@@ -39,12 +39,20 @@ export const loadUserIndex = ( coursesData ) => ({
   receivedAt: Date.now()
 })
 
+// The learners endpoint is paginated, follow the next links to load all pages
+const fetchAllPages = (url, results = []) =>
+  fetch(url, { credentials: "same-origin" })
+    .then(response => response.json())
+    .then(json => {
+      const allResults = results.concat(json['results']);
+      return json['next'] ? fetchAllPages(json['next'], allResults) : allResults;
+    });
+
 export function fetchUserIndex () {
   return dispatch => {
     dispatch(addActiveApiFetch())
-    return fetch(apiConfig.learnersGeneral, { credentials: "same-origin" })
-      .then(response => response.json())
-      .then(json => dispatch(loadUserIndex(json)))
+    return fetchAllPages(apiConfig.learnersGeneral)
+      .then(users => dispatch(loadUserIndex(users)))
       .then(dispatch(removeActiveApiFetch()));
   }
 }
@@ -33,6 +33,7 @@ from figures.helpers import as_course_key
 from figures.models import (
     CourseDailyMetrics,
     LearnerCourseGradeMetrics,
+    LearnerCourseGradeSnapshot,
     SiteDailyMetrics,
 )
 
@@ -276,6 +277,21 @@ class LearnerCourseGradeMetricsFactory(DjangoModelFactory):
     sections_possible = 10
 
 
+class LearnerCourseGradeSnapshotFactory(DjangoModelFactory):
+    class Meta:
+        model = LearnerCourseGradeSnapshot
+    site = factory.SubFactory(SiteFactory)
+    date_for = factory.Sequence(lambda n:
+        (datetime.datetime(2018, 1, 1) + datetime.timedelta(days=n)).replace(tzinfo=utc).date())
+    user = factory.SubFactory(UserFactory)
+    course_id = factory.Sequence(lambda n:
+        'course-v1:StarFleetAcademy+SFA{}+2161'.format(n))
+    points_possible = 30.0
+    points_earned = 15.0
+    sections_worked = 5
+    sections_possible = 10
+
+
 class SiteDailyMetricsFactory(DjangoModelFactory):
     class Meta:
         model = SiteDailyMetrics
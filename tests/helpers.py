@@ -1,7 +1,11 @@
 '''Helper methods for Figures testing
 '''
 
+from contextlib import contextmanager
+
 from dateutil.rrule import rrule, DAILY
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from packaging import version
 
 import organizations
@@ -35,3 +39,16 @@ def django_filters_pre_v1():
     """
     import django_filters
     return version.parse(django_filters.__version__) < version.parse('1.0.0')
+
+
+@contextmanager
+def assert_num_queries(num):
+    """Asserts the block runs ``num`` database queries
+
+    Used instead of the ``django_assert_num_queries`` fixture, which the
+    pinned pytest-django does not provide
+    """
+    with CaptureQueriesContext(connection) as context:
+        yield context
+    assert len(context) == num, '{} queries run, {} expected:\n{}'.format(
+        len(context), num, '\n'.join(query['sql'] for query in context.captured_queries))
@@ -49,6 +49,8 @@ from django.utils.timezone import utc
 import organizations
 
 from figures import metrics
+from figures.pipeline.backfill import backfill_site_daily_active_users, date_range
+from figures.pipeline.monthly_metrics import update_monthly_metrics
 import figures.helpers
 import figures.sites
 
@@ -62,7 +64,7 @@ from tests.factories import (
     StudentModuleFactory,
     UserFactory,
     )
-from tests.helpers import organizations_support_sites
+from tests.helpers import assert_num_queries, organizations_support_sites
 
 # TODO:
 
@@ -290,6 +292,9 @@ class TestSiteMetricsGettersStandalone(object):
                     start_date=self.data_start_date,
                     end_date=self.data_end_date)
             student_module_sets.append(data)
+        backfill_site_daily_active_users(
+            site=self.site,
+            days=date_range(self.data_start_date, self.data_end_date))
 
         count = metrics.get_active_users_for_time_period(
             site=self.site,
@@ -297,6 +302,20 @@ class TestSiteMetricsGettersStandalone(object):
             end_date=self.data_end_date)
         assert count == len(student_module_sets)
 
+    def test_get_active_users_without_daily_records(self):
+        """Days without SiteDailyActiveUsers records are not read from
+        StudentModule, they count no users until they are backfilled
+        """
+        for i in range(0, 3):
+            create_student_module_test_data(
+                start_date=self.data_start_date,
+                end_date=self.data_end_date)
+        count = metrics.get_active_users_for_time_period(
+            site=self.site,
+            start_date=self.data_start_date,
+            end_date=self.data_end_date)
+        assert count == 0
+
     def test_get_total_site_users_for_time_period(self):
         '''
         TODO: add users who joined before and after the time period, and
@@ -444,6 +463,9 @@ class TestSiteMetricsGettersMultisite(object):
             org_course, created = add_course_to_site(
                 data['course_overview'].id,
                 site=self.alpha_site)
+        backfill_site_daily_active_users(
+            site=self.alpha_site,
+            days=date_range(self.data_start_date, self.data_end_date))
         count = metrics.get_active_users_for_time_period(
             site=self.alpha_site,
             start_date=self.data_start_date,
@@ -632,6 +654,38 @@ class TestCourseMetricsGettersStandalone(object):
         assert actual == expected
 
 
+    @pytest.mark.parametrize('func', [
+        metrics.get_course_enrolled_users_for_time_period,
+        metrics.get_course_average_progress_for_time_period,
+        metrics.get_course_average_days_to_complete_for_time_period,
+        metrics.get_course_num_learners_completed_for_time_period,
+    ])
+    def test_get_monthly_history_metric(self, func):
+        """The series read from the rollups matches the daily records
+        """
+        date_for = datetime.date(2018, 4, 15)
+        update_monthly_metrics(self.site, self.data_start_date, date_for)
+        with assert_num_queries(1):
+            actual = metrics.get_monthly_history_metric(
+                func=func,
+                site=self.site,
+                date_for=date_for,
+                months_back=4,
+                course_id=self.course_overview.id)
+        aggregate = func.monthly_history_series
+        expected = []
+        for month in figures.helpers.previous_months_iterator(date_for, 4):
+            expected.append(dict(
+                period=metrics.period_str(month),
+                value=aggregate.as_value(aggregate.get_raw_value(
+                    site=self.site,
+                    start_date=datetime.date(month[0], month[1], 1),
+                    end_date=datetime.date(month[0], month[1], month[2]),
+                    course_id=self.course_overview.id))))
+        assert actual['history'] == expected
+        assert actual['current_month'] == expected[-1]['value']
+
+
 @pytest.mark.skipif(not organizations_support_sites(),
                     reason='Organizations support sites')
 @pytest.mark.django_db
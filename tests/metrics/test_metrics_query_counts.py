@@ -0,0 +1,101 @@
+"""Pins the number of queries the figures.metrics functions issue
+
+A change to these counts means a metric started loading querysets or querying
+per record or per month. Update the expected counts only on purpose
+"""
+
+import datetime
+
+import pytest
+
+from django.contrib.sites.models import Site
+
+from figures import metrics
+from figures.models import SiteDailyActiveUsers
+from figures.pipeline.backfill import date_range
+from figures.user_id_sets import pack_user_ids
+
+from tests.factories import (
+    CourseDailyMetricsFactory,
+    CourseOverviewFactory,
+    SiteDailyMetricsFactory,
+)
+from tests.helpers import assert_num_queries
+
+
+START_DATE = datetime.date(2018, 1, 1)
+END_DATE = datetime.date(2018, 1, 31)
+
+
+@pytest.mark.django_db
+class TestMetricsQueryCounts(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db, settings):
+        settings.FEATURES['FIGURES_IS_MULTISITE'] = False
+        self.site = Site.objects.first()
+        self.course_overview = CourseOverviewFactory()
+        for day in range(1, 4):
+            date_for = datetime.date(2018, 1, day)
+            SiteDailyMetricsFactory(site=self.site, date_for=date_for)
+            CourseDailyMetricsFactory(
+                site=self.site,
+                date_for=date_for,
+                course_id=str(self.course_overview.id))
+
+    @pytest.mark.parametrize('func, num_queries', [
+        (metrics.get_active_users_for_time_period, 1),
+        (metrics.get_total_site_users_for_time_period, 1),
+        (metrics.get_total_site_users_joined_for_time_period, 1),
+        (metrics.get_total_enrollments_for_time_period, 1),
+        (metrics.get_total_site_courses_for_time_period, 1),
+        (metrics.get_total_course_completions_for_time_period, 1),
+    ])
+    def test_site_metrics(self, func, num_queries):
+        with assert_num_queries(num_queries):
+            func(site=self.site, start_date=START_DATE, end_date=END_DATE)
+
+    @pytest.mark.parametrize('func', [
+        metrics.get_course_enrolled_users_for_time_period,
+        metrics.get_course_average_progress_for_time_period,
+        metrics.get_course_average_days_to_complete_for_time_period,
+        metrics.get_course_num_learners_completed_for_time_period,
+    ])
+    def test_course_metrics(self, func):
+        with assert_num_queries(1):
+            func(site=self.site, start_date=START_DATE, end_date=END_DATE,
+                 course_id=self.course_overview.id)
+
+    @pytest.mark.parametrize('func', [
+        metrics.get_course_enrolled_users_for_time_period,
+        metrics.get_course_average_progress_for_time_period,
+    ])
+    def test_course_metrics_without_data(self, func):
+        with assert_num_queries(1):
+            value = func(site=self.site,
+                         start_date=datetime.date(2017, 1, 1),
+                         end_date=datetime.date(2017, 1, 31),
+                         course_id=self.course_overview.id)
+        assert value == 0
+
+    def test_get_monthly_history_metric(self):
+        with assert_num_queries(1):
+            metrics.get_monthly_history_metric(
+                func=metrics.get_course_average_progress_for_time_period,
+                site=self.site,
+                date_for=END_DATE,
+                months_back=6,
+                course_id=self.course_overview.id)
+
+    def test_active_users_from_daily_records(self):
+        for day in date_range(START_DATE, END_DATE):
+            SiteDailyActiveUsers.objects.create(
+                site=self.site, date_for=day, user_count=0, user_ids=pack_user_ids([]))
+        with assert_num_queries(1):
+            metrics.get_active_users_for_time_period(
+                site=self.site, start_date=START_DATE, end_date=END_DATE)
+
+    def test_get_monthly_site_metrics(self):
+        with assert_num_queries(5):
+            metrics.get_monthly_site_metrics(
+                site=self.site, date_for=END_DATE, months_back=6)
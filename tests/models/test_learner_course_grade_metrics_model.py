@@ -67,6 +67,19 @@ class TestLearnerCourseGradeMetrics(object):
         assert last_day
         assert obj.date_for == last_day
 
+    def test_as_of(self):
+        for day in [1, 5]:
+            rec = self.create_rec.copy()
+            rec.update(date_for=datetime.date(2018, 2, day), sections_worked=day)
+            LearnerCourseGradeMetrics.objects.create(**rec)
+
+        assert not LearnerCourseGradeMetrics.objects.as_of(datetime.date(2018, 1, 31)).exists()
+        for date_for, sections_worked in [(datetime.date(2018, 2, 3), 1),
+                                          (datetime.date(2018, 2, 9), 5)]:
+            objs = LearnerCourseGradeMetrics.objects.as_of(
+                date_for, course_id=str(self.course_enrollment.course_id))
+            assert [obj.sections_worked for obj in objs] == [sections_worked]
+
     def test_progress_percent(self):
         expected = (self.grade_data['sections_worked'] /
             self.grade_data['sections_possible'])
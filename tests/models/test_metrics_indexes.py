@@ -0,0 +1,71 @@
+"""Checks the main metrics queries use the Figures model indexes
+
+Reads the SQLite query plans, so these tests are skipped on other databases
+"""
+
+import datetime
+import pytest
+
+from django.db import connection
+
+from figures import metrics
+from figures.models import LearnerCourseGradeMetrics, LearnerCourseGradeSnapshot
+
+from tests.factories import SiteFactory
+
+
+START_DATE = datetime.date(2019, 1, 1)
+END_DATE = datetime.date(2019, 1, 31)
+COURSE_ID = 'course-v1:StarFleetAcademy+SFA01+2161'
+
+
+def query_plan(queryset):
+    '''Returns the SQLite query plan details of the queryset as one string
+    '''
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return ' '.join(str(row[-1]) for row in cursor.fetchall())
+
+
+@pytest.mark.django_db
+class TestMetricsIndexes(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        if connection.vendor != 'sqlite':
+            pytest.skip('Query plans are only checked on SQLite')
+        self.site = SiteFactory()
+
+    def assert_uses_index(self, queryset, index_name=None):
+        plan = query_plan(queryset)
+        assert 'USING INDEX' in plan or 'USING COVERING INDEX' in plan, plan
+        if index_name:
+            assert index_name in plan, plan
+
+    def test_site_daily_metrics(self):
+        self.assert_uses_index(metrics.SITE_TOTAL_USERS.get_queryset(
+            self.site, START_DATE, END_DATE))
+
+    def test_site_course_completions(self):
+        self.assert_uses_index(
+            metrics.SITE_COURSE_COMPLETIONS.get_queryset(self.site, START_DATE, END_DATE),
+            'figures_cdm_site_date')
+
+    def test_course_daily_metrics(self):
+        self.assert_uses_index(
+            metrics.COURSE_ENROLLMENTS.get_queryset(
+                self.site, START_DATE, END_DATE, course_id=COURSE_ID),
+            'figures_cdm_site_course_date')
+
+    def test_learner_course_grades(self):
+        self.assert_uses_index(
+            LearnerCourseGradeMetrics.objects.filter(
+                course_id=COURSE_ID, date_for__lte=END_DATE),
+            'figures_lcgm_course_date')
+
+    def test_learner_course_grade_snapshots(self):
+        self.assert_uses_index(
+            LearnerCourseGradeSnapshot.objects.filter(
+                course_id=COURSE_ID, date_for__lt=END_DATE),
+            'figures_lcgs_course_date')
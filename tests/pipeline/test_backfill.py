@@ -0,0 +1,180 @@
+"""Tests the date range backfill in figures.pipeline.backfill
+
+"""
+
+import datetime
+import mock
+import pytest
+
+from django.contrib.auth import get_user_model
+from django.utils.timezone import utc
+
+from courseware.models import StudentModule
+
+from figures.models import CourseDailyMetrics, SiteDailyActiveUsers, SiteDailyMetrics
+from figures.pipeline import backfill
+from figures.user_id_sets import unpack_user_ids
+
+from tests.factories import (
+    CourseAccessRoleFactory,
+    CourseDailyMetricsFactory,
+    CourseEnrollmentFactory,
+    CourseOverviewFactory,
+    GeneratedCertificateFactory,
+    LearnerCourseGradeMetricsFactory,
+    SiteFactory,
+    StudentModuleFactory,
+)
+
+
+@pytest.mark.django_db
+class TestBackfillDailyMetrics(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db, monkeypatch):
+        self.site = SiteFactory()
+        self.start_date = datetime.date(2019, 3, 1)
+        self.end_date = datetime.date(2019, 3, 3)
+        self.course = CourseOverviewFactory()
+        self.course_id = str(self.course.id)
+        # Enrolled the day before, first day and last day of the range
+        self.enrollments = [
+            CourseEnrollmentFactory(
+                course_id=self.course.id,
+                course_overview=self.course,
+                created=created)
+            for created in (
+                datetime.datetime(2019, 2, 28, 12, tzinfo=utc),
+                datetime.datetime(2019, 3, 1, 12, tzinfo=utc),
+                datetime.datetime(2019, 3, 3, 12, tzinfo=utc))]
+        for ce in self.enrollments[:2]:
+            StudentModuleFactory(
+                student=ce.user,
+                course_id=self.course.id,
+                modified=datetime.datetime(2019, 3, 2, 8, tzinfo=utc))
+        GeneratedCertificateFactory(
+            user=self.enrollments[0].user,
+            course_id=self.course.id,
+            created_date=datetime.datetime(2019, 3, 2, 0, tzinfo=utc))
+        monkeypatch.setattr(
+            'figures.sites.get_courses_for_site', lambda site: [self.course])
+        monkeypatch.setattr(
+            'figures.sites.get_courses_for_org', lambda org: type(self.course).objects.all())
+        monkeypatch.setattr(
+            'figures.sites.get_users_for_org', lambda org: get_user_model().objects.all())
+        monkeypatch.setattr(
+            'figures.sites.get_org_for_course', lambda course_id: self.site)
+
+    def test_date_range(self):
+        assert backfill.date_range(self.start_date, self.end_date) == [
+            datetime.date(2019, 3, 1),
+            datetime.date(2019, 3, 2),
+            datetime.date(2019, 3, 3)]
+        assert backfill.date_range(self.end_date, self.start_date) == []
+
+    def test_backfill(self):
+        counts = backfill.backfill_daily_metrics(
+            site=self.site, start_date=self.start_date, end_date=self.end_date)
+        assert counts == dict(course_daily_metrics=3, site_daily_metrics=3)
+
+        cdms = CourseDailyMetrics.objects.filter(
+            course_id=self.course_id).order_by('date_for')
+        assert [cdm.enrollment_count for cdm in cdms] == [2, 2, 3]
+        assert [cdm.active_learners_today for cdm in cdms] == [0, 2, 0]
+        assert [cdm.num_learners_completed for cdm in cdms] == [0, 1, 1]
+        # Certificate created at the start of 3/2, one day after enrollment
+        assert [cdm.average_days_to_complete for cdm in cdms] == [0, 1, 1]
+        assert [cdm.median_days_to_complete for cdm in cdms] == [None, 1, 1]
+        assert all(cdm.average_progress is None for cdm in cdms)
+
+        sdms = SiteDailyMetrics.objects.filter(site=self.site).order_by('date_for')
+        assert [sdm.todays_active_user_count for sdm in sdms] == [0, 2, 0]
+        assert [sdm.cumulative_active_user_count for sdm in sdms] == [0, 2, 2]
+        assert [sdm.total_enrollment_count for sdm in sdms] == [2, 2, 3]
+
+        active_users = SiteDailyActiveUsers.objects.filter(
+            site=self.site).order_by('date_for')
+        assert [rec.user_count for rec in active_users] == [0, 2, 0]
+        assert unpack_user_ids(active_users[1].user_ids) == sorted(
+            [ce.user_id for ce in self.enrollments[:2]])
+
+    def test_site_totals_from_site_courses(self, monkeypatch):
+        # The site sees a course of another site, as in TMA microsite mode
+        other_site = SiteFactory()
+        other_course = CourseOverviewFactory()
+        CourseEnrollmentFactory(
+            course_id=other_course.id,
+            course_overview=other_course,
+            created=datetime.datetime(2019, 2, 28, 12, tzinfo=utc))
+        monkeypatch.setattr(
+            'figures.sites.get_courses_for_site',
+            lambda site: [self.course, other_course])
+        monkeypatch.setattr(
+            'figures.sites.get_org_for_course',
+            lambda course_id: other_site if str(course_id) == str(
+                other_course.id) else self.site)
+        backfill.backfill_daily_metrics(
+            site=self.site, start_date=self.start_date, end_date=self.end_date)
+        assert CourseDailyMetrics.objects.filter(
+            site=other_site, course_id=str(other_course.id)).count() == 3
+        sdms = SiteDailyMetrics.objects.filter(site=self.site).order_by('date_for')
+        assert [sdm.total_enrollment_count for sdm in sdms] == [2, 2, 3]
+
+    def test_average_progress_from_grades_history(self):
+        # Grade metrics are only written on the dates grades changed. Only
+        # the most recent record before the range counts
+        for ce, date_for, sections_worked in [
+                (self.enrollments[0], datetime.date(2019, 1, 15), 3),
+                (self.enrollments[0], datetime.date(2019, 2, 27), 1),
+                (self.enrollments[1], datetime.date(2019, 3, 2), 2),
+                (self.enrollments[0], datetime.date(2019, 3, 3), 4)]:
+            LearnerCourseGradeMetricsFactory(
+                site=self.site,
+                user=ce.user,
+                course_id=self.course_id,
+                date_for=date_for,
+                sections_worked=sections_worked,
+                sections_possible=4)
+        backfill.backfill_daily_metrics(
+            site=self.site, start_date=self.start_date, end_date=self.end_date)
+        cdms = CourseDailyMetrics.objects.filter(
+            course_id=self.course_id).order_by('date_for')
+        assert [float(cdm.average_progress) for cdm in cdms] == [0.25, 0.38, 0.75]
+
+    def test_excludes_course_staff(self):
+        CourseAccessRoleFactory(
+            user=self.enrollments[2].user, course_id=self.course.id, role='staff')
+        backfill.backfill_daily_metrics(
+            site=self.site, start_date=self.start_date, end_date=self.end_date)
+        assert CourseDailyMetrics.objects.get(
+            course_id=self.course_id, date_for=self.end_date).enrollment_count == 2
+
+    def test_reads_student_modules_once_per_metric(self):
+        with mock.patch.object(
+                StudentModule.objects, 'filter',
+                wraps=StudentModule.objects.filter) as sm_filter:
+            backfill.backfill_daily_metrics(
+                site=self.site, start_date=self.start_date, end_date=self.end_date)
+        # Once for the course active learners, once for the site active users
+        assert sm_filter.call_count == 2
+
+    @pytest.mark.parametrize('force_update, expected_count', [
+        (False, 100),
+        (True, 2),
+    ])
+    def test_existing_records(self, force_update, expected_count):
+        CourseDailyMetricsFactory(
+            site=self.site,
+            course_id=self.course_id,
+            date_for=self.start_date,
+            enrollment_count=100)
+        counts = backfill.backfill_daily_metrics(
+            site=self.site,
+            start_date=self.start_date,
+            end_date=self.end_date,
+            force_update=force_update)
+        assert counts['course_daily_metrics'] == 3
+        assert CourseDailyMetrics.objects.filter(course_id=self.course_id).count() == 3
+        assert CourseDailyMetrics.objects.get(
+            course_id=self.course_id,
+            date_for=self.start_date).enrollment_count == expected_count
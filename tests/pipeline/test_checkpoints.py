@@ -0,0 +1,88 @@
+"""Tests the pipeline run checkpoints in figures.pipeline.checkpoints
+
+"""
+
+import datetime
+import pytest
+
+from figures.models import PipelineCourseRun, PipelineRun
+from figures.pipeline.checkpoints import (
+    completed_course_ids,
+    course_checkpoint,
+    finish_pipeline_run,
+    start_pipeline_run,
+)
+
+from tests.factories import (
+    LearnerCourseGradeMetricsFactory,
+    LearnerCourseGradeSnapshotFactory,
+    SiteFactory,
+)
+
+
+@pytest.mark.django_db
+class TestPipelineCheckpoints(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.site = SiteFactory()
+        self.date_for = datetime.date(2019, 1, 2)
+        self.course_id = 'course-v1:StarFleetAcademy+SFA01+2161'
+
+    def test_start_new_run(self):
+        run = start_pipeline_run(self.site, self.date_for)
+        assert run.status == PipelineRun.STARTED
+        assert start_pipeline_run(self.site, self.date_for) != run
+
+    def test_resume_unfinished_run(self):
+        run = start_pipeline_run(self.site, self.date_for)
+        assert start_pipeline_run(self.site, self.date_for, resume=True) == run
+
+    def test_resume_finished_run(self):
+        run = finish_pipeline_run(start_pipeline_run(self.site, self.date_for))
+        resumed = start_pipeline_run(self.site, self.date_for, resume=True)
+        assert resumed == run
+        assert resumed.status == PipelineRun.FINISHED
+        assert start_pipeline_run(self.site, self.date_for) != run
+
+    @pytest.mark.parametrize('status', [
+        PipelineCourseRun.FAILED, PipelineCourseRun.STARTED])
+    def test_resume_finished_run_with_incomplete_course(self, status):
+        run = start_pipeline_run(self.site, self.date_for)
+        PipelineCourseRun.objects.create(
+            run=run, course_id=self.course_id, status=status)
+        finish_pipeline_run(run)
+        resumed = start_pipeline_run(self.site, self.date_for, resume=True)
+        assert resumed == run
+        assert resumed.status == PipelineRun.STARTED
+        assert resumed.finished_at is None
+
+    def test_course_checkpoint_succeeded(self):
+        run = start_pipeline_run(self.site, self.date_for)
+        # Written before the course run, so not counted
+        LearnerCourseGradeSnapshotFactory(
+            course_id=self.course_id, date_for=self.date_for)
+        with course_checkpoint(run, self.course_id):
+            LearnerCourseGradeSnapshotFactory(
+                course_id=self.course_id, date_for=self.date_for)
+            LearnerCourseGradeMetricsFactory(
+                course_id=self.course_id, date_for=self.date_for)
+            # Moved to a later date, but this run saved the learner's grades
+            LearnerCourseGradeMetricsFactory(
+                course_id=self.course_id, date_for=self.date_for,
+                user=LearnerCourseGradeSnapshotFactory(
+                    course_id=self.course_id,
+                    date_for=self.date_for + datetime.timedelta(days=1)).user)
+        course_run = run.course_runs.get()
+        assert course_run.status == PipelineCourseRun.SUCCEEDED
+        assert course_run.learner_grades_count == 3
+        assert course_run.elapsed_seconds >= 0
+        assert completed_course_ids(run) == set([self.course_id])
+
+    def test_course_checkpoint_failed(self):
+        run = start_pipeline_run(self.site, self.date_for)
+        with pytest.raises(ValueError):
+            with course_checkpoint(run, self.course_id):
+                raise ValueError('expected failure')
+        assert run.course_runs.get().status == PipelineCourseRun.FAILED
+        assert completed_course_ids(run) == set()
@@ -7,13 +7,22 @@ import datetime
 import mock
 import pytest
 
+from celery.exceptions import SoftTimeLimitExceeded
 from django.core.exceptions import PermissionDenied, ValidationError
 
 from opaque_keys.edx.locator import CourseLocator
 from student.models import CourseEnrollment, CourseAccessRole
 
 from figures.helpers import as_datetime, next_day, prev_day, is_multisite
-from figures.models import CourseDailyMetrics, PipelineError
+from figures.models import (
+    CourseDailyMetrics,
+    LearnerCourseGradeMetrics,
+    LearnerCourseGradeSnapshot,
+    PipelineCourseRun,
+    PipelineError,
+    PipelineRun,
+)
+import figures.metrics
 from figures.pipeline import course_daily_metrics as pipeline_cdm
 import figures.sites
 
@@ -22,8 +31,12 @@ from tests.factories import (
     CourseEnrollmentFactory,
     CourseOverviewFactory,
     GeneratedCertificateFactory,
+    LearnerCourseGradeMetricsFactory,
+    LearnerCourseGradeSnapshotFactory,
+    SiteFactory,
     StudentModuleFactory,
 )
+from tests.helpers import assert_num_queries
 
 
 @pytest.mark.django_db
@@ -146,6 +159,30 @@ class TestCourseDailyMetricsPipelineFunctions(object):
                 course_id=self.course_overview.id, date_for=self.today)
             assert recs.count() == len(self.course_enrollments)
 
+    def test_get_active_learner_counts(self):
+        other_course = CourseOverviewFactory()
+        StudentModuleFactory(course_id=other_course.id, modified=as_datetime(self.today))
+        counts = pipeline_cdm.get_active_learner_counts(
+            course_ids=[self.course_overview.id, str(other_course.id)],
+            date_for=self.today)
+        assert counts == {
+            str(self.course_overview.id): len(self.course_enrollments),
+            str(other_course.id): 1,
+        }
+        assert pipeline_cdm.get_active_learner_counts(
+            course_ids=[self.course_overview.id],
+            date_for=next_day(self.today)) == {}
+
+    def test_extract_with_active_learners_today(self, monkeypatch):
+        monkeypatch.setattr(
+            pipeline_cdm, 'get_average_progress', lambda *args, **kwargs: 0.5)
+        monkeypatch.setattr(
+            pipeline_cdm, 'get_active_learner_ids_today',
+            lambda *args: pytest.fail('should use the count passed in'))
+        data = pipeline_cdm.CourseDailyMetricsExtractor().extract(
+            self.course_overview.id, date_for=self.today, active_learners_today=7)
+        assert data['active_learners_today'] == 7
+
     def test_get_average_progress(self):
         """
         [John] This test needs work. The function it is testing needs work too
@@ -169,6 +206,46 @@ class TestCourseDailyMetricsPipelineFunctions(object):
             # hardcode the expected value
             assert actual == 0.5
 
+    def test_get_average_progress_site_context(self):
+        site = SiteFactory()
+        site_context = figures.sites.SiteContext(site)
+        course_enrollments = CourseEnrollment.objects.filter(
+            course_id=self.course_overview.id)
+        with mock.patch.object(site_context, 'get_site_for_course',
+                               return_value=site) as mock_get_site:
+            with mock.patch('figures.sites.get_site_for_course',
+                            side_effect=AssertionError('should use the site context')):
+                pipeline_cdm.get_average_progress(
+                    course_id=self.course_overview.id,
+                    date_for=self.today,
+                    course_enrollments=course_enrollments,
+                    site_context=site_context)
+        mock_get_site.assert_called_once_with(self.course_overview.id)
+        assert LearnerCourseGradeMetrics.objects.filter(
+            course_id=str(self.course_overview.id)).exclude(site=site).count() == 0
+
+    def test_get_average_progress_loads_course_once(self):
+        """The course structure should be loaded once for all the learners
+        """
+        with mock.patch.dict('figures.helpers.settings.FEATURES', {
+                'FIGURES_IS_MULTISITE': False,
+                'FIGURES_PIPELINE_BATCH_SIZE': 2}):
+            course_enrollments = CourseEnrollment.objects.filter(
+                course_id=self.course_overview.id)
+            assert course_enrollments.count() > 2
+            with mock.patch(
+                    'figures.metrics.get_course_by_id',
+                    wraps=figures.metrics.get_course_by_id) as mock_get_course:
+                actual = pipeline_cdm.get_average_progress(
+                    course_id=self.course_overview.id,
+                    date_for=self.today,
+                    course_enrollments=course_enrollments
+                    )
+            assert mock_get_course.call_count == 1
+            assert actual == 0.5
+            assert LearnerCourseGradeMetrics.objects.filter(
+                course_id=str(self.course_overview.id)).count() == course_enrollments.count()
+
     @mock.patch(
         'figures.metrics.LearnerCourseGrades.course_progress',
         side_effect=PermissionDenied('mock-failure')
@@ -187,6 +264,21 @@ class TestCourseDailyMetricsPipelineFunctions(object):
             assert results == pytest.approx(0.0)
             assert PipelineError.objects.count() == course_enrollments.count()
 
+    @mock.patch(
+        'figures.metrics.LearnerCourseGrades.course_progress',
+        side_effect=SoftTimeLimitExceeded()
+    )
+    def test_get_average_progress_time_limit(self, mock_lcg):
+        # The course task time limit is not logged as a learner error
+        with mock.patch.dict('figures.helpers.settings.FEATURES', {'FIGURES_IS_MULTISITE': False}):
+            with pytest.raises(SoftTimeLimitExceeded):
+                pipeline_cdm.get_average_progress(
+                    course_id=self.course_overview.id,
+                    date_for=self.today,
+                    course_enrollments=CourseEnrollment.objects.filter(
+                        course_id=self.course_overview.id))
+            assert PipelineError.objects.count() == 0
+
     def test_get_days_to_complete(self, ):
         with mock.patch.dict('figures.helpers.settings.FEATURES', {'FIGURES_IS_MULTISITE': False}):
             expected = dict(
@@ -199,6 +291,38 @@ class TestCourseDailyMetricsPipelineFunctions(object):
 
             assert actual == expected
 
+    def test_get_days_to_complete_num_queries(self):
+        with assert_num_queries(2):
+            pipeline_cdm.get_days_to_complete(
+                course_id=self.course_overview.id,
+                date_for=self.today)
+
+    def test_get_days_to_complete_without_enrollment(self):
+        cert = GeneratedCertificateFactory(
+            course_id=self.course_overview.id,
+            created_date=as_datetime(prev_day(self.today)))
+        actual = pipeline_cdm.get_days_to_complete(
+            course_id=self.course_overview.id,
+            date_for=self.today)
+        assert actual['days'] == self.cert_days_to_complete
+        assert actual['errors'] == [dict(
+            msg='No CE record',
+            course_id=str(self.course_overview.id),
+            user_id=cert.user.id)]
+
+    @pytest.mark.parametrize('days, expected', [
+        ([], dict(days_to_complete_p25=None, median_days_to_complete=None,
+                  days_to_complete_p75=None, days_to_complete_p90=None)),
+        ([7], dict(days_to_complete_p25=7, median_days_to_complete=7,
+                   days_to_complete_p75=7, days_to_complete_p90=7)),
+        ([30, 10, 20, 40, 50], dict(days_to_complete_p25=20, median_days_to_complete=30,
+                                    days_to_complete_p75=40, days_to_complete_p90=46)),
+    ])
+    def test_calc_days_to_complete_distribution(self, days, expected):
+        actual = pipeline_cdm.calc_days_to_complete_distribution(days)
+        assert dict((key, pipeline_cdm.as_rounded_int(value))
+                    for key, value in actual.items()) == expected
+
     def test_calc_average_days_to_complete(self):
         with mock.patch.dict('figures.helpers.settings.FEATURES', {'FIGURES_IS_MULTISITE': False}):
             actual = pipeline_cdm.calc_average_days_to_complete(
@@ -221,6 +345,110 @@ class TestCourseDailyMetricsPipelineFunctions(object):
             assert actual == len(self.generated_certificates)
 
 
+@pytest.mark.django_db
+class TestIncrementalGrades(object):
+    """Tests carrying forward grade metrics for learners without activity
+    """
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.today = datetime.date(2018, 6, 1)
+        self.last_run = datetime.date(2018, 5, 30)
+        self.course_overview = CourseOverviewFactory()
+        self.course_enrollments = [CourseEnrollmentFactory(
+            course_id=self.course_overview.id) for i in range(3)]
+        self.previous_grades = [LearnerCourseGradeMetricsFactory(
+            user=ce.user,
+            course_id=str(ce.course_id),
+            date_for=self.last_run,
+            sections_worked=1,
+            sections_possible=4,
+            ) for ce in self.course_enrollments[:2]]
+        for rec in self.previous_grades:
+            LearnerCourseGradeSnapshotFactory(
+                site=rec.site,
+                user=rec.user,
+                course_id=rec.course_id,
+                date_for=rec.date_for,
+                sections_worked=rec.sections_worked,
+                sections_possible=rec.sections_possible)
+        # The first learner worked on the course since the last run
+        self.active_ce = self.course_enrollments[0]
+        StudentModuleFactory(
+            course_id=self.active_ce.course_id,
+            student=self.active_ce.user,
+            created=as_datetime(self.last_run),
+            modified=as_datetime(self.today))
+        self.add_run(self.last_run)
+
+    def add_run(self, date_for, status=PipelineCourseRun.SUCCEEDED):
+        run = PipelineRun.objects.create(
+            site=self.previous_grades[0].site,
+            date_for=date_for,
+            status=PipelineRun.FINISHED)
+        PipelineCourseRun.objects.create(
+            run=run, course_id=str(self.course_overview.id), status=status)
+
+    def get_carry_forward_grades(self, date_for):
+        return pipeline_cdm.CarryForwardGrades(
+            course_id=self.course_overview.id, date_for=date_for).for_users(
+            [ce.user.id for ce in self.course_enrollments])
+
+    def test_get_carry_forward_grades(self):
+        carry_forward = self.get_carry_forward_grades(self.today)
+        assert carry_forward.keys() == [self.course_enrollments[1].user.id]
+
+    def test_get_carry_forward_grades_no_history(self):
+        assert self.get_carry_forward_grades(self.last_run) == {}
+
+    def test_get_carry_forward_grades_failed_run(self):
+        PipelineCourseRun.objects.update(status=PipelineCourseRun.FAILED)
+        assert self.get_carry_forward_grades(self.today) == {}
+
+    def test_get_carry_forward_grades_reads_since_last_run(self):
+        # Snapshots from before the last successful run were not handled by
+        # it, so their learners are graded
+        LearnerCourseGradeSnapshot.objects.filter(
+            user=self.course_enrollments[1].user).update(
+            date_for=prev_day(self.last_run))
+        assert self.get_carry_forward_grades(self.today) == {}
+        assert pipeline_cdm.CarryForwardGrades(
+            course_id=self.course_overview.id,
+            date_for=self.today).last_modified.keys() == [self.active_ce.user.id]
+
+    def test_get_average_progress_incremental(self):
+        features = {'FIGURES_IS_MULTISITE': False, 'FIGURES_INCREMENTAL_GRADES': True}
+        with mock.patch.dict('figures.helpers.settings.FEATURES', features):
+            with mock.patch(
+                    'figures.pipeline.course_daily_metrics.iter_course_grades',
+                    wraps=pipeline_cdm.iter_course_grades) as mock_iter:
+                pipeline_cdm.get_average_progress(
+                    course_id=self.course_overview.id,
+                    date_for=self.today,
+                    course_enrollments=CourseEnrollment.objects.filter(
+                        course_id=self.course_overview.id))
+            graded_users = mock_iter.call_args[0][0]
+            assert set(user.id for user in graded_users) == set(
+                [self.course_enrollments[0].user.id, self.course_enrollments[2].user.id])
+            # Carried forward grades are unchanged, so only the snapshot moves
+            carried_user = self.course_enrollments[1].user
+            assert not LearnerCourseGradeMetrics.objects.filter(
+                user=carried_user, date_for=self.today).exists()
+            carried = LearnerCourseGradeSnapshot.objects.get(user=carried_user)
+            assert carried.date_for == self.today
+            assert carried.sections_worked == 1
+            assert carried.sections_possible == 4
+
+    def test_get_carry_forward_grades_inactive_since_snapshot(self):
+        # A learner active after their last run is carried forward once
+        # their grades are saved again
+        date_for = next_day(self.today)
+        LearnerCourseGradeSnapshot.objects.update(date_for=date_for)
+        self.add_run(date_for)
+        carry_forward = self.get_carry_forward_grades(next_day(date_for))
+        assert set(carry_forward.keys()) == set(
+            [self.active_ce.user.id, self.course_enrollments[1].user.id])
+
+
 @pytest.mark.django_db
 class TestCourseDailyMetricsExtractor(object):
     """
@@ -283,7 +511,8 @@ class TestCourseDailyMetricsLoader(object):
 
     @pytest.mark.parametrize('average_progress', [-1.0, -0.01, 1.01])
     def test_load_invalid_data(self, monkeypatch, average_progress):
-        def mock_get_average_progress(course_id, date_for, course_enrollments):
+        def mock_get_average_progress(course_id, date_for, course_enrollments,
+                                      site_context=None):
             return average_progress
         with mock.patch.dict('figures.helpers.settings.FEATURES', {'FIGURES_IS_MULTISITE': False}):
             course_id = self.course_enrollments[0].course_id
@@ -0,0 +1,64 @@
+"""Tests the course details snapshots in figures.pipeline.course_details
+
+"""
+
+import datetime
+import pytest
+
+from figures.models import CourseDetailsSnapshot
+from figures.pipeline import course_details
+
+from tests.factories import CourseOverviewFactory, SiteFactory
+from tests.helpers import assert_num_queries
+
+
+class MockCourseDetailsSerializer(object):
+    """Stands in for CourseDetailsSerializer, which needs the TMA models
+    """
+    site = None
+
+    def __init__(self, course_overview):
+        self.course_overview = course_overview
+
+    @property
+    def data(self):
+        return dict(course_id=str(self.course_overview.id), source='live')
+
+
+@pytest.mark.django_db
+class TestCourseDetailsSnapshot(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db, monkeypatch):
+        self.site = SiteFactory()
+        self.date_for = datetime.date(2019, 3, 1)
+        self.course_overviews = [CourseOverviewFactory() for i in range(3)]
+        MockCourseDetailsSerializer.site = self.site
+        monkeypatch.setattr(
+            course_details, 'CourseDetailsSerializer', MockCourseDetailsSerializer)
+
+    def test_load_course_details_snapshot(self):
+        course_id = self.course_overviews[0].id
+        snapshot, created = course_details.load_course_details_snapshot(
+            course_id, self.date_for)
+        assert created
+        assert snapshot.site == self.site
+        assert snapshot.data == dict(course_id=str(course_id), source='live')
+
+        snapshot2, created = course_details.load_course_details_snapshot(
+            str(course_id), datetime.date(2019, 3, 2))
+        assert not created
+        assert snapshot2.id == snapshot.id
+        assert snapshot2.date_for == datetime.date(2019, 3, 2)
+
+    def test_get_course_details_data(self):
+        for co in self.course_overviews[:2]:
+            CourseDetailsSnapshot.objects.create(
+                site=self.site,
+                course_id=str(co.id),
+                date_for=self.date_for,
+                data=dict(course_id=str(co.id), source='snapshot'))
+        with assert_num_queries(1):
+            data = course_details.get_course_details_data(self.course_overviews)
+        assert [rec['source'] for rec in data] == ['snapshot', 'snapshot', 'live']
+        assert data[0]['course_id'] == str(self.course_overviews[0].id)
@@ -0,0 +1,88 @@
+"""Tests figures.pipeline.grade_metrics_compaction
+
+"""
+
+import datetime
+import pytest
+
+from figures.models import LearnerCourseGradeMetrics
+from figures.pipeline import grade_metrics_compaction
+from figures.pipeline.grade_metrics_compaction import compact_learner_course_grades
+
+from tests.factories import LearnerCourseGradeMetricsFactory, SiteFactory, UserFactory
+
+
+COURSE_ID = 'course-v1:StarFleetAcademy+SFA01+2161'
+
+
+@pytest.mark.django_db
+class TestCompactLearnerCourseGrades(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.site = SiteFactory()
+        self.user = UserFactory()
+        self.today = datetime.date(2019, 4, 30)
+        # Daily records from 3/1 to 4/30. Sections worked change on 3/4 and 3/20
+        for day in range(61):
+            date_for = datetime.date(2019, 3, 1) + datetime.timedelta(days=day)
+            if date_for < datetime.date(2019, 3, 4):
+                sections_worked = 1
+            elif date_for < datetime.date(2019, 3, 20):
+                sections_worked = 2
+            else:
+                sections_worked = 3
+            LearnerCourseGradeMetricsFactory(
+                site=self.site,
+                user=self.user,
+                course_id=COURSE_ID,
+                date_for=date_for,
+                sections_worked=sections_worked)
+
+    def dates_kept(self, before):
+        return list(LearnerCourseGradeMetrics.objects.filter(
+            date_for__lt=before).order_by('date_for').values_list('date_for', flat=True))
+
+    def test_change_points(self):
+        deleted = compact_learner_course_grades(
+            date_for=self.today, retention_days=30, sampling='change')
+        cutoff = datetime.date(2019, 3, 31)
+        assert self.dates_kept(cutoff) == [
+            datetime.date(2019, 3, 1),
+            datetime.date(2019, 3, 4),
+            datetime.date(2019, 3, 20)]
+        assert deleted == 27
+        # Records in the retention window are kept
+        assert LearnerCourseGradeMetrics.objects.filter(date_for__gte=cutoff).count() == 31
+
+    def test_deletes_in_batches(self, monkeypatch):
+        monkeypatch.setattr(grade_metrics_compaction, 'pipeline_batch_size', lambda: 4)
+        deleted = compact_learner_course_grades(
+            date_for=self.today, retention_days=30, sampling='change')
+        assert deleted == 27
+        assert self.dates_kept(datetime.date(2019, 3, 31)) == [
+            datetime.date(2019, 3, 1),
+            datetime.date(2019, 3, 4),
+            datetime.date(2019, 3, 20)]
+
+    def test_progress_history_after_compaction(self):
+        compact_learner_course_grades(
+            date_for=self.today, retention_days=30, sampling='change')
+        for date_for, sections_worked in [(datetime.date(2019, 3, 3), 1),
+                                          (datetime.date(2019, 3, 10), 2),
+                                          (datetime.date(2019, 3, 25), 3)]:
+            objs = LearnerCourseGradeMetrics.objects.as_of(date_for, course_id=COURSE_ID)
+            assert [obj.sections_worked for obj in objs] == [sections_worked]
+
+    @pytest.mark.parametrize('sampling, expected', [
+        ('week', [datetime.date(2019, 3, day) for day in (3, 10, 17, 24, 29)]),
+        ('month', [datetime.date(2019, 3, 29)]),
+    ])
+    def test_period_sampling(self, sampling, expected):
+        compact_learner_course_grades(
+            date_for=self.today, retention_days=31, sampling=sampling)
+        assert self.dates_kept(datetime.date(2019, 3, 30)) == expected
+
+    def test_unknown_sampling(self):
+        with pytest.raises(ValueError):
+            compact_learner_course_grades(sampling='year')
@@ -8,10 +8,10 @@ import pytest
 
 from django.contrib.sites.models import Site
 
-from figures.models import LearnerCourseGradeMetrics
+from figures.models import LearnerCourseGradeMetrics, LearnerCourseGradeSnapshot
 import figures.pipeline.loaders
 
-from tests.factories import CourseEnrollmentFactory
+from tests.factories import CourseEnrollmentFactory, CourseOverviewFactory
 
 
 @pytest.mark.django_db
@@ -45,3 +45,106 @@ class TestSaveLearnerCourseGrades(object):
         assert obj.points_earned == details['points_earned']
         assert obj.sections_worked == details['sections_worked']
         assert obj.sections_possible == details['count']
+
+
+@pytest.mark.django_db
+class TestBulkSaveLearnerCourseGrades(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.site = Site.objects.first()
+        self.date_for = datetime.date(2018, 2, 2)
+        self.course_overview = CourseOverviewFactory()
+        self.course_enrollments = [CourseEnrollmentFactory(
+            course_id=self.course_overview.id) for i in range(5)]
+
+    def details(self, sections_worked):
+        return dict(
+            points_possible=10.0,
+            points_earned=5.0,
+            sections_worked=sections_worked,
+            count=20,
+            )
+
+    def test_creates_new_records(self):
+        course_grades = [(ce, self.details(3)) for ce in self.course_enrollments]
+        created, updated = figures.pipeline.loaders.bulk_save_learner_course_grades(
+            site=self.site,
+            date_for=self.date_for,
+            course_grades=course_grades,
+            batch_size=2)
+        assert (created, updated) == (5, 0)
+        assert LearnerCourseGradeMetrics.objects.filter(
+            date_for=self.date_for, sections_worked=3,
+            course_id=str(self.course_overview.id)).count() == 5
+
+    def test_updates_changed_records(self):
+        ce_changed, ce_unchanged = self.course_enrollments[:2]
+        for ce in (ce_changed, ce_unchanged):
+            figures.pipeline.loaders.save_learner_course_grades(
+                site=self.site,
+                date_for=self.date_for,
+                course_enrollment=ce,
+                course_progress_details=self.details(3))
+        course_grades = [(ce_changed, self.details(4)), (ce_unchanged, self.details(3))]
+        created, updated = figures.pipeline.loaders.bulk_save_learner_course_grades(
+            site=self.site,
+            date_for=self.date_for,
+            course_grades=course_grades)
+        assert (created, updated) == (0, 1)
+        assert LearnerCourseGradeMetrics.objects.count() == 2
+        assert LearnerCourseGradeMetrics.objects.get(
+            user=ce_changed.user).sections_worked == 4
+        assert LearnerCourseGradeMetrics.objects.get(
+            user=ce_unchanged.user).sections_worked == 3
+
+    def test_updates_snapshots(self):
+        ce_newer, ce_older = self.course_enrollments[:2]
+        figures.pipeline.loaders.save_learner_course_grades(
+            site=self.site,
+            date_for=self.date_for + datetime.timedelta(days=1),
+            course_enrollment=ce_newer,
+            course_progress_details=self.details(9))
+        course_grades = [(ce, self.details(4)) for ce in (ce_newer, ce_older)]
+        figures.pipeline.loaders.bulk_save_learner_course_grades(
+            site=self.site,
+            date_for=self.date_for,
+            course_grades=course_grades)
+
+        snapshots = LearnerCourseGradeSnapshot.objects.for_learner_courses(
+            [(ce.user_id, ce.course_id) for ce in self.course_enrollments])
+        assert len(snapshots) == 2
+        course_id = str(self.course_overview.id)
+        # A snapshot of a later date is not rolled back
+        assert snapshots[(ce_newer.user_id, course_id)].sections_worked == 9
+        assert snapshots[(ce_older.user_id, course_id)].sections_worked == 4
+        assert snapshots[(ce_older.user_id, course_id)].date_for == self.date_for
+
+    def test_skips_unchanged_grades(self):
+        ce_changed, ce_unchanged = self.course_enrollments[:2]
+        figures.pipeline.loaders.bulk_save_learner_course_grades(
+            site=self.site,
+            date_for=self.date_for,
+            course_grades=[(ce, self.details(3)) for ce in (ce_changed, ce_unchanged)])
+        next_date = self.date_for + datetime.timedelta(days=1)
+        created, updated = figures.pipeline.loaders.bulk_save_learner_course_grades(
+            site=self.site,
+            date_for=next_date,
+            course_grades=[(ce_changed, self.details(4)), (ce_unchanged, self.details(3))])
+        assert (created, updated) == (1, 0)
+        assert set(LearnerCourseGradeMetrics.objects.filter(
+            date_for=next_date).values_list('user_id', flat=True)) == set([ce_changed.user_id])
+
+        # The unchanged learner's snapshot still moves to the date
+        snapshot = LearnerCourseGradeSnapshot.objects.get(user=ce_unchanged.user)
+        assert snapshot.date_for == next_date
+        assert snapshot.sections_worked == 3
+
+        obj, created = figures.pipeline.loaders.save_learner_course_grades(
+            site=self.site,
+            date_for=next_date + datetime.timedelta(days=1),
+            course_enrollment=ce_unchanged,
+            course_progress_details=self.details(3))
+        assert not created
+        assert obj.date_for == self.date_for
+        assert LearnerCourseGradeMetrics.objects.filter(user=ce_unchanged.user).count() == 1
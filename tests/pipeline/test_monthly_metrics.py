@@ -0,0 +1,110 @@
+"""Tests the monthly rollups in figures.pipeline.monthly_metrics
+
+"""
+
+import datetime
+import pytest
+
+from figures import metrics
+from figures.models import CourseMonthlyMetrics, SiteMonthlyMetrics
+from figures.pipeline import monthly_metrics
+
+from tests.factories import (
+    CourseDailyMetricsFactory,
+    CourseOverviewFactory,
+    SiteDailyMetricsFactory,
+    SiteFactory,
+)
+from tests.helpers import assert_num_queries
+
+
+@pytest.mark.django_db
+class TestMonthlyMetrics(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.site = SiteFactory()
+        self.course_id = str(CourseOverviewFactory().id)
+        self.sdm = []
+        self.cdm = []
+        for i, date_for in enumerate([datetime.date(2019, 1, 30),
+                                      datetime.date(2019, 1, 31),
+                                      datetime.date(2019, 2, 1)]):
+            self.sdm.append(SiteDailyMetricsFactory(
+                site=self.site,
+                date_for=date_for,
+                total_user_count=10 + i,
+                total_enrollment_count=20 + i,
+                course_count=1))
+            self.cdm.append(CourseDailyMetricsFactory(
+                site=self.site,
+                date_for=date_for,
+                course_id=self.course_id,
+                enrollment_count=5 + i,
+                average_progress='0.{}0'.format(i + 1),
+                average_days_to_complete=10 * (i + 1),
+                num_learners_completed=i))
+
+    def test_update_site_monthly_metrics(self):
+        rollup, created = monthly_metrics.update_site_monthly_metrics(
+            self.site, datetime.date(2019, 1, 15))
+        assert created
+        assert rollup.month_for == datetime.date(2019, 1, 1)
+        assert rollup.total_user_count == 11
+        assert rollup.total_enrollment_count == 21
+        assert rollup.course_count == 1
+        assert rollup.course_completions == 1
+
+    def test_update_course_monthly_metrics(self):
+        rollup, created = monthly_metrics.update_course_monthly_metrics(
+            self.site, self.course_id, datetime.date(2019, 1, 31))
+        assert created
+        assert rollup.month_for == datetime.date(2019, 1, 1)
+        assert rollup.enrollment_count == 6
+        assert float(rollup.average_progress) == pytest.approx(0.15)
+        assert rollup.average_days_to_complete == pytest.approx(15.0)
+        assert rollup.num_learners_completed == 1
+
+    def test_current_month_refreshed(self):
+        monthly_metrics.update_course_monthly_metrics(
+            self.site, self.course_id, datetime.date(2019, 2, 1))
+        CourseDailyMetricsFactory(
+            site=self.site,
+            date_for=datetime.date(2019, 2, 2),
+            course_id=self.course_id,
+            enrollment_count=50)
+        rollup, created = monthly_metrics.update_course_monthly_metrics(
+            self.site, self.course_id, datetime.date(2019, 2, 2))
+        assert not created
+        assert rollup.enrollment_count == 50
+        assert CourseMonthlyMetrics.objects.count() == 1
+
+    def test_update_monthly_metrics(self):
+        monthly_metrics.update_monthly_metrics(
+            self.site, datetime.date(2019, 1, 20), datetime.date(2019, 2, 10))
+        assert set(SiteMonthlyMetrics.objects.values_list('month_for', flat=True)) == set(
+            [datetime.date(2019, 1, 1), datetime.date(2019, 2, 1)])
+        assert set(CourseMonthlyMetrics.objects.values_list(
+            'course_id', 'month_for')) == set([
+                (self.course_id, datetime.date(2019, 1, 1)),
+                (self.course_id, datetime.date(2019, 2, 1))])
+
+    @pytest.mark.parametrize('func, expected', [
+        (metrics.get_total_site_users_for_time_period, 11),
+        (metrics.get_total_enrollments_for_time_period, 21),
+        (metrics.get_total_course_completions_for_time_period, 1),
+    ])
+    def test_site_metrics_read_rollups(self, func, expected):
+        monthly_metrics.update_site_monthly_metrics(
+            self.site, datetime.date(2019, 1, 1))
+        with assert_num_queries(1):
+            assert func(site=self.site,
+                        start_date=datetime.date(2019, 1, 1),
+                        end_date=datetime.date(2019, 1, 31)) == expected
+
+    def test_partial_month_reads_daily_records(self):
+        assert metrics.get_course_enrolled_users_for_time_period(
+            site=self.site,
+            start_date=datetime.date(2019, 1, 1),
+            end_date=datetime.date(2019, 1, 30),
+            course_id=self.course_id) == 5
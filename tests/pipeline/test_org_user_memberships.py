@@ -0,0 +1,141 @@
+"""Tests figures.pipeline.org_user_memberships
+
+The mock CourseEnrollment model has no TMA course overview, so the tests
+replace ``get_enrollment_org_users`` and ``get_org_enrollments`` to read the
+org from the mock course overview
+"""
+
+import datetime
+import mock
+import pytest
+
+from django.utils.timezone import utc
+
+from figures.models import OrgUserMembership, OrgUserMembershipLoad
+from figures.pipeline import org_user_memberships
+from figures.pipeline.org_user_memberships import (
+    load_org_user_memberships,
+    prune_org_user_memberships,
+    update_org_user_memberships,
+)
+
+from tests.factories import CourseEnrollmentFactory, CourseOverviewFactory, UserFactory
+from tests.helpers import assert_num_queries
+
+
+def mock_enrollment_org_users(course_enrollments):
+    return [(ce.course_overview.org, ce.user_id) for ce in course_enrollments]
+
+
+def mock_org_enrollments(course_enrollments, org):
+    return course_enrollments.filter(course_overview__org=org)
+
+
+@pytest.mark.django_db
+class TestLoadOrgUserMemberships(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.users = [UserFactory() for _ in range(3)]
+
+    def test_creates_missing(self):
+        OrgUserMembership.objects.create(org='SFA', user=self.users[0])
+        org_users = [('SFA', user.id) for user in self.users] + [
+            ('SFA', self.users[1].id), ('Other', self.users[0].id)]
+        assert load_org_user_memberships(org_users) == 3
+        assert set(OrgUserMembership.objects.values_list('org', 'user_id')) == set(
+            [('SFA', user.id) for user in self.users] + [('Other', self.users[0].id)])
+
+    def test_batches(self, monkeypatch):
+        monkeypatch.setattr(org_user_memberships, 'pipeline_batch_size', lambda: 2)
+        org_users = [('SFA', user.id) for user in self.users]
+        assert load_org_user_memberships(iter(org_users)) == 3
+        assert load_org_user_memberships(iter(org_users)) == 0
+        assert OrgUserMembership.objects.count() == 3
+
+
+@pytest.mark.django_db
+class TestUpdateOrgUserMemberships(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db, monkeypatch):
+        monkeypatch.setattr(org_user_memberships, 'get_enrollment_org_users',
+                            mock_enrollment_org_users)
+        monkeypatch.setattr(org_user_memberships, 'get_org_enrollments',
+                            mock_org_enrollments)
+        self.course_overview = CourseOverviewFactory(org='SFA')
+        self.old_enrollment = CourseEnrollmentFactory(
+            course_overview=self.course_overview,
+            created=datetime.datetime(2019, 3, 1, tzinfo=utc))
+        self.new_enrollment = CourseEnrollmentFactory(
+            course_overview=self.course_overview)
+        self.features = {'FIGURES_HAS_MICROSITES': True}
+
+    def test_single_site(self):
+        with assert_num_queries(0):
+            assert update_org_user_memberships() == 0
+        assert not OrgUserMembership.objects.exists()
+        assert not OrgUserMembershipLoad.objects.exists()
+
+    def test_first_load_reads_all(self):
+        # Memberships added by the enrollment signals don't count as a load
+        OrgUserMembership.objects.create(org='Other', user=self.old_enrollment.user)
+        with mock.patch.dict('figures.helpers.settings.FEATURES', self.features):
+            assert update_org_user_memberships() == 2
+        # The user has no enrollment in the Other org
+        assert set(OrgUserMembership.objects.values_list('org', 'user_id')) == set(
+            [('SFA', self.old_enrollment.user_id), ('SFA', self.new_enrollment.user_id)])
+        load = OrgUserMembershipLoad.objects.get()
+        assert load.created_count == 2
+        assert load.deleted_count == 1
+
+    @pytest.mark.parametrize('loaded_until, expected', [
+        # The previous load read the enrollments up to 3/31
+        (datetime.datetime(2019, 3, 31, tzinfo=utc), 1),
+        # Enrollments created just before the high-water mark are read again
+        (datetime.datetime(2019, 3, 31, 12, 30, tzinfo=utc), 1),
+        (datetime.datetime(2019, 4, 2, tzinfo=utc), 0),
+    ])
+    def test_loads_since_previous_load(self, loaded_until, expected):
+        OrgUserMembershipLoad.objects.create(loaded_until=loaded_until)
+        self.new_enrollment.created = datetime.datetime(2019, 3, 31, 12, tzinfo=utc)
+        self.new_enrollment.save()
+        with mock.patch.dict('figures.helpers.settings.FEATURES', self.features):
+            assert update_org_user_memberships() == expected
+        assert OrgUserMembership.objects.filter(
+            org='SFA', user_id=self.new_enrollment.user_id).exists() == bool(expected)
+        assert not OrgUserMembership.objects.filter(
+            org='SFA', user_id=self.old_enrollment.user_id).exists()
+        assert OrgUserMembershipLoad.objects.first().created_count == expected
+
+
+@pytest.mark.django_db
+class TestPruneOrgUserMemberships(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db, monkeypatch):
+        monkeypatch.setattr(org_user_memberships, 'get_org_enrollments',
+                            mock_org_enrollments)
+        self.enrollment = CourseEnrollmentFactory(
+            course_overview=CourseOverviewFactory(org='SFA'))
+
+    def test_deletes_memberships_without_enrollment(self):
+        kept = OrgUserMembership.objects.create(org='SFA', user=self.enrollment.user)
+        OrgUserMembership.objects.create(org='Other', user=self.enrollment.user)
+        OrgUserMembership.objects.create(org='SFA', user=UserFactory())
+        assert prune_org_user_memberships() == 2
+        assert list(OrgUserMembership.objects.all()) == [kept]
+
+    def test_deleted_enrollment(self):
+        OrgUserMembership.objects.create(org='SFA', user=self.enrollment.user)
+        assert prune_org_user_memberships() == 0
+        self.enrollment.delete()
+        assert prune_org_user_memberships() == 1
+        assert not OrgUserMembership.objects.exists()
+
+    def test_batches(self, monkeypatch):
+        monkeypatch.setattr(org_user_memberships, 'pipeline_batch_size', lambda: 2)
+        for _ in range(3):
+            OrgUserMembership.objects.create(org='SFA', user=UserFactory())
+        with assert_num_queries(5):
+            assert prune_org_user_memberships() == 3
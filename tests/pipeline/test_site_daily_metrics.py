@@ -21,6 +21,7 @@ from figures.helpers import as_datetime, prev_day, is_multisite
 from figures.models import SiteDailyMetrics
 from figures.pipeline import site_daily_metrics as pipeline_sdm
 import figures.sites
+from figures.user_id_sets import unpack_user_ids
 
 from tests.factories import (
     CourseDailyMetricsFactory,
@@ -28,6 +29,7 @@ from tests.factories import (
     OrganizationFactory,
     OrganizationCourseFactory,
     SiteDailyMetricsFactory,
+    StudentModuleFactory,
     UserFactory,
 )
 
@@ -153,6 +155,21 @@ class TestCourseDailyMetricsPipelineFunctions(object):
             date_for=self.date_for)
         assert actual == expected
 
+    def test_load_site_daily_active_users(self):
+        users = [UserFactory() for i in range(3)]
+        for user, modified in [
+                (users[0], datetime.datetime(2018, 6, 1, 1, tzinfo=utc)),
+                (users[0], datetime.datetime(2018, 6, 1, 23, tzinfo=utc)),
+                (users[1], datetime.datetime(2018, 6, 1, 12, tzinfo=utc)),
+                (users[2], datetime.datetime(2018, 6, 2, 0, tzinfo=utc))]:
+            StudentModuleFactory(student=user, modified=modified)
+        rec, created = pipeline_sdm.load_site_daily_active_users(
+            site=self.site,
+            date_for=self.date_for)
+        assert created
+        assert rec.user_count == 2
+        assert unpack_user_ids(rec.user_ids) == sorted([users[0].id, users[1].id])
+
     @pytest.mark.parametrize('prev_day_data, expected', [
         (SDM_PREV_DAY[0], 0,),
         (SDM_PREV_DAY[1], SDM_PREV_DAY[1]['cumulative_active_user_count'],),
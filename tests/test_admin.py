@@ -10,9 +10,19 @@ import figures.admin
 
 from figures.models import (
     CourseDailyMetrics,
+    CourseDetailsSnapshot,
+    CourseMonthlyMetrics,
+    LearnerCourseGradeSnapshot,
+    OrgUserMembership,
+    OrgUserMembershipLoad,
+    SiteDailyActiveUsers,
     SiteDailyMetrics,
+    SiteMonthlyMetrics,
     LearnerCourseGradeMetrics,
+    PipelineCourseRun,
     PipelineError,
+    PipelineRun,
+    ReportJob,
     )
 
 from tests.factories import (
@@ -36,6 +46,16 @@ class TestModelAdminRepresentations(object):
             (SiteDailyMetrics, figures.admin.SiteDailyMetricsAdmin),
             (LearnerCourseGradeMetrics, figures.admin.LearnerCourseGradeMetricsAdmin),
             (PipelineError, figures.admin.PipelineErrorAdmin),
+            (PipelineRun, figures.admin.PipelineRunAdmin),
+            (PipelineCourseRun, figures.admin.PipelineCourseRunAdmin),
+            (CourseDetailsSnapshot, figures.admin.CourseDetailsSnapshotAdmin),
+            (SiteMonthlyMetrics, figures.admin.SiteMonthlyMetricsAdmin),
+            (CourseMonthlyMetrics, figures.admin.CourseMonthlyMetricsAdmin),
+            (SiteDailyActiveUsers, figures.admin.SiteDailyActiveUsersAdmin),
+            (LearnerCourseGradeSnapshot, figures.admin.LearnerCourseGradeSnapshotAdmin),
+            (OrgUserMembership, figures.admin.OrgUserMembershipAdmin),
+            (OrgUserMembershipLoad, figures.admin.OrgUserMembershipLoadAdmin),
+            (ReportJob, figures.admin.ReportJobAdmin),
         ])
     def test_course_daily_metrics_admin(self, model_class, model_admin_class):
         obj = model_admin_class(model_class, self.admin_site)
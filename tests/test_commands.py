@@ -12,4 +12,22 @@ class PopulateFiguresMetricsTest(TestCase):
         call_command('populate_figures_metrics', '--no-delay', stdout=out)
 
         self.assertEqual('', out.getvalue())
-        #self.assertIn('Expected output', out.getvalue())
\ No newline at end of file
+        #self.assertIn('Expected output', out.getvalue())
+
+class BackfillFiguresMetricsTest(TestCase):
+    def test_command_output(self):
+        out = StringIO()
+        call_command('backfill_figures_metrics', '--no-delay',
+                     '--start-date', '2019-03-01', '--end-date', '2019-03-03',
+                     stdout=out)
+
+        self.assertEqual('', out.getvalue())
+
+class CompactFiguresGradeMetricsTest(TestCase):
+    def test_command_output(self):
+        out = StringIO()
+        call_command('compact_figures_grade_metrics', '--no-delay',
+                     '--retention-days', '30', '--sampling', 'week',
+                     stdout=out)
+
+        self.assertEqual('', out.getvalue())
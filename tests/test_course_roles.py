@@ -0,0 +1,47 @@
+"""Tests the cached course staff user ids in figures.course_roles
+
+"""
+
+import pytest
+
+from django.core.cache import cache
+
+from figures.course_roles import get_excluded_user_ids
+
+from tests.factories import CourseAccessRoleFactory, CourseOverviewFactory, UserFactory
+from tests.helpers import assert_num_queries
+
+
+@pytest.mark.django_db
+class TestExcludedUserIds(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        cache.clear()
+        self.course_overview = CourseOverviewFactory()
+        self.roles = [CourseAccessRoleFactory(
+            course_id=self.course_overview.id,
+            role=role) for role in ['staff', 'instructor', 'ccx_coach']]
+        CourseAccessRoleFactory(course_id=self.course_overview.id, role='beta_testers')
+
+    def test_excluded_user_ids(self):
+        assert get_excluded_user_ids(self.course_overview.id) == frozenset(
+            role.user_id for role in self.roles)
+
+    def test_cached(self):
+        get_excluded_user_ids(self.course_overview.id)
+        with assert_num_queries(0):
+            assert get_excluded_user_ids(str(self.course_overview.id))
+
+    def test_invalidated_on_role_change(self):
+        expected = set(role.user_id for role in self.roles)
+        get_excluded_user_ids(self.course_overview.id)
+
+        new_role = CourseAccessRoleFactory(
+            course_id=self.course_overview.id, role='staff', user=UserFactory())
+        expected.add(new_role.user_id)
+        assert get_excluded_user_ids(self.course_overview.id) == expected
+
+        self.roles[0].delete()
+        expected.remove(self.roles[0].user_id)
+        assert get_excluded_user_ids(self.course_overview.id) == expected
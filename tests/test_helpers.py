@@ -16,6 +16,7 @@ from figures.helpers import (
     as_course_key,
     as_datetime,
     as_date,
+    chunks,
     days_from,
     next_day,
     prev_day,
@@ -204,3 +205,13 @@ class TestMonthIterator(object):
 
         vals = list(previous_months_iterator(month_for, months_back))
         assert vals == expected_vals
+
+
+@pytest.mark.parametrize('items, size, expected', [
+    ([], 2, []),
+    ([1, 2, 3], 2, [[1, 2], [3]]),
+    ([1, 2, 3, 4], 2, [[1, 2], [3, 4]]),
+    (iter([1, 2, 3]), 5, [[1, 2, 3]]),
+])
+def test_chunks(items, size, expected):
+    assert list(chunks(items, size)) == expected
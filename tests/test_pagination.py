@@ -1,4 +1,4 @@
-from figures.pagination import FiguresLimitOffsetPagination
+from figures.pagination import FiguresKeysetPagination, FiguresLimitOffsetPagination
 
 
 class TestFiguresLimitOffsetPagination(object):
@@ -7,3 +7,10 @@ class TestFiguresLimitOffsetPagination(object):
     '''
     def test_default_pagination_limit(self):
         assert FiguresLimitOffsetPagination.default_limit == 20
+
+
+class TestFiguresKeysetPagination(object):
+
+    def test_page_size_is_capped(self):
+        assert FiguresKeysetPagination.ordering == 'id'
+        assert FiguresKeysetPagination.page_size <= FiguresKeysetPagination.max_page_size
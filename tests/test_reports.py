@@ -0,0 +1,226 @@
+"""Tests figures.reports
+
+"""
+
+import csv
+import datetime
+import gzip
+import io
+import json
+import mock
+import pytest
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now, utc
+
+from figures import reports
+from figures.models import ReportJob
+from figures.reports import (
+    LEARNER_PROGRESS_FIELDS,
+    build_report_job,
+    csv_lines,
+    get_or_create_report_job,
+    learner_progress_rows,
+    ndjson_lines,
+    user_chunks,
+)
+from figures.sites import SiteContext
+
+from tests.factories import (
+    CourseEnrollmentFactory,
+    CourseOverviewFactory,
+    GeneratedCertificateFactory,
+    LearnerCourseGradeSnapshotFactory,
+    SiteFactory,
+    UserFactory,
+)
+
+
+@pytest.mark.django_db
+class TestLearnerProgressRows(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db, monkeypatch):
+        monkeypatch.setattr(reports, 'report_batch_size', lambda: 2)
+        self.site = SiteFactory()
+        self.course_overviews = [CourseOverviewFactory() for _ in range(2)]
+        self.users = [UserFactory(profile__name=u'L\xe9a {}'.format(i)) for i in range(5)]
+        for user in self.users:
+            for course_overview in self.course_overviews:
+                CourseEnrollmentFactory(user=user, course_overview=course_overview)
+        self.snapshot = LearnerCourseGradeSnapshotFactory(
+            site=self.site,
+            user=self.users[0],
+            course_id=str(self.course_overviews[0].id),
+            sections_worked=5,
+            sections_possible=10)
+        GeneratedCertificateFactory(
+            user=self.users[0],
+            course_id=self.course_overviews[0].id,
+            created_date=datetime.datetime(2019, 4, 1, tzinfo=utc))
+
+    def get_rows(self):
+        return list(learner_progress_rows(
+            get_user_model().objects.filter(id__in=[user.id for user in self.users]),
+            SiteContext(self.site)))
+
+    def test_user_chunks(self):
+        chunks = list(user_chunks(get_user_model().objects.all(), 2))
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+        assert [user for chunk in chunks for user in chunk] == list(
+            get_user_model().objects.order_by('id'))
+
+    def test_rows(self):
+        rows = self.get_rows()
+        assert len(rows) == len(self.users) * len(self.course_overviews)
+        assert [row['user_id'] for row in rows] == sorted(
+            [user.id for user in self.users] * len(self.course_overviews))
+        assert all(tuple(row.keys()) == LEARNER_PROGRESS_FIELDS for row in rows)
+        row = [row for row in rows if row['user_id'] == self.users[0].id and
+               row['course_id'] == str(self.course_overviews[0].id)][0]
+        assert row['name'] == self.users[0].profile.name
+        assert row['progress_percent'] == 0.5
+        assert row['sections_worked'] == 5
+        assert row['course_completed'] == '2019-04-01'
+        other = [row for row in rows if row['user_id'] == self.users[1].id][0]
+        assert other['progress_percent'] == 0.0
+        assert other['sections_worked'] is None
+        assert other['course_completed'] is None
+
+    def test_queries_per_chunk(self, monkeypatch):
+        monkeypatch.setattr(reports, 'report_batch_size', lambda: len(self.users))
+        with CaptureQueriesContext(connection) as all_users:
+            self.get_rows()
+        self.users = self.users[:2]
+        with CaptureQueriesContext(connection) as two_users:
+            self.get_rows()
+        assert len(all_users) == len(two_users)
+
+    def test_csv_lines(self):
+        lines = list(csv_lines(self.get_rows()))
+        assert len(lines) == len(self.users) * len(self.course_overviews) + 1
+        records = list(csv.DictReader(lines))
+        assert records[0]['username'] == self.users[0].username
+        assert set(rec['course_completed'] for rec in records if
+                   rec['user_id'] == str(self.users[0].id)) == set(['2019-04-01', ''])
+        assert records[-1]['course_completed'] == ''
+
+    def test_ndjson_lines(self):
+        lines = list(ndjson_lines(self.get_rows()))
+        assert all(line.endswith('\n') for line in lines)
+        records = [json.loads(line) for line in lines]
+        assert records[0]['username'] == self.users[0].username
+        assert records[0]['name'] == self.users[0].profile.name
+
+
+@pytest.mark.django_db
+class TestReportJobs(object):
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db, settings, tmpdir):
+        settings.MEDIA_ROOT = str(tmpdir)
+        self.site = SiteFactory()
+        self.date_for = datetime.date(2019, 4, 1)
+        self.course_enrollments = [CourseEnrollmentFactory() for _ in range(3)]
+
+    def get_job(self, **kwargs):
+        params = dict(
+            site=self.site,
+            org='',
+            report_type=ReportJob.LEARNER_PROGRESS,
+            filters={},
+            date_for=self.date_for)
+        params.update(kwargs)
+        return get_or_create_report_job(**params)
+
+    def test_deduplicated(self):
+        job, queued = self.get_job(filters={'is_active': 'true'})
+        assert queued
+        assert self.get_job(filters={'is_active': 'true'}) == (job, False)
+        other_jobs = [
+            self.get_job(filters={'is_active': 'false'})[0],
+            self.get_job(date_for=datetime.date(2019, 4, 2))[0],
+            self.get_job(restricted_to=self.course_enrollments[0].user)[0],
+            self.get_job(report_type=ReportJob.COURSE_DETAILS)[0],
+        ]
+        assert len(set(obj.id for obj in other_jobs + [job])) == 5
+
+    def test_build(self):
+        job, _ = self.get_job()
+        job = build_report_job(job.id)
+        assert job.status == ReportJob.SUCCEEDED
+        assert job.row_count == len(self.course_enrollments)
+        assert job.result_file.name.endswith('.csv.gz')
+        with job.result_file.storage.open(job.result_file.name, 'rb') as result_file:
+            lines = io.TextIOWrapper(gzip.GzipFile(fileobj=result_file), encoding='utf-8')
+            records = list(csv.DictReader(lines))
+        assert set(rec['username'] for rec in records) == set(
+            ce.user.username for ce in self.course_enrollments)
+        # The built report is reused
+        assert self.get_job() == (job, False)
+
+    def test_build_once(self):
+        job, _ = self.get_job()
+        build_report_job(job.id)
+        job.refresh_from_db()
+        modified = job.modified
+        assert build_report_job(job.id).modified == modified
+
+    def test_failed_job_requeued(self, monkeypatch):
+        def fail(job):
+            raise Exception('report failed')
+        monkeypatch.setattr(reports, 'write_report_file', fail)
+        job, _ = self.get_job()
+        with pytest.raises(Exception):
+            build_report_job(job.id)
+        job.refresh_from_db()
+        assert job.status == ReportJob.FAILED
+        assert job.error == 'report failed'
+        job, queued = self.get_job()
+        assert queued
+        assert job.status == ReportJob.PENDING
+
+    @pytest.mark.parametrize('status, field', [
+        (ReportJob.PENDING, 'modified'),
+        (ReportJob.STARTED, 'heartbeat_at'),
+    ])
+    @mock.patch.dict('figures.helpers.settings.FEATURES',
+                     {'FIGURES_REPORT_JOB_TIMEOUT': 600})
+    def test_lost_job_requeued(self, status, field):
+        job, _ = self.get_job()
+        ReportJob.objects.filter(id=job.id).update(**{
+            'status': status,
+            'modified': now() - datetime.timedelta(seconds=900),
+            field: now() - datetime.timedelta(seconds=300)})
+        assert self.get_job() == (job, False)
+        ReportJob.objects.filter(id=job.id).update(**{
+            field: now() - datetime.timedelta(seconds=900)})
+        job, queued = self.get_job()
+        assert queued
+        assert job.status == ReportJob.PENDING
+        assert build_report_job(job.id).status == ReportJob.SUCCEEDED
+
+    def test_heartbeat(self, monkeypatch):
+        job, _ = self.get_job()
+        heartbeats = []
+        monkeypatch.setattr(reports, 'report_job_heartbeat',
+                            lambda job: lambda: heartbeats.append(job.id))
+        build_report_job(job.id)
+        # One heartbeat per row and one for the header
+        assert heartbeats == [job.id] * (len(self.course_enrollments) + 1)
+
+    def test_heartbeat_interval(self, monkeypatch):
+        job, _ = self.get_job()
+        started_at = now() - datetime.timedelta(hours=1)
+        ReportJob.objects.filter(id=job.id).update(heartbeat_at=started_at)
+        monkeypatch.setattr(reports, 'REPORT_JOB_HEARTBEAT_INTERVAL', 60)
+        heartbeat = reports.report_job_heartbeat(job)
+        heartbeat()
+        job.refresh_from_db()
+        assert job.heartbeat_at == started_at
+        monkeypatch.setattr(reports, 'REPORT_JOB_HEARTBEAT_INTERVAL', 0)
+        heartbeat()
+        job.refresh_from_db()
+        assert job.heartbeat_at > started_at
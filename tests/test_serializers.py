@@ -9,25 +9,32 @@ from dateutil.parser import parse
 import pytest
 import pytz
 
+from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
 from django.db import models
 from django.utils.timezone import utc
 
 from student.models import CourseEnrollment
 
-from figures.models import CourseDailyMetrics, SiteDailyMetrics
+from figures.models import (
+    CourseDailyMetrics,
+    LearnerCourseGradeSnapshot,
+    SiteDailyMetrics,
+)
 from figures.serializers import (
     CourseDailyMetricsSerializer,
     CourseDetailsSerializer,
     CourseEnrollmentSerializer,
     GeneralCourseDataSerializer,
     GeneralUserDataSerializer,
+    LearnerCourseData,
     LearnerCourseDetailsSerializer,
     LearnerDetailsSerializer,
     SerializeableCountryField,
     SiteDailyMetricsSerializer,
     UserIndexSerializer,
 )
+from figures.sites import SiteContext
 
 from tests.factories import (
     CourseAccessRoleFactory,
@@ -38,6 +45,7 @@ from tests.factories import (
     SiteDailyMetricsFactory,
     UserFactory,
     )
+from tests.helpers import assert_num_queries
 
 
 class TestSerializableCountryField(object):
@@ -56,6 +64,60 @@ class TestSerializableCountryField(object):
         assert SerializeableCountryField().to_representation(value) == expected_result
 
 
+@pytest.mark.django_db
+class TestLearnerCourseData(object):
+    """Tests the LearnerDetailsSerializer reads the prefetched course data
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.site = Site.objects.first()
+        self.course_overviews = [CourseOverviewFactory() for i in range(2)]
+        self.users = [UserFactory() for i in range(3)]
+        for user in self.users:
+            for co in self.course_overviews:
+                CourseEnrollmentFactory(
+                    user=user, course_id=co.id, course_overview=co)
+                LearnerCourseGradeSnapshot.objects.create(
+                    site=self.site,
+                    user=user,
+                    course_id=str(co.id),
+                    date_for=datetime.date(2018, 1, 2),
+                    points_possible=30.0,
+                    points_earned=15.0,
+                    sections_worked=2,
+                    sections_possible=10)
+        self.certificate_date = datetime.datetime(2018, 4, 1, tzinfo=utc)
+        GeneratedCertificateFactory(
+            user=self.users[0],
+            course_id=self.course_overviews[0].id,
+            created_date=self.certificate_date)
+
+    def test_serializes_from_prefetched_data(self):
+        users = list(get_user_model().objects.filter(
+            id__in=[user.id for user in self.users]).select_related('profile'))
+        learner_course_data = LearnerCourseData.for_users(users, SiteContext(self.site))
+        serializer = LearnerDetailsSerializer(
+            users,
+            many=True,
+            context=dict(site=self.site, learner_course_data=learner_course_data))
+        with assert_num_queries(0):
+            data = serializer.data
+
+        assert len(data) == len(self.users)
+        for rec in data:
+            assert len(rec['courses']) == len(self.course_overviews)
+            for course in rec['courses']:
+                assert course['progress_data']['course_progress_details'][
+                    'sections_worked'] == 2
+        completed = dict(
+            ((rec['id'], course['course_id']), course['progress_data']['course_completed'])
+            for rec in data for course in rec['courses'])
+        course_id = str(self.course_overviews[0].id)
+        assert completed[(self.users[0].id, course_id)] == self.certificate_date
+        assert not completed[(self.users[1].id, course_id)]
+
+
 @pytest.mark.django_db
 class TestUserIndexSerializer(object):
     '''Tests the UserIndexSerializer serializer class
@@ -86,3 +86,20 @@ class TestUpdateSettings(object):
             assert self.CELERY_TASK_NAME not in settings.CELERYBEAT_SCHEDULE
 
         assert settings.ENV_TOKENS['FIGURES'] == figures_env_tokens
+
+    @pytest.mark.parametrize('figures_env_tokens, scheduled', [
+        ({}, False),
+        ({'ENABLE_GRADE_METRICS_COMPACTION': True}, True),
+    ])
+    def test_grade_metrics_compaction_schedule(self, figures_env_tokens, scheduled):
+        settings = mock.Mock(
+            WEBPACK_LOADER={},
+            CELERYBEAT_SCHEDULE={},
+            FEATURES={},
+            ENV_TOKENS={
+                'FIGURES': figures_env_tokens,
+            }
+        )
+        plugin_settings(settings)
+        assert ('figures-compact-learner-course-grades' in
+                settings.CELERYBEAT_SCHEDULE) == scheduled
@@ -27,6 +27,7 @@ import pytest
 
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
+from django.utils.timezone import now
 
 import organizations
 
@@ -35,6 +36,7 @@ from openedx.core.djangoapps.content.course_overviews.models import (
 )
 
 import figures.helpers
+from figures.models import OrgUserMembership, OrgUserMembershipLoad
 import figures.sites
 
 from tests.factories import (
@@ -45,7 +47,7 @@ from tests.factories import (
     SiteFactory,
     UserFactory,
 )
-from tests.helpers import organizations_support_sites
+from tests.helpers import assert_num_queries, organizations_support_sites
 
 
 if organizations_support_sites():
@@ -283,3 +285,152 @@ class TestOrganizationsLacksSiteSupport(object):
             # msg = 'Not supposed to have "sites" attribute'
             assert not hasattr(
                 organizations.models.Organization, 'sites'), msg
+
+
+@pytest.mark.django_db
+class TestGetOrgForCourse(object):
+    """Tests figures.sites.get_org_for_course and its org to site index
+    """
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.default_site = Site.objects.get()
+        self.site = SiteFactory(domain='sfa.example.com')
+        SiteFactory(domain='sfa01.example.com')
+        self.features = {'FIGURES_HAS_MICROSITES': True}
+
+    def test_matches_course_key_org(self):
+        with mock.patch.dict('figures.sites.settings.FEATURES', self.features):
+            figures.sites.get_org_for_course('course-v1:SFA+SFA01+2161')
+            with assert_num_queries(0):
+                assert figures.sites.get_org_for_course(
+                    'course-v1:SFA+SFA01+2161') == self.site
+                # The course number contains the other site's org
+                assert figures.sites.get_org_for_course(
+                    'course-v1:Other+SFA01+2161') == self.default_site
+
+    def test_index_refreshed_on_site_change(self):
+        with mock.patch.dict('figures.sites.settings.FEATURES', self.features):
+            course_id = 'course-v1:Other+SFA01+2161'
+            assert figures.sites.get_org_for_course(course_id) == self.default_site
+            other_site = SiteFactory(domain='other.example.com')
+            assert figures.sites.get_org_for_course(course_id) == other_site
+            other_site.delete()
+            assert figures.sites.get_org_for_course(course_id) == self.default_site
+
+    def test_invalidate_replaces_index(self):
+        # A reader holding the index while a site is saved keeps a whole index
+        figures.sites.get_org_site_index()
+        index = figures.sites._org_site_index
+        SiteFactory(domain='other.example.com')
+        assert figures.sites._org_site_index is not index
+        assert index['orgs']['sfa'] == self.site
+
+    def test_single_site(self):
+        with mock.patch.dict('figures.sites.settings.FEATURES',
+                             {'FIGURES_HAS_MICROSITES': False}):
+            figures.sites.get_org_for_course('course-v1:SFA+SFA01+2161')
+            with assert_num_queries(0):
+                assert figures.sites.get_org_for_course(
+                    'course-v1:SFA+SFA01+2161') == self.default_site
+
+
+@pytest.mark.django_db
+class TestGetUsersForOrg(object):
+    """Tests figures.sites.get_users_for_org reads the org user memberships
+    """
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        CourseOverviewFactory(org='SFA')
+        CourseOverviewFactory(org='SFA2')
+        CourseOverviewFactory(org='Other')
+        self.users = [UserFactory() for _ in range(4)]
+        for org, user in zip(['SFA', 'SFA2', 'Other'], self.users):
+            OrgUserMembership.objects.create(org=org, user=user)
+        OrgUserMembershipLoad.objects.create(loaded_until=now())
+        self.features = {'FIGURES_HAS_MICROSITES': True}
+
+    def test_org_users(self):
+        with mock.patch.dict('figures.sites.settings.FEATURES', self.features):
+            assert set(figures.sites.get_users_for_org('SFA')) == set(self.users[:2])
+            assert set(figures.sites.get_users_for_org('Other')) == set([self.users[2]])
+
+    def test_single_site(self):
+        with mock.patch.dict('figures.sites.settings.FEATURES',
+                             {'FIGURES_HAS_MICROSITES': False}):
+            assert set(figures.sites.get_users_for_org('SFA')) == set(
+                get_user_model().objects.all())
+
+
+@pytest.mark.django_db
+class TestSiteContext(object):
+    """Tests figures.sites.SiteContext memoizes the site membership data
+    """
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        self.site = SiteFactory(domain='sfa.example.com')
+        self.features = {'FIGURES_IS_MULTISITE': True}
+
+    def test_org(self):
+        assert figures.sites.SiteContext(self.site).org == 'sfa'
+        assert figures.sites.SiteContext(self.site, org='').org == ''
+
+    def test_course_keys_read_once(self):
+        with mock.patch.dict('figures.helpers.settings.FEATURES', self.features):
+            with mock.patch('figures.sites.get_course_keys_for_site',
+                            return_value=[]) as mock_course_keys:
+                site_context = figures.sites.SiteContext(self.site)
+                site_context.courses
+                site_context.course_enrollments
+                assert site_context.course_keys == []
+        mock_course_keys.assert_called_once_with(self.site)
+
+    def test_members_built_once(self):
+        OrgUserMembershipLoad.objects.create(loaded_until=now())
+        names = ['user_ids', 'users', 'org_courses', 'org_users']
+        with mock.patch.dict('figures.sites.settings.FEATURES',
+                             {'FIGURES_HAS_MICROSITES': True}):
+            site_context = figures.sites.SiteContext(self.site)
+            # Reading the user ids, then building org_users checks the table
+            # was loaded and reads the course orgs
+            with assert_num_queries(3):
+                for name in names:
+                    getattr(site_context, name)
+            with assert_num_queries(0):
+                for name in names:
+                    getattr(site_context, name)
+            # Each evaluation is one query, the member querysets are not cached
+            with assert_num_queries(2):
+                list(site_context.org_users)
+                list(site_context.org_users)
+
+    def test_user_ids_evaluated_once(self):
+        users = [UserFactory() for i in range(2)]
+        site_context = figures.sites.SiteContext(self.site)
+        with mock.patch.dict('figures.helpers.settings.FEATURES',
+                             {'FIGURES_IS_MULTISITE': False}):
+            with assert_num_queries(1):
+                assert site_context.user_ids == frozenset(user.id for user in users)
+                assert users[0].id in site_context.user_ids
+
+    def test_get_site_for_course(self):
+        course_overview = CourseOverviewFactory()
+        other_course = CourseOverviewFactory()
+        with mock.patch.dict('figures.helpers.settings.FEATURES', self.features):
+            with mock.patch('figures.sites.get_course_keys_for_site',
+                            return_value=[course_overview.id]):
+                site_context = figures.sites.SiteContext(self.site)
+                with assert_num_queries(0):
+                    assert site_context.get_site_for_course(
+                        str(course_overview.id)) == self.site
+            with mock.patch('figures.sites.get_site_for_course',
+                            return_value=None) as mock_get_site:
+                assert site_context.get_site_for_course(other_course.id) is None
+            mock_get_site.assert_called_once_with(other_course.id)
+        # Standalone mode reads the default site once
+        default_site = Site.objects.get(id=figures.sites.settings.SITE_ID)
+        site_context = figures.sites.SiteContext(self.site)
+        with mock.patch.dict('figures.helpers.settings.FEATURES',
+                             {'FIGURES_IS_MULTISITE': False}):
+            with assert_num_queries(1):
+                assert site_context.get_site_for_course(course_overview.id) == default_site
+                assert site_context.get_site_for_course(other_course.id) == default_site
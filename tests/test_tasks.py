@@ -2,16 +2,23 @@
 
 """
 
+import datetime
+import mock
 import pytest
 
+from celery.exceptions import Retry, SoftTimeLimitExceeded
 from django.core.exceptions import ValidationError
+from django.utils.timezone import now
 
 from figures.helpers import as_date
 from figures.models import (
     CourseDailyMetrics,
+    PipelineCourseRun,
     PipelineError,
+    PipelineRun,
     SiteDailyMetrics,
     )
+from figures.pipeline.checkpoints import finish_pipeline_run
 import figures.tasks
 
 from tests.factories import (
@@ -97,3 +104,171 @@ def test_populate_daily_metrics_multisite(transactional_db, monkeypatch):
         ))
 
         figures.tasks.populate_daily_metrics(date_for=date_for)
+
+
+def test_populate_daily_metrics_resume(transactional_db, monkeypatch):
+    date_for = '2019-01-02'
+    finished_site = SiteFactory(domain='alpha.domain')
+    crashed_site = SiteFactory(domain='bravo.domain')
+    failed_site = SiteFactory(domain='charlie.domain')
+    site_courses = dict((site.id, [CourseOverviewFactory() for i in range(2)])
+                        for site in [finished_site, crashed_site, failed_site])
+    # The first site finished before the crash, the second completed one course
+    # and the third finished with one course failed
+    finish_pipeline_run(
+        PipelineRun.objects.create(site=finished_site, date_for=as_date(date_for)))
+    crashed_run = PipelineRun.objects.create(site=crashed_site, date_for=as_date(date_for))
+    PipelineCourseRun.objects.create(
+        run=crashed_run,
+        course_id=str(site_courses[crashed_site.id][0].id),
+        status=PipelineCourseRun.SUCCEEDED)
+    failed_run = PipelineRun.objects.create(site=failed_site, date_for=as_date(date_for))
+    for course, status in zip(site_courses[failed_site.id],
+                              [PipelineCourseRun.SUCCEEDED, PipelineCourseRun.FAILED]):
+        PipelineCourseRun.objects.create(
+            run=failed_run, course_id=str(course.id), status=status)
+    finish_pipeline_run(failed_run)
+
+    populated = []
+    populated_sites = []
+    monkeypatch.setattr(
+        figures.sites, 'get_courses_for_site',
+        lambda site: site_courses.get(site.id, []))
+    monkeypatch.setattr(
+        figures.tasks, 'get_active_learner_counts', lambda course_ids, date_for: {})
+    monkeypatch.setattr(
+        figures.tasks, 'populate_single_cdm',
+        lambda course_id, **kwargs: populated.append(str(course_id)))
+    monkeypatch.setattr(
+        figures.tasks, 'populate_course_details_snapshot', lambda **kwargs: None)
+    monkeypatch.setattr(
+        figures.tasks, 'populate_site_daily_metrics',
+        lambda site_id, **kwargs: populated_sites.append((site_id, kwargs['force_update'])))
+
+    figures.tasks.populate_daily_metrics(date_for=date_for, resume=True)
+
+    assert populated == [str(site_courses[crashed_site.id][1].id),
+                         str(site_courses[failed_site.id][1].id)]
+    assert populated_sites == [(crashed_site.id, True), (failed_site.id, True)]
+    assert PipelineRun.objects.filter(site=finished_site).count() == 1
+    assert PipelineRun.objects.get(id=crashed_run.id).status == PipelineRun.FINISHED
+    failed_run = PipelineRun.objects.get(id=failed_run.id)
+    assert failed_run.status == PipelineRun.FINISHED
+    assert failed_run.course_runs.filter(
+        status=PipelineCourseRun.SUCCEEDED).count() == 2
+
+
+@pytest.mark.parametrize('course_ids, max_lanes, expected', [
+    ([], 2, []),
+    (['a', 'b', 'c'], 2, [['a', 'c'], ['b']]),
+    (['a', 'b'], 4, [['a'], ['b']]),
+    (['a', 'b'], 0, [['a', 'b']]),
+])
+def test_course_task_lanes(course_ids, max_lanes, expected):
+    assert figures.tasks.course_task_lanes(course_ids, max_lanes) == expected
+
+
+def test_populate_course_daily_metrics_error(transactional_db, monkeypatch):
+    """Failed course tasks are logged and do not raise so the chord completes
+    """
+    site = SiteFactory()
+    run = PipelineRun.objects.create(site=site, date_for=as_date('2019-01-02'))
+
+    def mock_pop_single_cdm_fails(**kwargs):
+        raise ValidationError(message={'message': 'expected failure'})
+
+    monkeypatch.setattr(
+        figures.tasks, 'populate_single_cdm', mock_pop_single_cdm_fails)
+    with mock.patch.dict('figures.helpers.settings.FEATURES', {
+            'FIGURES_PIPELINE_COURSE_MAX_RETRIES': 0}):
+        result = figures.tasks.populate_course_daily_metrics(
+            course_id='course-v1:certs-appsembler+001+2019',
+            run_id=run.id,
+            date_for='2019-01-02')
+    assert result is False
+    assert PipelineError.objects.filter(site=site).count() == 1
+    assert run.course_runs.get().status == PipelineCourseRun.FAILED
+
+
+def test_populate_course_daily_metrics_time_limit(transactional_db, monkeypatch):
+    """Timed out course tasks are logged and not retried
+    """
+    site = SiteFactory()
+    run = PipelineRun.objects.create(site=site, date_for=as_date('2019-01-02'))
+
+    def mock_pop_single_cdm_times_out(**kwargs):
+        raise SoftTimeLimitExceeded()
+
+    monkeypatch.setattr(
+        figures.tasks, 'populate_single_cdm', mock_pop_single_cdm_times_out)
+    result = figures.tasks.populate_course_daily_metrics(
+        course_id='course-v1:certs-appsembler+001+2019',
+        run_id=run.id,
+        date_for='2019-01-02')
+    assert result is False
+    assert PipelineError.objects.filter(site=site).count() == 1
+    assert run.course_runs.get().status == PipelineCourseRun.FAILED
+
+
+def test_populate_site_daily_metrics_callback(transactional_db, monkeypatch):
+    site = SiteFactory()
+    run = PipelineRun.objects.create(site=site, date_for=as_date('2019-01-02'))
+    calls = []
+
+    def mock_pop_sdm(site_id, **kwargs):
+        calls.append(site_id)
+
+    monkeypatch.setattr(
+        figures.tasks, 'populate_site_daily_metrics', mock_pop_sdm)
+    figures.tasks.populate_site_daily_metrics_callback(
+        [True, False], site_id=site.id, run_id=run.id, date_for='2019-01-02')
+    assert calls == [site.id]
+    assert PipelineRun.objects.get(id=run.id).status == PipelineRun.FINISHED
+
+
+class TestFinalizeSiteDailyMetrics(object):
+    """Tests the site metrics of stalled parallel runs get populated
+    """
+    @pytest.fixture(autouse=True)
+    def setup(self, transactional_db, monkeypatch):
+        self.site = SiteFactory()
+        self.run = PipelineRun.objects.create(
+            site=self.site, date_for=as_date('2019-01-02'))
+        self.calls = []
+
+        def mock_pop_sdm(site_id, **kwargs):
+            self.calls.append((site_id, kwargs.get('force_update')))
+
+        monkeypatch.setattr(
+            figures.tasks, 'populate_site_daily_metrics', mock_pop_sdm)
+
+    def finalize(self):
+        with mock.patch.dict('figures.helpers.settings.FEATURES', {
+                'FIGURES_PIPELINE_COURSE_TIME_LIMIT': 600}):
+            figures.tasks.finalize_site_daily_metrics(
+                site_id=self.site.id, run_id=self.run.id, date_for='2019-01-02')
+
+    def test_waits_for_active_run(self):
+        PipelineCourseRun.objects.create(
+            run=self.run, course_id='course-v1:SFA+SFA01+2161', started_at=now())
+        with pytest.raises(Retry):
+            self.finalize()
+        assert self.calls == []
+
+    def test_stalled_run(self):
+        PipelineRun.objects.filter(id=self.run.id).update(
+            created=now() - datetime.timedelta(hours=2))
+        self.finalize()
+        assert self.calls == [(self.site.id, None)]
+        assert PipelineRun.objects.get(id=self.run.id).status == PipelineRun.FINISHED
+
+    def test_finished_run(self):
+        finish_pipeline_run(self.run)
+        self.finalize()
+        assert self.calls == []
+
+    def test_callback_after_finalize(self):
+        finish_pipeline_run(self.run)
+        figures.tasks.populate_site_daily_metrics_callback(
+            [True], site_id=self.site.id, run_id=self.run.id, date_for='2019-01-02')
+        assert self.calls == [(self.site.id, True)]
@@ -0,0 +1,28 @@
+"""Tests the compact user id sets in figures.user_id_sets
+
+"""
+
+import pytest
+
+from figures.user_id_sets import pack_user_ids, unpack_user_ids
+
+
+@pytest.mark.parametrize('user_ids, expected', [
+    ([], []),
+    ([0], [0]),
+    ([9, 1, 8, 7], [1, 7, 8, 9]),
+    ([3, 3, 100000], [3, 100000]),
+    ([2 ** 32 - 1], [2 ** 32 - 1]),
+])
+def test_pack_unpack(user_ids, expected):
+    assert unpack_user_ids(pack_user_ids(user_ids)) == expected
+
+
+def test_unpack_empty_data():
+    assert unpack_user_ids(b'') == []
+    assert unpack_user_ids(None) == []
+
+
+def test_packed_size_independent_of_max_user_id():
+    user_ids = [10 ** 9 + i * 7 for i in range(1000)]
+    assert len(pack_user_ids(user_ids)) < 100
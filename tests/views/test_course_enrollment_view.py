@@ -80,10 +80,24 @@ class TestCourseEnrollmentViewSet(BaseViewTest):
 
         assert response.status_code == 200
         assert set(response.data.keys()) == set(
-            ['count', 'next', 'previous', 'results',])
+            ['next', 'previous', 'results',])
 
         assert len(response.data['results']) == len(expected_data)
 
         for data in response.data['results']:
             db_rec = expected_data.get(id=data['id'])
             assert parse(data['created']) == db_rec.created
+
+    def test_keyset_pages(self):
+        view = self.view_class.as_view({'get': 'list'})
+        url = self.request_path + '?page_size=3'
+        ids = []
+        while url:
+            request = APIRequestFactory().get(url)
+            force_authenticate(request, user=self.staff_user)
+            response = view(request)
+            assert response.status_code == 200
+            assert len(response.data['results']) <= 3
+            ids.extend(rec['id'] for rec in response.data['results'])
+            url = response.data['next']
+        assert ids == sorted(CourseEnrollment.objects.values_list('id', flat=True))
@@ -3,15 +3,21 @@
 '''
 
 
+import mock
 import pytest
 
+from django.core.cache import cache
+from django.contrib.sites.models import Site
+
 from rest_framework.test import (
     APIRequestFactory,
     #RequestsClient, Not supported in older  rest_framework versions
     force_authenticate,
     )
 
+from figures.site_metrics_cache import invalidate_site_metrics
 from figures.views import GeneralSiteMetricsView
+from tests.factories import SiteDailyMetricsFactory
 from tests.views.base import BaseViewTest
 
 
@@ -39,6 +45,7 @@ class TestGeneralSiteMetricsView(BaseViewTest):
     @pytest.fixture(autouse=True)
     def setup(self, db):
         super(TestGeneralSiteMetricsView, self).setup(db)
+        cache.clear()
         self.view_class.metrics_method = property(
             lambda self: mock_get_monthly_site_metrics)
 
@@ -51,3 +58,46 @@ class TestGeneralSiteMetricsView(BaseViewTest):
 
         assert response.data == mock_get_monthly_site_metrics()
 
+    def get_response(self, **extra):
+        request = APIRequestFactory().get(self.request_path, **extra)
+        force_authenticate(request, user=self.staff_user)
+        return self.view_class.as_view()(request)
+
+    def test_cached_until_site_metrics_change(self):
+        metrics_method = mock.Mock(side_effect=mock_get_monthly_site_metrics)
+        self.view_class.metrics_method = property(lambda self: metrics_method)
+        self.get_response()
+        response = self.get_response()
+        assert metrics_method.call_count == 1
+        assert response.data == mock_get_monthly_site_metrics()
+
+        SiteDailyMetricsFactory(site=Site.objects.first())
+        invalidate_site_metrics(Site.objects.first())
+        self.get_response()
+        assert metrics_method.call_count == 2
+
+    def test_conditional_get(self):
+        SiteDailyMetricsFactory(site=Site.objects.first())
+        response = self.get_response()
+        assert response['ETag']
+        assert response['Last-Modified']
+
+        response = self.get_response(HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == 304
+
+    def test_invalid_months_back(self):
+        response = self.get_response(data={'months_back': 'six'})
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize('months_back, expected', [
+        ('3', 3),
+        ('-2', 1),
+        ('0', 1),
+        ('1000', 24),
+    ])
+    def test_months_back_clamped(self, months_back, expected):
+        metrics_method = mock.Mock(side_effect=mock_get_monthly_site_metrics)
+        self.view_class.metrics_method = property(lambda self: metrics_method)
+        response = self.get_response(data={'months_back': months_back})
+        assert response.status_code == 200
+        assert metrics_method.call_args[1]['months_back'] == expected
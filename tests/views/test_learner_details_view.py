@@ -170,7 +170,7 @@ class TestLearnerDetailsViewSet(BaseViewTest):
 
         # Later, we'll elaborate on the tests. For now, some basic checks
         assert response.status_code == 200
-        assert len(response.data) == len(self.users)
+        assert len(response.data['results']) == len(self.users)
 
         User = get_user_model()
         qs = User.objects.filter(username__in=self.usernames)
@@ -178,7 +178,6 @@ class TestLearnerDetailsViewSet(BaseViewTest):
 
         # Expect the following format for pagination
         # {
-        #     "count": 2,
         #     "next": null, # or a url
         #     "previous": null, # or a url
         #     "results": [
@@ -186,7 +185,7 @@ class TestLearnerDetailsViewSet(BaseViewTest):
         #     ]
         # }
         assert set(response.data.keys()) == set(
-            ['count', 'next', 'previous', 'results',])
+            ['next', 'previous', 'results',])
 
         for rec in response.data['results']:
             # fail if we cannot find the user in the models
@@ -0,0 +1,56 @@
+'''Tests the Figures LearnerProgressExportView class
+
+'''
+
+import csv
+import json
+import pytest
+
+from rest_framework.test import (
+    APIRequestFactory,
+    force_authenticate,
+    )
+
+from figures.views import LearnerProgressExportView
+
+from tests.factories import CourseEnrollmentFactory, UserFactory
+from tests.views.base import BaseViewTest
+
+
+@pytest.mark.django_db
+class TestLearnerProgressExportView(BaseViewTest):
+    '''Tests the LearnerProgressExportView view class
+    '''
+    request_path = 'api/users/progress-export.csv'
+    view_class = LearnerProgressExportView
+    get_action = None
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db):
+        super(TestLearnerProgressExportView, self).setup(db)
+        self.course_enrollments = [
+            CourseEnrollmentFactory(user=UserFactory(username='learner{}'.format(i)))
+            for i in range(3)]
+
+    def get_response(self, export_format, **params):
+        request = APIRequestFactory().get(self.request_path, params)
+        force_authenticate(request, user=self.staff_user)
+        return self.view_class.as_view()(request, export_format=export_format)
+
+    def test_csv(self):
+        response = self.get_response('csv')
+        assert response.status_code == 200
+        assert response.streaming
+        assert response['Content-Type'] == 'text/csv'
+        assert 'attachment; filename="learner-progress-' in response['Content-Disposition']
+        lines = [line.decode('utf-8') for line in response.streaming_content]
+        records = list(csv.DictReader(lines))
+        assert set(rec['username'] for rec in records) == set(
+            ce.user.username for ce in self.course_enrollments)
+
+    def test_ndjson_filtered(self):
+        response = self.get_response('ndjson', username='learner1')
+        assert response['Content-Type'] == 'application/x-ndjson'
+        records = [json.loads(line.decode('utf-8')) for line in response.streaming_content]
+        assert [rec['course_id'] for rec in records] == [
+            str(self.course_enrollments[1].course_id)]
@@ -0,0 +1,99 @@
+'''Tests the Figures ReportJobViewSet class
+
+'''
+
+import datetime
+import gzip
+import io
+import mock
+import pytest
+
+from django.contrib.sites.models import Site
+
+from rest_framework.test import (
+    APIRequestFactory,
+    force_authenticate,
+    )
+
+from figures.models import ReportJob
+from figures.reports import build_report_job
+from figures.views import ReportJobViewSet
+
+from tests.factories import CourseEnrollmentFactory
+from tests.views.base import BaseViewTest
+
+
+@pytest.mark.django_db
+class TestReportJobViewSet(BaseViewTest):
+    '''Tests the ReportJobViewSet view class
+    '''
+    request_path = 'api/reports/'
+    view_class = ReportJobViewSet
+
+    @pytest.fixture(autouse=True)
+    def setup(self, db, settings, tmpdir):
+        super(TestReportJobViewSet, self).setup(db)
+        settings.MEDIA_ROOT = str(tmpdir)
+        self.course_enrollments = [CourseEnrollmentFactory() for _ in range(2)]
+
+    def post(self, data):
+        request = APIRequestFactory().post(self.request_path, data, format='json')
+        force_authenticate(request, user=self.staff_user)
+        # The test transaction never commits, so run the on_commit callbacks now
+        with mock.patch('figures.views.transaction.on_commit',
+                        side_effect=lambda func: func()) as mock_on_commit:
+            with mock.patch('figures.views.run_report_job') as mock_run_report_job:
+                response = self.view_class.as_view({'post': 'create'})(request)
+        assert mock_on_commit.call_count == mock_run_report_job.delay.call_count
+        return response, mock_run_report_job
+
+    def get(self, action, pk):
+        request = APIRequestFactory().get('{}{}/'.format(self.request_path, pk))
+        force_authenticate(request, user=self.staff_user)
+        return self.view_class.as_view({'get': action})(request, pk=pk)
+
+    def test_create_queues_job_once(self):
+        data = dict(report_type=ReportJob.LEARNER_PROGRESS, filters={'is_active': 'true'})
+        response, mock_run_report_job = self.post(data)
+        assert response.status_code == 202
+        assert response.data['status'] == ReportJob.PENDING
+        job = ReportJob.objects.get(id=response.data['id'])
+        assert job.site == Site.objects.first()
+        assert job.filters == {'is_active': 'true'}
+        mock_run_report_job.delay.assert_called_once_with(job.id)
+
+        response, mock_run_report_job = self.post(data)
+        assert response.data['id'] == job.id
+        assert not mock_run_report_job.delay.called
+
+    def test_invalid_report_type(self):
+        response, mock_run_report_job = self.post(dict(report_type='unknown'))
+        assert response.status_code == 400
+        assert not ReportJob.objects.exists()
+
+    def test_date_for(self):
+        data = dict(report_type=ReportJob.LEARNER_PROGRESS)
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        response, _ = self.post(dict(data, date_for=str(yesterday)))
+        assert response.status_code == 400
+        assert 'date_for' in response.data
+        response, _ = self.post(dict(data, date_for=str(datetime.date.today())))
+        assert response.status_code == 202
+        assert response.data['date_for'] == str(datetime.date.today())
+
+    def test_status_and_download(self):
+        response, _ = self.post(dict(report_type=ReportJob.LEARNER_PROGRESS))
+        job_id = response.data['id']
+        assert self.get('download', job_id).status_code == 404
+
+        build_report_job(job_id)
+        response = self.get('retrieve', job_id)
+        assert response.status_code == 200
+        assert response.data['status'] == ReportJob.SUCCEEDED
+        assert response.data['row_count'] == len(self.course_enrollments)
+
+        response = self.get('download', job_id)
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/gzip'
+        content = gzip.GzipFile(fileobj=io.BytesIO(b''.join(response.streaming_content)))
+        assert len(content.read().splitlines()) == len(self.course_enrollments) + 1